@@ -1,26 +1,24 @@
 import logging
 import streamlit as st
 
-from talkdoc_core.gptservice import GPTService
-from talkdoc_core.pdf_ops import fillPDF
-from talkdoc_core.agents import get_json_from_chat_history_agent
+from talkdoc_core import metrics
+from talkdoc_core.gptservice import get_gpt_service
+from talkdoc_core.pdf_ops import fill_pdf_bytes, load_pdf_template
+from talkdoc_core.agents import IncrementalExtractor
+from talkdoc_core.bundle import fill_bundle, get_bundle_registry
+from talkdoc_core.context import ConversationContext
+from talkdoc_core.form_registry import get_form_registry, get_prompt_store
+from talkdoc_core.greetings import LANGUAGES, get_greeting_cache, greeting_messages
+from talkdoc_core.session_memory import session_memory_report
 
-import tempfile
 from dotenv import load_dotenv
 import uuid
-import json
 import os
-import shutil
 from pathlib import Path
 from authentication import auth
 
 
-# Settings and configurations
-st.set_page_config(
-    page_title="TalkDoc", page_icon="🔥", initial_sidebar_state="expanded"
-)
-st.markdown(
-    """
+CUSTOM_CSS = """
     <style>
         .css-1jc7ptx, .e1ewe7hr3, .viewerBadge_container__1QSob,
         .styles_viewerBadge__1yB5_, .viewerBadge_link__1S137,
@@ -117,130 +115,229 @@ st.markdown(
         
 
     </style>
-""",
-    unsafe_allow_html=True,
-)
-load_dotenv(".env")
-logging.basicConfig(level=logging.INFO)
+"""
+
+
+def main():
+    # Settings and configurations
+    st.set_page_config(
+        page_title="TalkDoc", page_icon="🔥", initial_sidebar_state="expanded"
+    )
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+    load_dotenv(".env")
+    logging.basicConfig(level=logging.INFO)
+
+    # "sections" sends the outline and the current section instead of all fields
+    scoped_prompt = os.getenv("SYSTEM_PROMPT_MODE") == "sections"
+
+    form_registry = get_form_registry("form_mapping.json")
+    form_mapping = form_registry.forms()
+    # Several forms filled from one conversation, see bundle_mapping.json
+    bundle_registry = get_bundle_registry("bundle_mapping.json")
+    bundle_mapping = bundle_registry.bundles()
+    greeting_cache = get_greeting_cache()
+
+    st.session_state.pdf = False
+
+    # Authentication
+    try:
+        credentials, authenticator = auth()
+        authenticator.login()
+    except Exception as e:
+        st.error(f"Authentication failed: {e}")
+        st.stop()
+
+
+    # Main
+    if st.session_state["authentication_status"]:
+        users = credentials["usernames"]
+        st.session_state.open_ai_api_key = users[st.session_state["username"]][
+            "OPENAI_API_KEY"
+        ]
+
+        authenticator.logout(location="sidebar")
+
+        with st.sidebar:
+            st.title("TalkDOC 🔥")
+
+            valid_api_key = False
+
+            if st.session_state.open_ai_api_key:
+                gpt = get_gpt_service(st.session_state.open_ai_api_key)
+                valid_api_key = gpt.check_openai_api_key()
+
+            if valid_api_key and os.getenv("GREETING_PREGENERATE"):
+                # Opening messages of all forms and languages, generated once per process
+                forms = [form_registry.get(name) for name in form_mapping]
+                forms += [bundle_registry.get(name) for name in bundle_mapping]
+                greeting_cache.pregenerate_once(gpt, forms, LANGUAGES.values(), scoped_prompt)
+
+            selected_form = st.selectbox(
+                "Select the form to fill",
+                list(form_mapping.keys()) + list(bundle_mapping.keys()),
+                index=None,
+                placeholder="Select the form to fill",
+            )
 
-with open("form_mapping.json", "r") as file:
-    form_mapping = json.load(file)
+            logging.info(f"Selected form: {selected_form}")
 
-st.session_state.pdf = False
+            if "selected_form" not in st.session_state:
+                st.session_state.selected_form = None
 
-# Authentication
-try:
-    credentials, authenticator = auth()
-    authenticator.login()
-except Exception as e:
-    st.error(f"Authentication failed: {e}")
-    st.stop()
-
-
-# Main
-if st.session_state["authentication_status"]:
-    users = credentials["usernames"]
-    st.session_state.open_ai_api_key = users[st.session_state["username"]][
-        "OPENAI_API_KEY"
-    ]
-
-    authenticator.logout(location="sidebar")
-
-    with st.sidebar:
-        st.title("TalkDOC 🔥")
-
-        valid_api_key = False
-
-        if st.session_state.open_ai_api_key:
-            gpt = GPTService(st.session_state.open_ai_api_key)
-            valid_api_key = gpt.check_openai_api_key()
-
-        selected_form = st.selectbox(
-            "Select the form to fill",
-            form_mapping.keys(),
-            index=None,
-            placeholder="Select the form to fill",
-        )
-
-        logging.info(f"Selected form: {selected_form}")
-
-        if "selected_form" not in st.session_state:
-            st.session_state.selected_form = None
-
-        else:
-            st.session_state.selected_form = selected_form
-
-        if st.session_state.selected_form is not None:
-            st.session_state.pdf = True
-            st.session_state.seleced_form = selected_form
-            template_json_path = form_mapping[selected_form]["template_path"]
-            pdf_path = form_mapping[selected_form]["pdf_path"]
-            form_id = form_mapping[selected_form]["id"]
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                temp_pdf_path = tmp.name
-
-            shutil.copy(pdf_path, temp_pdf_path)
-
-            with open(template_json_path, "r") as template_json_file:
-                st.session_state.form_dict = json.load(template_json_file)
-
-            # rag_flag = st.toggle("Knowledge Assistant")
-            rag_flag = os.getenv("RAG_FLAG")
-            fill_pdf_button = st.button("Fill PDF")
-
-    if st.session_state.pdf and valid_api_key:
-        st.header(selected_form)
-        messages = gpt.add_system_prompt_for_chat(st.session_state.form_dict)
-        if "chat_id" not in st.session_state:
-            st.session_state.chat_id = uuid.uuid4()
-            logging.info(f"Chat ID: {st.session_state.chat_id}")
-
-        # First run - if there are no messages in the session state
-        if "messages" not in st.session_state:
-            st.session_state.messages = []
-            st.session_state.messages.append(*messages)
-            response = gpt.chat(st.session_state.messages, stream=False)
-            st.session_state.messages.append({"role": "assistant", "content": response})
-
-        # Display Message
-        for message in st.session_state.messages:
-            if message["role"] != "system":
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
-
-        # Chat input
-        if user_response := st.chat_input("Type your response here..."):
-            st.session_state.messages.append({"role": "user", "content": user_response})
-
-            with st.chat_message("user"):
-                st.markdown(user_response)
-
-            with st.chat_message("assistant"):
-                if rag_flag:
-                    logging.info("Answering using RAG")
-                    # response = get_rag_response(form_id, user_response)
-                    st.write("Knowledge Assistant is not implemented yet")
-                else:
-                    response = gpt.chat(st.session_state.messages)
-                    response = st.write_stream(response)
+            else:
+                st.session_state.selected_form = selected_form
 
-                st.session_state.messages.append(
+            if st.session_state.selected_form is not None:
+                st.session_state.pdf = True
+                st.session_state.seleced_form = selected_form
+                is_bundle = selected_form in bundle_mapping
+                if is_bundle:
+                    form = bundle_registry.get(selected_form)
+                else:
+                    form = form_registry.get(selected_form)
+                    pdf_path = form.pdf_path
+                form_id = form.form_id
+
+                # Shared read-only view, parsed once per process
+                st.session_state.form_dict = form.template
+
+                language = LANGUAGES[st.selectbox("Language", LANGUAGES.keys())]
+
+                # rag_flag = st.toggle("Knowledge Assistant")
+                rag_flag = os.getenv("RAG_FLAG")
+                fill_pdf_button = st.button("Fill PDF")
+
+        if st.session_state.pdf and valid_api_key:
+            st.header(selected_form)
+            if "chat_id" not in st.session_state:
+                st.session_state.chat_id = uuid.uuid4()
+                logging.info(f"Chat ID: {st.session_state.chat_id}")
+
+            # Messages, extracted values and context belong to one form and
+            # language, switching either starts a new conversation
+            chat_key = (form_id, language)
+            if st.session_state.get("chat_key") != chat_key:
+                st.session_state.chat_key = chat_key
+                for key in ("messages", "extractor"):
+                    st.session_state.pop(key, None)
+                if "context" in st.session_state:
+                    # Drops the summary of the previous form's answers
+                    st.session_state.context.reset()
+
+            # First run - if there are no messages in the session state
+            greeting_streamed = False
+            if "messages" not in st.session_state:
+                messages = form.system_messages(language=language, scoped=scoped_prompt)
+                response = greeting_cache.get(form, language, scoped_prompt)
+                if response is None:
+                    # The same messages as a pre-generated greeting
+                    with st.chat_message("assistant"):
+                        response = st.write_stream(
+                            gpt.chat(greeting_messages(form, language, scoped_prompt))
+                        )
+                    greeting_cache.put(form, response, language, scoped_prompt)
+                    greeting_streamed = True
+                st.session_state.messages = messages + [
                     {"role": "assistant", "content": response}
-                )
-
-        if fill_pdf_button:
-            response = get_json_from_chat_history_agent(
-                gpt, st.session_state.messages, st.session_state.form_dict
-            )
+                ]
+
+            if "extractor" not in st.session_state:
+                # Shares the template, compact fields and rules of the form
+                st.session_state.extractor = IncrementalExtractor.for_form(form)
+
+            if "context" not in st.session_state:
+                st.session_state.context = ConversationContext()
+
+            # Display Message, a greeting streamed in this run is already shown
+            shown_messages = st.session_state.messages[: -1 if greeting_streamed else None]
+            for message in shown_messages:
+                if message["role"] != "system":
+                    with st.chat_message(message["role"]):
+                        st.markdown(message["content"])
+
+            # Chat input
+            if user_response := st.chat_input("Type your response here..."):
+                st.session_state.messages.append({"role": "user", "content": user_response})
+
+                with st.chat_message("user"):
+                    st.markdown(user_response)
+
+                with st.chat_message("assistant"):
+                    if rag_flag:
+                        logging.info("Answering using RAG")
+                        # response = get_rag_response(form_id, user_response)
+                        st.write("Knowledge Assistant is not implemented yet")
+                    else:
+                        # Recent turns verbatim, older ones as a summary
+                        context = st.session_state.context.build(
+                            st.session_state.messages, gpt
+                        )
+                        if scoped_prompt:
+                            # Last, so the system prompt and history stay a cacheable prefix
+                            context.append(
+                                form.sections.message(st.session_state.extractor.snapshot())
+                            )
+                        response = gpt.chat(context)
+                        response = st.write_stream(response)
+
+                    st.session_state.messages.append(
+                        {"role": "assistant", "content": response}
+                    )
 
-            filled_pdf = fillPDF(temp_pdf_path, st.session_state.form_dict, response)
+                # Keep the extracted field values current without blocking the chat
+                st.session_state.extractor.update_in_background(
+                    gpt, st.session_state.messages
+                )
 
-            if filled_pdf:
-                with open(temp_pdf_path, "rb") as file:
+            if fill_pdf_button:
+                # Values are extracted per turn, only not yet processed turns remain
+                st.session_state.extractor.update(gpt, st.session_state.messages)
+                response = st.session_state.extractor.snapshot()
+
+                try:
+                    if is_bundle:
+                        # All forms of the bundle in parallel, as one zip
+                        filled_pdf = fill_bundle(form, response)
+                    else:
+                        filled_pdf = fill_pdf_bytes(load_pdf_template(pdf_path), response)
+                except Exception as e:
+                    logging.error(f"Error filling PDF: {e}")
+                    filled_pdf = None
+
+                if filled_pdf:
                     st.download_button(
-                        data=file,
-                        label="Download PDF",
-                        file_name=f"filled_{form_id}.pdf",
-                        mime="application/octet-stream",
+                        data=filled_pdf,
+                        label="Download PDFs" if is_bundle else "Download PDF",
+                        file_name=f"filled_{form_id}.zip" if is_bundle else f"filled_{form_id}.pdf",
+                        mime="application/zip" if is_bundle else "application/octet-stream",
                     )
+
+            if os.getenv("SESSION_MEMORY_REPORT"):
+                # Own bytes of this session next to the data shared by all sessions
+                state = {key: st.session_state[key] for key in st.session_state}
+                # The answers as a locked copy, an update may be running
+                state["extractor"] = state["extractor"].snapshot()
+                report = session_memory_report(
+                    state,
+                    (form, get_prompt_store(), greeting_cache.get(form, language, scoped_prompt)),
+                )
+                logging.info(f"Chat {st.session_state.chat_id}: {report.format()}")
+                st.sidebar.caption(report.format())
+
+
+# Measures the duration of this script run, also one ended by st.stop() or an error
+rerun_span = metrics.span("chat_rerun")
+try:
+    main()
+except Exception as e:
+    rerun_span.set(error=type(e).__name__)
+    raise
+finally:
+    # st.stop() and st.rerun() raise BaseException subclasses, they end here without an error label
+    rerun_span.end()
+    if os.getenv("TALKDOC_METRICS_PROM"):
+        # An export failure must not replace the result of the run
+        try:
+            metrics.write_prometheus(os.getenv("TALKDOC_METRICS_PROM"))
+        except Exception as e:
+            logging.warning(f"Cannot write the Prometheus metrics: {e}")
@@ -0,0 +1,228 @@
+"""
+Benchmark suite over all forms in form_mapping.json.
+
+Times field extraction, loading the template (JSON and compiled artifact),
+filling (fillPDF from disk and fill_pdf_bytes with
+the cached template, rewritten, as incremental update and flattened),
+filter_json_fields, prompt construction and parsing of a model answer, each
+with a synthetic response that answers every field.
+Results are written as JSON and can be compared against a stored baseline:
+
+    python scripts/benchmark.py --out bench.json
+    python scripts/benchmark.py --baseline scripts/benchmark_baseline.json
+    python scripts/benchmark.py --save-baseline scripts/benchmark_baseline.json
+
+With --baseline the exit code is 1 if a benchmark got slower than the
+baseline by more than --tolerance (default 0.25, i.e. 25%).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import pypdf
+
+from talkdoc_core.agents import validate_extracted_json
+from talkdoc_core.field_rules import RuleExtractor
+from talkdoc_core.pdf_ops import (
+    extract_fields_from_form,
+    fill_pdf_bytes,
+    fillPDF,
+    load_pdf_template,
+)
+from talkdoc_core.prompts import (
+    CompactFields,
+    filter_json_fields,
+    get_chat_history_to_json_prompt,
+    get_system_prompt_body,
+)
+from talkdoc_core.sections import FormSections
+from talkdoc_core.template_model import FormTemplate
+
+# Shortest sample, sub-millisecond benchmarks are looped up to this
+MIN_SAMPLE_SECONDS = 0.05
+
+logging.disable(logging.INFO)
+logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+MESSAGES = [
+    {"role": "system", "content": "system"},
+    {"role": "assistant", "content": "Wie lautet Ihr Vorname?"},
+    {"role": "user", "content": "Max"},
+    {"role": "assistant", "content": "Danke"},
+]
+
+
+def synthetic_response(template):
+    """Answers every field, "Ja" for buttons and "Test" for text fields."""
+    return {
+        k: ("Ja" if v.get("type") == "/Btn" else "Test") for k, v in template.items()
+    }
+
+
+def measure(fn, repeat):
+    """
+    Times repeat samples of fn, a sample calls fast functions in a loop of at
+    least MIN_SAMPLE_SECONDS (like timeit), the results are per call.
+    """
+    start = perf_counter()
+    fn()
+    first = perf_counter() - start
+    number = max(1, int(MIN_SAMPLE_SECONDS / first)) if first > 0 else 1
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((perf_counter() - start) / number)
+    return {"median": median(timings), "min": min(timings), "runs": repeat, "number": number}
+
+
+def form_benchmarks(form, workdir):
+    """Returns {name: fn} for one form."""
+    with open(form["template_path"], "rb") as file:
+        raw = file.read()
+    template = json.loads(raw)
+    compiled = FormTemplate.from_json(template).to_bytes()
+    pdf_path = form["pdf_path"]
+    response = synthetic_response(template)
+    compact = CompactFields(template)
+    sections = FormSections(template)
+    answer = json.dumps(compact.encode_values(response), ensure_ascii=False)
+    fill_path = Path(workdir) / Path(pdf_path).name
+
+    def fill_from_disk():
+        shutil.copy(pdf_path, fill_path)
+        # fillPDF prints every field it fills
+        with contextlib.redirect_stdout(io.StringIO()):
+            filled = fillPDF(fill_path, template, response, incremental=False)
+        if not filled:
+            raise RuntimeError(f"fillPDF failed for {pdf_path}")
+
+    def parse_answer():
+        validate_extracted_json(compact.decode(json.loads(answer)), template)
+
+    return {
+        "extract": lambda: extract_fields_from_form(
+            pdf_path, output_path=Path(workdir) / "fields.json"
+        ),
+        "template_load": lambda: FormTemplate.from_json(json.loads(raw)),
+        "template_load_compiled": lambda: FormTemplate.from_bytes(compiled),
+        "fill": fill_from_disk,
+        "fill_cached_template": lambda: fill_pdf_bytes(
+            load_pdf_template(pdf_path), response, incremental=False
+        ),
+        "fill_incremental": lambda: fill_pdf_bytes(
+            load_pdf_template(pdf_path), response, incremental=True
+        ),
+        "fill_flatten": lambda: fill_pdf_bytes(
+            load_pdf_template(pdf_path), response, flatten=True
+        ),
+        "filter_json_fields": lambda: filter_json_fields(template),
+        "compact_fields": lambda: CompactFields(template),
+        "system_prompt": lambda: get_system_prompt_body(template),
+        "section_prompt": lambda: sections.prompt(response),
+        "extraction_prompt": lambda: get_chat_history_to_json_prompt(
+            MESSAGES, CompactFields(template)
+        ),
+        "parse_answer": parse_answer,
+        "rule_extract": lambda: RuleExtractor(template).extract(MESSAGES),
+    }
+
+
+def run(mapping_path="form_mapping.json", repeat=5, forms=None, only=None):
+    with open(mapping_path, "r", encoding="utf-8") as file:
+        mapping = json.load(file)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for form in mapping.values():
+            if forms and form["id"] not in forms:
+                continue
+            for name, fn in form_benchmarks(form, workdir).items():
+                if only and name not in only:
+                    continue
+                # Warm-up run, fills the template cache like the app does
+                fn()
+                results[f"{form['id']}/{name}"] = measure(fn, repeat)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pypdf": pypdf.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=0.25):
+    """Returns one row per benchmark present in both, regressed if slower than baseline * (1 + tolerance)."""
+    rows = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else 1.0
+        rows.append(
+            {
+                "name": name,
+                "baseline": base["median"],
+                "current": result["median"],
+                "ratio": ratio,
+                "regressed": ratio > 1 + tolerance,
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mapping", default="form_mapping.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--forms", nargs="*", help="form ids, default all")
+    parser.add_argument("--only", nargs="*", help="benchmark names, default all")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    report = run(args.mapping, args.repeat, args.forms, args.only)
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=4)
+
+    if not args.baseline:
+        print(f"{'benchmark':<46} {'median':>10} {'min':>10}")
+        for name, result in report["results"].items():
+            print(f"{name:<46} {result['median'] * 1000:>8.2f}ms {result['min'] * 1000:>8.2f}ms")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    rows = compare(report, baseline, args.tolerance)
+    print(f"{'benchmark':<46} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(
+            f"{row['name']:<46} {row['baseline'] * 1000:>8.2f}ms "
+            f"{row['current'] * 1000:>8.2f}ms {row['ratio']:>6.2f}x{flag}"
+        )
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Compares the per-field fill path (one update_page_form_field_values call per
+response key) with the compiled fill plan on every form in form_mapping.json.
+
+    python scripts/benchmark_fill.py --repeat 5
+"""
+
+import argparse
+import json
+import logging
+from io import BytesIO
+from statistics import median
+from time import perf_counter
+
+from pypdf import PdfReader, PdfWriter
+
+from talkdoc_core.pdf_ops import get_fill_plan
+
+logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+
+def synthetic_response(source_json):
+    return {
+        k: ("Ja" if v.get("type") == "/Btn" else "Test") for k, v in source_json.items()
+    }
+
+
+def comparable_response(response, source_json, plan):
+    # The per-field path needs hidden_fields for buttons and crashes on text
+    # fields drawn with checkbox appearances, leave those out of the comparison
+    return {
+        k: v
+        for k, v in response.items()
+        if (source_json[k].get("type") == "/Tx" and not plan.fields[k].widgets[0].states)
+        or (source_json[k].get("type") == "/Btn" and "hidden_fields" in source_json[k])
+    }
+
+
+def fill_per_field(pdf_path, source_json, response):
+    # The fillPDF implementation before the fill plan, kept here as the baseline
+    writer = PdfWriter()
+    writer.append(PdfReader(pdf_path))
+
+    start = perf_counter()
+    for k, v in response.items():
+        page_num = source_json[k]["page"]
+        if source_json[k].get("type") == "/Tx":
+            value = v
+        elif source_json[k].get("type") == "/Btn":
+            if v.strip().lower() in ("ja", "yes"):
+                if source_json[k]["hidden_fields"].get("FF") != 49152:
+                    value = source_json[k]["hidden_fields"].get("on_state")
+                else:
+                    value = "/0"
+            else:
+                if source_json[k]["hidden_fields"].get("FF") != 49152:
+                    value = source_json[k]["hidden_fields"].get("off_state")
+                else:
+                    value = "/1"
+
+        writer.update_page_form_field_values(
+            writer.pages[page_num], {k: value}, auto_regenerate=False
+        )
+    fill_time = perf_counter() - start
+
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue(), fill_time
+
+
+def fill_with_plan(pdf_path, source_json, response):
+    plan = get_fill_plan(pdf_path)
+    writer = PdfWriter()
+    writer.append(PdfReader(pdf_path))
+
+    start = perf_counter()
+    plan.apply(writer, response)
+    fill_time = perf_counter() - start
+
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue(), fill_time
+
+
+def field_values(pdf_bytes):
+    fields = PdfReader(BytesIO(pdf_bytes)).get_fields() or {}
+    return {k: str(v.get("/V")) for k, v in fields.items()}
+
+
+def timed(fn, repeat, *args):
+    """Returns the last output with the median fill step and end-to-end times."""
+    fill_timings, total_timings = [], []
+    output = None
+    for _ in range(repeat):
+        start = perf_counter()
+        output, fill_time = fn(*args)
+        total_timings.append(perf_counter() - start)
+        fill_timings.append(fill_time)
+    return output, median(fill_timings), median(total_timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mapping", default="form_mapping.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.mapping, "r", encoding="utf-8") as file:
+        form_mapping = json.load(file)
+
+    print("Fill step = updating the field values, total = parse + fill + write")
+    print(
+        f"{'form':<24} {'fields':>6} {'per-field fill':>15} {'plan fill':>10} "
+        f"{'speedup':>8} {'per-field total':>16} {'plan total':>11}  same output"
+    )
+    for form in form_mapping.values():
+        with open(form["template_path"], "r", encoding="utf-8") as file:
+            source_json = json.load(file)
+        pdf_path = form["pdf_path"]
+        plan = get_fill_plan(pdf_path)  # compiled once, like the app does
+
+        response = comparable_response(synthetic_response(source_json), source_json, plan)
+        planned, plan_fill, plan_total = timed(
+            fill_with_plan, args.repeat, pdf_path, source_json, response
+        )
+        legacy, legacy_fill, legacy_total = timed(
+            fill_per_field, args.repeat, pdf_path, source_json, response
+        )
+        same = field_values(legacy) == field_values(planned)
+
+        print(
+            f"{form['id'][:24]:<24} {len(response):>6} {legacy_fill:>14.4f}s "
+            f"{plan_fill:>9.4f}s {legacy_fill / plan_fill:>7.1f}x "
+            f"{legacy_total:>15.3f}s {plan_total:>10.3f}s  {same}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Token counts of the prompts per form for the original JSON field encoding
+and the compact field list (talkdoc_core.prompts.CompactFields).
+
+    python scripts/prompt_tokens.py
+    python scripts/prompt_tokens.py --json
+
+Counts use tiktoken (o200k_base, the gpt-4.1 tokenizer) when it is installed,
+otherwise they are estimated as characters / 4 and marked with "~".
+"""
+
+import argparse
+import json
+import logging
+
+from talkdoc_core.prompts import (
+    CompactFields,
+    format_fields,
+    get_chat_history_to_json_prompt,
+    get_system_prompt_body,
+)
+
+logging.disable(logging.INFO)
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text):
+        return len(_encoding.encode(text))
+
+    ESTIMATED = False
+except ImportError:
+
+    def count_tokens(text):
+        return round(len(text) / 4)
+
+    ESTIMATED = True
+
+
+MESSAGES = [
+    {"role": "system", "content": ""},
+    {"role": "assistant", "content": ""},
+]
+
+
+def prompt_tokens(name, template):
+    compact = CompactFields(template)
+    prompts = {
+        "fields": (format_fields(template), compact.text),
+        "system_prompt": (
+            get_system_prompt_body(template, "json"),
+            get_system_prompt_body(compact),
+        ),
+        "extraction_prompt": (
+            get_chat_history_to_json_prompt(MESSAGES, template),
+            get_chat_history_to_json_prompt(MESSAGES, compact),
+        ),
+    }
+
+    rows = []
+    for prompt, (json_text, compact_text) in prompts.items():
+        json_tokens = count_tokens(str(json_text))
+        compact_tokens = count_tokens(compact_text)
+        rows.append(
+            {
+                "form": name,
+                "prompt": prompt,
+                "fields": len(template),
+                "json": json_tokens,
+                "compact": compact_tokens,
+                "saved": round(1 - compact_tokens / json_tokens, 3),
+                "estimated": ESTIMATED,
+            }
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mapping", default="form_mapping.json")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.mapping, "r", encoding="utf-8") as file:
+        mapping = json.load(file)
+
+    rows = []
+    for name, form in mapping.items():
+        with open(form["template_path"], "r", encoding="utf-8") as file:
+            rows += prompt_tokens(form["id"], json.load(file))
+
+    if args.json:
+        print(json.dumps(rows, indent=4))
+        return
+
+    mark = "~" if ESTIMATED else ""
+    print(f"{'form':<26} {'prompt':<18} {'fields':>6} {'json':>9} {'compact':>9} {'saved':>6}")
+    for row in rows:
+        print(
+            f"{row['form']:<26} {row['prompt']:<18} {row['fields']:>6} "
+            f"{mark + str(row['json']):>9} {mark + str(row['compact']):>9} {row['saved']:>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
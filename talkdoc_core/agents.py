@@ -1,24 +1,274 @@
-from talkdoc_core.prompts import get_chat_history_to_json_prompt
+from talkdoc_core.context import ConversationContext
+from talkdoc_core.field_rules import RuleExtractor
+from talkdoc_core.prompts import (
+    CompactFields,
+    get_chat_history_to_json_prompt,
+    get_incremental_extraction_prompt,
+)
+from talkdoc_core.template_model import as_template
 
 import json
 import logging
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
 logging.basicConfig(level=logging.INFO)
 
+# Shared by all sessions for extraction work that must not block a chat turn
+_background_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def pre_extract(messages_history, json_fields):
+    """
+    Resolves the structured fields (dates, IBAN, PLZ, phone, yes/no) locally,
+    returns the resolved values and the fields left for the model.
+
+    Only fields resolved from a turn that holds nothing but the value leave
+    the model's field list, the model may still correct the others (see
+    merge_resolved).
+    """
+    json_fields = as_template(json_fields)
+    resolved, consumed, turns = RuleExtractor(json_fields).extract(
+        messages_history, with_turns=True
+    )
+    final = {name for name, turn in turns.items() if turn in consumed}
+    remaining = {k: v for k, v in json_fields.items() if k not in final}
+    if resolved:
+        logging.info(f"Resolved {len(resolved)} fields without the model: {resolved}")
+    return resolved, remaining
+
+
+def merge_resolved(json_res, resolved):
+    """Adds the rule values to a model answer, non-empty values of the model win."""
+    for k, v in resolved.items():
+        if not json_res.get(k):
+            json_res[k] = v
+    return json_res
+
 
 def get_json_from_chat_history_agent(gpt, messages_history, orig_parsed_json_fields):
 
     time_start = time()
-    instructions = get_chat_history_to_json_prompt(
-        messages_history, orig_parsed_json_fields
-    )
+    resolved, remaining = pre_extract(messages_history, orig_parsed_json_fields)
+    json_res = {}
+    if remaining:
+        fields = CompactFields(remaining)
+        instructions = get_chat_history_to_json_prompt(messages_history, fields)
 
-    messages = gpt.add_user_prompt([], instructions)
+        messages = gpt.add_user_prompt([], instructions)
 
-    json_res = gpt.chat(messages, stream=False, json_mode=True)
-    json_res = json.loads(json_res)
+        json_res = gpt.chat(messages, stream=False, json_mode=True)
+        json_res = fields.decode(json.loads(json_res))
+    merge_resolved(json_res, resolved)
     logging.info(json_res)
     logging.info(f"Processing time for get_json_from_chat_history_agent: {time() - time_start} seconds")
     return json_res
+
+
+def shard_fields(json_fields, max_fields_per_shard=None):
+    """Splits the template fields by page, pages larger than max_fields_per_shard are split further."""
+    json_fields = as_template(json_fields)
+    pages = {}
+    for key, field in json_fields.items():
+        pages.setdefault(field.page, []).append(key)
+
+    shards = []
+    for page in sorted(pages):
+        keys = pages[page]
+        size = max_fields_per_shard or len(keys)
+        for i in range(0, len(keys), size):
+            shards.append({k: json_fields[k] for k in keys[i : i + size]})
+    return shards
+
+
+def validate_extracted_json(json_res, json_fields):
+    """Keeps only known template keys as strings, missing keys are set to ""."""
+    unknown = [k for k in json_res if k not in json_fields]
+    if unknown:
+        logging.warning(f"Dropping keys not in the template: {unknown}")
+
+    return {
+        k: "" if json_res.get(k) is None else str(json_res[k]) for k in json_fields
+    }
+
+
+def _extract_shard(gpt, messages_history, fields):
+    time_start = time()
+    compact_fields = CompactFields(fields)
+    instructions = get_chat_history_to_json_prompt(messages_history, compact_fields)
+    messages = gpt.add_user_prompt([], instructions)
+    json_res = json.loads(gpt.chat(messages, stream=False, json_mode=True))
+    json_res = compact_fields.decode(json_res)
+    return validate_extracted_json(json_res, fields), time() - time_start
+
+
+def get_json_from_chat_history_sharded(
+    gpt,
+    messages_history,
+    orig_parsed_json_fields,
+    max_fields_per_shard=None,
+    max_workers=8,
+):
+    """
+    Same result as get_json_from_chat_history_agent, but the fields are split
+    into one shard per page (or smaller, see shard_fields) and the shards are
+    extracted concurrently. Returns the merged JSON and per-shard stats.
+    """
+    time_start = time()
+    resolved, remaining = pre_extract(messages_history, orig_parsed_json_fields)
+    shards = shard_fields(remaining, max_fields_per_shard)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as executor:
+        futures = [
+            executor.submit(_extract_shard, gpt, messages_history, shard)
+            for shard in shards
+        ]
+        results = [future.result() for future in futures]
+
+    json_res = validate_extracted_json({}, orig_parsed_json_fields)
+    shard_stats = []
+    for shard, (shard_json, seconds) in zip(shards, results):
+        json_res.update(shard_json)
+        shard_stats.append(
+            {
+                "pages": sorted({field.page for field in shard.values()}),
+                "fields": len(shard),
+                "seconds": seconds,
+            }
+        )
+    merge_resolved(json_res, resolved)
+
+    logging.info(json_res)
+    logging.info(
+        f"Processing time for get_json_from_chat_history_sharded: {time() - time_start} seconds "
+        f"({len(shards)} shards, slowest {max((s['seconds'] for s in shard_stats), default=0)} seconds)"
+    )
+    return json_res, shard_stats
+
+
+class IncrementalExtractor:
+    """
+    Keeps the field -> value state of one conversation up to date.
+
+    Each update only sends the messages added since the previous update
+    (plus the last already seen message for context) together with the
+    current state, corrections from the model overwrite earlier values.
+    Structured answers are resolved locally first (see field_rules), if that
+    covers every new user turn the model is not called at all.
+
+    values holds the answered fields only. for_form shares the template,
+    the compact fields and the rules of a registry entry, so a session adds
+    nothing but its answers. Readers on other threads than the update use
+    snapshot, update_in_background changes values on a worker thread.
+    """
+
+    def __init__(self, json_fields, compact_fields=None, rules=None):
+        self.json_fields = json_fields = as_template(json_fields)
+        self.compact_fields = (
+            CompactFields(json_fields) if compact_fields is None else compact_fields
+        )
+        self.rules = RuleExtractor(json_fields) if rules is None else rules
+        self.values = {}
+        # Number of messages of the conversation already processed, the
+        # leading system messages count as processed (see pending_messages)
+        self.processed = 0
+        # _lock serializes the updates (held during the model call),
+        # _values_lock only guards the writes to values against snapshot
+        self._lock = threading.Lock()
+        self._values_lock = threading.Lock()
+
+    @classmethod
+    def for_form(cls, form):
+        """Extractor on the shared data of a FormEntry or FormBundle."""
+        return cls(form.template, form.sections.compact, form.rules)
+
+    def snapshot(self):
+        """Copy of the current values, safe to read while an update runs."""
+        with self._values_lock:
+            return dict(self.values)
+
+    def _start(self, messages):
+        # Index of the first message to send, after the system messages (one
+        # more with a selected language) and with the last processed message as context
+        system = len(ConversationContext.split(messages)[0])
+        return max(system, self.processed - 1)
+
+    def pending_messages(self, messages):
+        return messages[self._start(messages) :]
+
+    def update(self, gpt, messages):
+        """Processes the new messages, returns the fields that changed."""
+        messages = list(messages)
+        with self._lock:
+            start = self._start(messages)
+            new_messages = messages[start:]
+            if len(messages) <= max(start, self.processed) or not any(
+                m["role"] == "user" for m in new_messages
+            ):
+                self.processed = max(self.processed, len(messages))
+                return {}
+
+            time_start = time()
+            resolved, consumed = self.rules.extract(new_messages, self.values)
+            # Index of the first not yet processed message in new_messages
+            first_new = max(0, self.processed - start)
+            user_turns = {
+                i
+                for i, m in enumerate(new_messages)
+                if m["role"] == "user" and i >= first_new
+            }
+
+            json_res = dict(resolved)
+            if not user_turns <= consumed:
+                values = {**self.values, **resolved}
+                instructions = get_incremental_extraction_prompt(
+                    new_messages, self.compact_fields, values
+                )
+                json_res = merge_resolved(
+                    self.compact_fields.decode(
+                        json.loads(
+                            gpt.chat(
+                                gpt.add_user_prompt([], instructions),
+                                stream=False,
+                                json_mode=True,
+                            )
+                        )
+                    ),
+                    resolved,
+                )
+
+            changed = {}
+            for k, v in json_res.items():
+                if k not in self.json_fields:
+                    logging.warning(f"Dropping key not in the template: {k}")
+                    continue
+                v = "" if v is None else str(v)
+                if self.values.get(k, "") != v:
+                    changed[k] = v
+            with self._values_lock:
+                for k, v in changed.items():
+                    # A withdrawn answer leaves the state
+                    if v:
+                        self.values[k] = v
+                    else:
+                        self.values.pop(k, None)
+            self.processed = len(messages)
+
+            logging.info(
+                f"Incremental extraction of {len(new_messages)} messages: "
+                f"{changed} in {time() - time_start} seconds"
+            )
+            return changed
+
+    def update_in_background(self, gpt, messages):
+        """Schedules update on a shared worker thread and returns the future."""
+        future = _background_executor.submit(self.update, gpt, list(messages))
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            logging.error(f"Incremental extraction failed: {future.exception()}")
@@ -0,0 +1,243 @@
+"""
+Bulk filling of one template with many responses.
+
+    python -m talkdoc_core.batch buergergeld responses/ --out filled.zip
+    python -m talkdoc_core.batch anek responses.jsonl --out filled/ --workers 4
+
+Responses are either a directory of *.json files (one response per file,
+the file stem names the output) or a JSONL file with one response per line.
+A JSONL line is either the response itself or {"id": ..., "response": {...}}.
+A record that is not valid JSON is reported as failed, the others are still
+filled. Output names are reduced to safe file names, repeated names get a
+numeric suffix.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import zipfile
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+from talkdoc_core.form_registry import get_form_registry
+from talkdoc_core.pdf_ops import fill_pdf_bytes, load_pdf_template
+
+logging.basicConfig(level=logging.INFO)
+
+# Template of the current worker process, parsed once in _init_worker
+_worker_template = None
+
+_UNSAFE_CHARS = re.compile(r"[^\w.-]")
+
+
+@dataclass
+class FillResult:
+    name: str
+    ok: bool
+    seconds: float
+    output: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class InvalidResponse:
+    """A record that could not be read, reported as a failed FillResult."""
+
+    error: str
+
+
+def _read_record(text):
+    try:
+        record = json.loads(text)
+    except json.JSONDecodeError as e:
+        return InvalidResponse(f"JSONDecodeError: {e}")
+    if not isinstance(record, dict):
+        return InvalidResponse(f"TypeError: expected a JSON object, got {type(record).__name__}")
+    return record
+
+
+def iter_responses(source):
+    """
+    Yields (name, response) pairs from a directory of JSON files or a JSONL
+    file, response is an InvalidResponse for a record that is not a JSON object.
+    """
+    source = Path(source)
+    if source.is_dir():
+        for path in sorted(source.glob("*.json")):
+            yield path.stem, _read_record(path.read_text(encoding="utf-8"))
+        return
+
+    with open(source, "r", encoding="utf-8") as file:
+        for line_num, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = _read_record(line)
+            if isinstance(record, dict) and "response" in record and "id" in record:
+                yield str(record["id"]), record["response"]
+            else:
+                yield f"{source.stem}_{line_num:05d}", record
+
+
+def safe_filename(name):
+    """name as a file name without directories or unusual characters, e.g. "../x" -> "x"."""
+    name = str(name).replace("\\", "/").rsplit("/", 1)[-1]
+    name = _UNSAFE_CHARS.sub("_", name).strip(".")
+    return name or "document"
+
+
+def _init_worker(pdf_path):
+    global _worker_template
+    _worker_template = load_pdf_template(pdf_path)
+
+
+def _fill_one(name, response):
+    start = perf_counter()
+    try:
+        pdf_bytes = fill_pdf_bytes(_worker_template, response)
+        return name, pdf_bytes, perf_counter() - start, None
+    except Exception as e:
+        return name, None, perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+class _OutputSink:
+    """Writes filled PDFs to a directory or, for a *.zip path, into one archive."""
+
+    def __init__(self, output):
+        self.output = Path(output)
+        self.archive = None
+        self._names = set()
+        if self.output.suffix == ".zip":
+            self.output.parent.mkdir(parents=True, exist_ok=True)
+            self.archive = zipfile.ZipFile(self.output, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self.output.mkdir(parents=True, exist_ok=True)
+
+    def _filename(self, name):
+        base = safe_filename(name)
+        filename = f"{base}.pdf"
+        suffix = 1
+        while filename.lower() in self._names:
+            suffix += 1
+            filename = f"{base}_{suffix}.pdf"
+        self._names.add(filename.lower())
+        return filename
+
+    def write(self, name, pdf_bytes):
+        filename = self._filename(name)
+        if self.archive is not None:
+            self.archive.writestr(filename, pdf_bytes)
+            return f"{self.output}:{filename}"
+
+        path = self.output / filename
+        with open(path, "wb") as pdf_file:
+            pdf_file.write(pdf_bytes)
+        return str(path)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+
+def fill_batch(
+    template_id,
+    responses,
+    output,
+    workers=None,
+    mapping_path="form_mapping.json",
+):
+    """
+    Fills every response against the template with the given form id.
+
+    Filling runs in a process pool, each worker parses the template PDF once.
+    Results are written to output as they complete, at most two documents per
+    worker are in flight. Returns one FillResult per response.
+    """
+    pdf_path = get_form_registry(mapping_path).get_by_id(template_id).pdf_path
+    workers = workers or os.cpu_count() or 1
+    if isinstance(responses, (str, Path)):
+        responses = iter_responses(responses)
+
+    results = []
+    sink = _OutputSink(output)
+
+    def collect(name, pdf_bytes, seconds, error):
+        if error is None:
+            results.append(FillResult(name, True, seconds, sink.write(name, pdf_bytes)))
+        else:
+            logging.error(f"Filling {name} failed: {error}")
+            results.append(FillResult(name, False, seconds, error=error))
+
+    try:
+        if workers == 1:
+            _init_worker(pdf_path)
+            for name, response in responses:
+                if isinstance(response, InvalidResponse):
+                    collect(name, None, 0.0, response.error)
+                    continue
+                collect(*_fill_one(name, response))
+            return results
+
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(str(pdf_path),)
+        ) as executor:
+            pending = set()
+            for name, response in responses:
+                if isinstance(response, InvalidResponse):
+                    collect(name, None, 0.0, response.error)
+                    continue
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(*future.result())
+                pending.add(executor.submit(_fill_one, name, response))
+
+            for future in wait(pending).done:
+                collect(*future.result())
+    finally:
+        sink.close()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fill one form template with many responses"
+    )
+    parser.add_argument("template_id", help="id of the form in form_mapping.json")
+    parser.add_argument("responses", help="directory of JSON files or a JSONL file")
+    parser.add_argument("--out", required=True, help="output directory or .zip file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--mapping", default="form_mapping.json")
+    parser.add_argument("--report", help="write the per-document results as JSON")
+    args = parser.parse_args(argv)
+
+    start = perf_counter()
+    results = fill_batch(
+        args.template_id, args.responses, args.out, args.workers, args.mapping
+    )
+    elapsed = perf_counter() - start
+
+    failed = [r for r in results if not r.ok]
+    for result in failed:
+        print(f"FAILED {result.name}: {result.error}")
+    print(
+        f"Filled {len(results) - len(failed)}/{len(results)} documents "
+        f"in {elapsed:.2f}s -> {args.out}"
+    )
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump([asdict(r) for r in results], report_file, indent=4)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
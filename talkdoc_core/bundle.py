@@ -0,0 +1,230 @@
+"""
+Form bundles: several forms filled from one conversation.
+
+A bundle (bundle_mapping.json) lists forms of form_mapping.json that are
+usually needed together, e.g. the Bürgergeld application with Anlage EK and
+Anlage VM. Fields with the same PDF name and type in several forms, such as
+txtfPersonVorname, become one field of the bundle, so the chat asks for them
+once and one extraction pass covers all forms. fill_bundle fills every PDF in
+parallel and returns them as one zip archive.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+
+from talkdoc_core.field_rules import RuleExtractor
+from talkdoc_core.form_registry import (
+    _file_signature,
+    freeze,
+    get_form_registry,
+    shared_system_messages,
+)
+from talkdoc_core.pdf_ops import fill_pdf_bytes
+from talkdoc_core.prompts import (
+    filter_json_fields,
+    get_sectioned_system_prompt_body,
+    get_system_prompt_body,
+    get_system_prompt_date_footer,
+)
+from talkdoc_core.sections import FormSections
+from talkdoc_core.template_model import FormTemplate
+
+logging.basicConfig(level=logging.INFO)
+
+# Shared by all sessions, each worker keeps its parsed templates cached
+_fill_pool = None
+_fill_pool_lock = threading.Lock()
+
+
+def _get_fill_pool():
+    global _fill_pool
+    with _fill_pool_lock:
+        if _fill_pool is None:
+            # spawn, forking a process that runs the event loop and chat threads is unsafe
+            _fill_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _fill_pool
+
+
+def build_alias_index(forms):
+    """
+    Returns the union template and {bundle field: ((form_id, field), ...)}.
+
+    Fields are keyed by their PDF name, a name used with different types is
+    kept apart as "name@form_id". Pages are renumbered to follow each other
+    across the forms, so page based sharding and sections stay per form.
+    """
+    fields = {}
+    aliases = {}
+    page_offset = 0
+    for form in forms:
+        for name, field in form.template.items():
+            key = name
+            if key in fields and fields[key].field_type != field.field_type:
+                key = f"{name}@{form.form_id}"
+            if key not in fields:
+                fields[key] = field.replace(name=key, page=field.page + page_offset)
+            aliases.setdefault(key, []).append((form.form_id, name))
+        page_offset += max((f.page for f in form.template.values()), default=-1) + 1
+    return FormTemplate(fields), {key: tuple(targets) for key, targets in aliases.items()}
+
+
+@dataclass(frozen=True)
+class FormBundle:
+    """Read-only view of a bundle, used like a FormEntry by the chat."""
+
+    name: str
+    form_id: str
+    forms: tuple
+    template: FormTemplate
+    aliases: MappingProxyType
+    filtered_fields: MappingProxyType
+    system_prompt_body: str
+    content_hash: str
+    sections: FormSections
+    rules: RuleExtractor
+
+    @classmethod
+    def build(cls, name, bundle_id, forms):
+        fields, aliases = build_alias_index(forms)
+        content_hash = hashlib.sha256(
+            "".join(form.content_hash for form in forms).encode("ascii")
+        ).hexdigest()
+        return cls(
+            name=name,
+            form_id=bundle_id,
+            forms=tuple(forms),
+            template=fields,
+            aliases=freeze(aliases),
+            filtered_fields=freeze(filter_json_fields(fields)),
+            system_prompt_body=get_system_prompt_body(fields),
+            content_hash=content_hash,
+            sections=FormSections(fields),
+            rules=RuleExtractor(fields),
+        )
+
+    def system_prompt(self, today=None, scoped=False):
+        body = get_sectioned_system_prompt_body() if scoped else self.system_prompt_body
+        return body + get_system_prompt_date_footer(today)
+
+    def system_messages(self, today=None, language=None, scoped=False):
+        body = get_sectioned_system_prompt_body() if scoped else self.system_prompt_body
+        return shared_system_messages(body, today, language)
+
+    def split(self, values):
+        """Maps bundle field values to {form_id: {field: value}}, each shared answer goes to every form."""
+        per_form = {form.form_id: {} for form in self.forms}
+        for key, value in values.items():
+            for form_id, name in self.aliases.get(key, ()):
+                per_form[form_id][name] = value
+        return per_form
+
+    def shared_fields(self):
+        return [key for key, targets in self.aliases.items() if len(targets) > 1]
+
+
+def _fill_form(pdf_path, values):
+    # Runs in a worker process, fill_pdf_bytes parses each template once per process
+    return fill_pdf_bytes(pdf_path, values)
+
+
+def fill_bundle(bundle, values, workers=None):
+    """
+    Fills every form of the bundle with the extracted values and returns a
+    zip archive (bytes) with one filled_<form id>.pdf per form.
+
+    The forms are filled in parallel in a shared process pool, workers=1
+    fills them one after the other in this process.
+    """
+    per_form = bundle.split(values)
+    if workers == 1:
+        filled = [fill_pdf_bytes(form.pdf_path, per_form[form.form_id]) for form in bundle.forms]
+    else:
+        pool = _get_fill_pool()
+        futures = [
+            pool.submit(_fill_form, str(form.pdf_path), per_form[form.form_id])
+            for form in bundle.forms
+        ]
+        filled = [future.result() for future in futures]
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        for form, pdf_bytes in zip(bundle.forms, filled):
+            archive.writestr(f"filled_{form.form_id}.pdf", pdf_bytes)
+    return output.getvalue()
+
+
+class BundleRegistry:
+    """
+    Bundles of bundle_mapping.json on top of a FormRegistry.
+
+    A bundle is rebuilt when one of its templates changes.
+    """
+
+    def __init__(self, mapping_path="bundle_mapping.json", form_registry=None):
+        self.mapping_path = Path(mapping_path)
+        self.form_registry = form_registry or get_form_registry()
+        self._lock = threading.Lock()
+        self._bundles = {}
+        self._mapping = None
+        self._mapping_signature = None
+
+    def bundles(self):
+        """
+        Returns the (read-only) {name: {"id": ..., "forms": [...]}}, reloaded
+        when the file changes and empty if the mapping file does not exist.
+        """
+        with self._lock:
+            signature = (
+                _file_signature(self.mapping_path) if self.mapping_path.exists() else None
+            )
+            if self._mapping is None or signature != self._mapping_signature:
+                mapping = {}
+                if signature is not None:
+                    with open(self.mapping_path, "r", encoding="utf-8") as file:
+                        mapping = json.load(file)
+                self._mapping = freeze(mapping)
+                self._mapping_signature = signature
+            return self._mapping
+
+    def get(self, name):
+        bundles = self.bundles()
+        if name not in bundles:
+            raise KeyError(f"Bundle {name} not found in {self.mapping_path}")
+
+        forms = [self.form_registry.get_by_id(form_id) for form_id in bundles[name]["forms"]]
+        hashes = tuple(form.content_hash for form in forms)
+        with self._lock:
+            cached = self._bundles.get(name)
+            if cached is not None and cached[0] == hashes:
+                return cached[1]
+            logging.info(f"Building form bundle {name}")
+            bundle = FormBundle.build(name, bundles[name]["id"], forms)
+            self._bundles[name] = (hashes, bundle)
+            return bundle
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_bundle_registry(mapping_path="bundle_mapping.json", form_mapping_path="form_mapping.json"):
+    """Returns the process wide bundle registry for the given mapping files."""
+    key = (Path(mapping_path).resolve(), Path(form_mapping_path).resolve())
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = BundleRegistry(key[0], get_form_registry(form_mapping_path))
+        return _registries[key]
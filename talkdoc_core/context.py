@@ -0,0 +1,157 @@
+"""
+Bounded chat context for long form conversations.
+
+The last keep_turns turns are sent verbatim, older turns are folded into a
+running summary of the answered fields by a background model call. Until a
+summary is ready the older turns stay in the context, so building the
+context never waits for the model. If the summaries keep failing the
+context grows past the token budget, that is logged and counted in the
+chat_summary_failures_total metric.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from talkdoc_core import metrics
+from talkdoc_core.prompts import get_context_summary_message, get_context_summary_prompt
+
+logging.basicConfig(level=logging.INFO)
+
+# Failed summaries in a row after which an over-budget context is logged
+MAX_SUMMARY_FAILURES = 3
+
+# Shared by all sessions, summaries must not block a chat turn
+_summary_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def estimate_tokens(messages):
+    """Rough token count of messages (4 characters per token)."""
+    return sum(len(m["content"] or "") for m in messages) // 4 + 4 * len(messages)
+
+
+class ConversationContext:
+    def __init__(
+        self,
+        keep_turns=6,
+        token_budget=4000,
+        summary_tokens=800,
+        min_fold_messages=4,
+    ):
+        # keep_turns assistant/user pairs are kept verbatim, token_budget
+        # bounds the summary plus the verbatim messages (without system prompt)
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.min_fold_messages = min_fold_messages
+        self.summary = ""
+        # Number of dialog messages (after the system prompt) in the summary
+        self.covered = 0
+        # Incremented by reset, summaries of an earlier generation are dropped
+        self._generation = 0
+        # Summaries that failed since the last successful one
+        self.failures = 0
+        self._future = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def split(messages):
+        """Splits off the leading system messages."""
+        start = 0
+        while start < len(messages) and messages[start]["role"] == "system":
+            start += 1
+        return messages[:start], messages[start:]
+
+    def _tail_start(self, dialog, covered, summary):
+        start = max(covered, len(dialog) - 2 * self.keep_turns)
+        budget = self.token_budget - estimate_tokens([{"content": summary}])
+        # Drop further turns from the verbatim tail while it exceeds the budget
+        while start < len(dialog) - 1 and estimate_tokens(dialog[start:]) > budget:
+            start += 1
+        # Keep an assistant question together with the answer after it
+        if (
+            start > covered
+            and dialog[start]["role"] == "user"
+            and estimate_tokens(dialog[start - 1 :]) <= budget
+        ):
+            start -= 1
+        return start
+
+    def build(self, messages, gpt=None):
+        """
+        Returns the messages to send for the next turn.
+
+        With gpt, turns older than the verbatim tail are summarized in the
+        background once at least min_fold_messages of them have piled up.
+        """
+        system, dialog = self.split(messages)
+        with self._lock:
+            summary, covered = self.summary, self.covered
+            tail_start = self._tail_start(dialog, covered, summary)
+            running = self._future is not None and not self._future.done()
+            if (
+                gpt is not None
+                and not running
+                and tail_start - covered >= self.min_fold_messages
+            ):
+                self._future = _summary_executor.submit(
+                    self._summarize,
+                    gpt,
+                    summary,
+                    dialog[covered:tail_start],
+                    covered,
+                    self._generation,
+                )
+                self._future.add_done_callback(self._log_failure)
+            failures = self.failures
+
+        if failures >= MAX_SUMMARY_FAILURES:
+            tokens = estimate_tokens(dialog[covered:])
+            if tokens > self.token_budget:
+                logging.warning(
+                    f"Chat context of {tokens} tokens exceeds the budget of "
+                    f"{self.token_budget}, the last {failures} summaries failed"
+                )
+
+        context = list(system)
+        if summary:
+            context.append({"role": "system", "content": get_context_summary_message(summary)})
+        return context + dialog[covered:]
+
+    def _summarize(self, gpt, summary, folded, start, generation):
+        time_start = time()
+        prompt = get_context_summary_prompt(summary, folded, self.summary_tokens)
+        new_summary = gpt.chat(gpt.add_user_prompt([], prompt), stream=False)
+        with self._lock:
+            if self._generation != generation or self.covered != start:
+                return False
+            self.summary = new_summary.strip()
+            self.covered = start + len(folded)
+            self.failures = 0
+        logging.info(
+            f"Folded {len(folded)} messages into the chat summary in {time() - time_start} seconds"
+        )
+        return True
+
+    def wait(self, timeout=None):
+        """Waits for a running summary, for tests and benchmarks."""
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.covered = 0
+            self.failures = 0
+            self._generation += 1
+
+    def _log_failure(self, future):
+        if future.exception() is not None:
+            with self._lock:
+                self.failures += 1
+                failures = self.failures
+            metrics.inc("chat_summary_failures_total")
+            logging.error(f"Chat summary failed ({failures} in a row): {future.exception()}")
@@ -0,0 +1,239 @@
+"""
+Concurrent, resumable download of the documents linked from a form PDF.
+
+Every form folder keeps a manifest.json with the ETag, Last-Modified and
+SHA-256 of each file. Unchanged files are skipped with a conditional request
+(or by content hash when the server sends no validators) and interrupted
+downloads continue from their .part file with a Range request, a complete
+.part file (416 for the range) is verified and renamed. The manifest
+is written after every change, so the validator of a .part file survives a
+crash. Each URL keeps its own file name, a second URL with the same base
+name gets a hash of the URL appended.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+import requests
+from pypdf import PdfReader
+from pypdf.constants import AnnotationDictionaryAttributes as AA
+from requests.adapters import HTTPAdapter
+
+logging.basicConfig(level=logging.INFO)
+
+MANIFEST_NAME = "manifest.json"
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class DownloadResult:
+    url: str
+    filename: str
+    # downloaded, resumed, unchanged or failed
+    status: str
+    bytes: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def extract_pdf_links(pdf_path):
+    """Returns the URIs of all link annotations that point to a PDF, in page order."""
+    reader = PdfReader(pdf_path)
+    links = []
+    for page in reader.pages:
+        for annot in page.annotations or []:
+            annot = annot.get_object()
+            if annot[AA.Subtype] != "/Link" or "/A" not in annot:
+                continue
+            uri = annot["/A"].get_object().get("/URI")
+            if uri and uri.endswith(".pdf") and uri not in links:
+                links.append(uri)
+    return links
+
+
+def _filename(url):
+    # Decode first, an encoded "/" must not end up in the file name
+    return os.path.basename(unquote(urlparse(url).path))
+
+
+def _unique_filename(url, taken):
+    filename = _filename(url)
+    if filename in taken:
+        stem, ext = os.path.splitext(filename)
+        filename = f"{stem}-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}{ext}"
+    return filename
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_session(max_workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class DocumentDownloader:
+    def __init__(self, folder, session=None, max_workers=4, timeout=30):
+        self.folder = Path(folder)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = session or create_session(max_workers)
+        self._manifest_lock = threading.Lock()
+        self.manifest = self._load_manifest()
+        # {url: file name in folder}, the names from earlier runs stay fixed
+        self._filenames = {
+            url: entry["filename"] for url, entry in self.manifest.items() if entry.get("filename")
+        }
+
+    def _load_manifest(self):
+        path = self.folder / MANIFEST_NAME
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        return {}
+
+    def _save_manifest(self):
+        # Called with _manifest_lock held
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self.folder / MANIFEST_NAME
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    def filename(self, url):
+        """File name of url in the folder, unique per URL."""
+        with self._manifest_lock:
+            filename = self._filenames.get(url)
+            if filename is None:
+                filename = _unique_filename(url, set(self._filenames.values()))
+                self._filenames[url] = filename
+            return filename
+
+    def download_all(self, urls):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # Names in link order, independent of which download starts first
+        for url in urls:
+            self.filename(url)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.download, urls))
+
+    def download(self, url):
+        start = perf_counter()
+        filename = self.filename(url)
+        try:
+            result = self._download(url, filename)
+        except Exception as e:
+            logging.error(f"Download of {url} failed: {e}")
+            result = DownloadResult(url, filename, "failed", error=str(e))
+        result.seconds = perf_counter() - start
+        return result
+
+    def _download(self, url, filename):
+        path = self.folder / filename
+        part_path = self.folder / f"{filename}.part"
+        with self._manifest_lock:
+            known = dict(self.manifest.get(url, {}))
+
+        headers = {}
+        if path.exists() and known:
+            if known.get("etag"):
+                headers["If-None-Match"] = known["etag"]
+            if known.get("last_modified"):
+                headers["If-Modified-Since"] = known["last_modified"]
+
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset and known.get("partial_etag"):
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = known["partial_etag"]
+
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code == 304:
+                return DownloadResult(url, filename, "unchanged")
+
+            received = 0
+            if response.status_code == 416 and offset and offset == (
+                _total_size(response) or known.get("partial_size")
+            ):
+                # The .part file holds every byte, the run stopped before the rename
+                resumed = True
+                etag = known.get("partial_etag")
+            else:
+                response.raise_for_status()
+                resumed = response.status_code == 206
+                etag = response.headers.get("ETag")
+                with self._manifest_lock:
+                    # Remember the validator and size of the .part file for a later resume
+                    entry = self.manifest.setdefault(url, {})
+                    entry.update(
+                        filename=filename, partial_etag=etag, partial_size=_total_size(response)
+                    )
+                    self._save_manifest()
+
+                with open(part_path, "ab" if resumed else "wb") as file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+                        received += len(chunk)
+
+        sha256 = _sha256(part_path)
+        status = "resumed" if resumed else "downloaded"
+        if path.exists() and known.get("sha256") == sha256:
+            part_path.unlink()
+            status = "unchanged"
+        else:
+            os.replace(part_path, path)
+
+        with self._manifest_lock:
+            self.manifest[url] = {
+                "filename": filename,
+                "etag": etag,
+                "last_modified": response.headers.get("Last-Modified"),
+                "sha256": sha256,
+                "size": path.stat().st_size,
+            }
+            self._save_manifest()
+
+        logging.info(f"{status.capitalize()} PDF file: {filename}")
+        return DownloadResult(url, filename, status, bytes=received)
+
+
+def _total_size(response):
+    """Size of the whole file from Content-Range (206, 416) or Content-Length (200), None if unknown."""
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length", "")
+    if response.status_code == 200 and length.isdigit():
+        return int(length)
+    return None
+
+
+def download_linked_documents(
+    pdf_path, id, root="./documents", max_workers=4, timeout=30, session=None
+):
+    """Downloads all PDFs linked from pdf_path into <root>/<id>, skipping unchanged files."""
+    downloader = DocumentDownloader(
+        Path(root) / str(id), session=session, max_workers=max_workers, timeout=timeout
+    )
+    return downloader.download_all(extract_pdf_links(pdf_path))
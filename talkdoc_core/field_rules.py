@@ -0,0 +1,319 @@
+"""
+Rule-based extraction of structured fields before the model is asked.
+
+Dates, IBANs, postal codes, phone numbers and yes/no answers to /Btn fields
+are recognized from the field name and its /TU label. A user turn is matched
+against the assistant question before it: the field whose label words the
+question mentions gets the value, if the turn holds exactly one value of the
+field's kind and the value validates (calendar date, IBAN checksum). Only
+content words count, generic question and label words ("haben", "eine",
+"Checkbox", "Persönliche Daten") and words that many fields of the form
+share do not. Ties go to the first field in template order that has no
+value yet, the order in which the chat walks through the form. Checkboxes
+with a negated label ("Keine Bankverbindung vorhanden") never take a bare
+yes/no. A turn counts as consumed, i.e. it is not sent to the model, only
+if nothing but the value and yes/no words remain. Everything that is not
+resolved this way is left to the model.
+"""
+
+import logging
+import re
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+
+from talkdoc_core.template_model import as_template
+
+logging.basicConfig(level=logging.INFO)
+
+# A label word shared by more than this share of the rule fields (and more
+# than MIN_SHARED_FIELDS fields) does not tell the fields apart
+MAX_KEYWORD_SHARE = 0.1
+MIN_SHARED_FIELDS = 3
+
+_WORD = re.compile(r"[^\W\d_]{4,}")
+_VALIDATION = re.compile(r"Validierung.*", re.DOTALL)
+# Question and label words without information about the field itself
+_STOPWORDS = {
+    "angabe", "angaben", "ankreuzfeld", "antragstellenden", "ausfüllfeld", "auswahl",
+    "auswählen", "bitte", "button", "checkbox", "daten", "datum", "datumsfeld",
+    "dein", "deine", "deinem", "deinen", "deiner", "diese", "dieser", "eine", "einem",
+    "einen", "einer", "eines", "eingabe", "falls", "feld", "format", "ggf", "haben",
+    "hast", "ihnen", "ihre", "ihrem", "ihren", "ihrer", "laut", "lautet", "nein",
+    "oder", "option", "person", "persönliche", "persönlichen", "radio", "seit",
+    "sind", "sofern", "textfeld", "wann", "welche", "welchem", "welcher", "welches",
+    "wenn", "werden", "wird", "wurde",
+}
+_STOP_STEMS = {word[:6] for word in _STOPWORDS}
+# Checkbox labels that state an absence, a "Ja" to the question is not a tick
+_NEGATED = re.compile(r"\bkein(?:e|en|em|er|es)?\b", re.IGNORECASE)
+# Words that may stay next to a value in a consumed turn
+_FILLER = {"ja", "jawohl", "yes", "nein", "no", "genau", "richtig", "stimmt", "korrekt"}
+
+_DATE = re.compile(r"(?<![\d.])(\d{1,2})[./](\d{1,2})[./](\d{4})(?![\d.]*\d)")
+_ISO_DATE = re.compile(r"(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)")
+_IBAN_START = re.compile(r"\b[A-Za-z]{2}\d{2}")
+_PLZ = re.compile(r"(?<![\d.,])\d{5}(?!\d)(?![.,]\d)")
+_PHONE = re.compile(r"(?<![\w+])(?:\+|00)?\d[\d /()-]{4,}\d(?!\w)")
+
+_YES = {"ja", "jawohl", "yes", "yep", "genau", "richtig", "stimmt", "korrekt", "klar", "natürlich"}
+_NO = {"nein", "no", "nope", "nö", "nee", "nicht", "kein", "keine", "keins"}
+
+
+def stem(word):
+    # German compounds share their start, e.g. Geburtsdatum/Geburtsort
+    return word.lower()[:6]
+
+
+def content_stems(text):
+    """Stems of the words of text, without the generic question and label words."""
+    return {s for s in map(stem, _WORD.findall(text)) if s not in _STOP_STEMS}
+
+
+def label_keywords(label):
+    """Stems of the words describing a field, without the validation part."""
+    return content_stems(_VALIDATION.sub("", " ".join(str(label or "").split())))
+
+
+def negated_label(label):
+    return bool(_NEGATED.search(_VALIDATION.sub("", str(label or ""))))
+
+
+def iban_valid(iban):
+    """ISO 13616 check: length and mod 97 checksum."""
+    if not 15 <= len(iban) <= 34 or not iban.isalnum() or not iban[:2].isalpha():
+        return False
+    digits = "".join(str(int(c, 36)) for c in iban[4:] + iban[:4])
+    return int(digits) % 97 == 1
+
+
+def _format_iban(iban):
+    return " ".join(iban[i : i + 4] for i in range(0, len(iban), 4))
+
+
+def find_dates(text):
+    found = []
+    for day, month, year in _DATE.findall(text):
+        found.append((int(year), int(month), int(day)))
+    for year, month, day in _ISO_DATE.findall(text):
+        found.append((int(year), int(month), int(day)))
+
+    values = []
+    for year, month, day in found:
+        try:
+            values.append(date(year, month, day).strftime("%d.%m.%Y"))
+        except ValueError:
+            continue
+    return values
+
+
+def _iban_matches(text):
+    """Yields (start, end, IBAN) for each IBAN in text that passes iban_valid."""
+    last_end = 0
+    for match in _IBAN_START.finditer(text):
+        if match.start() < last_end:
+            continue
+        # Grow over the following whitespace separated groups, keep the
+        # longest prefix with a valid checksum
+        compact = ""
+        found = None
+        for token_match in re.finditer(r"\S+", text[match.start() :]):
+            token = token_match.group().rstrip(".,;:!?")
+            if not token.isalnum():
+                break
+            compact += token.upper()
+            if len(compact) > 34:
+                break
+            if iban_valid(compact):
+                found = (match.start() + token_match.start() + len(token), compact)
+        if found:
+            last_end = found[0]
+            yield match.start(), found[0], found[1]
+
+
+def find_ibans(text):
+    values = []
+    for _, _, iban in _iban_matches(text):
+        if _format_iban(iban) not in values:
+            values.append(_format_iban(iban))
+    return values
+
+
+def find_postal_codes(text):
+    return [code for code in _PLZ.findall(text) if code != "00000"]
+
+
+def find_phone_numbers(text):
+    values = []
+    for match in _PHONE.findall(text):
+        digits = re.sub(r"\D", "", match)
+        # Dates and postal codes are too short or lack the separators of a number
+        if 6 <= len(digits) <= 15 and not _DATE.fullmatch(match.strip()):
+            values.append(" ".join(match.split()))
+    return values
+
+
+def find_yes_no(text):
+    words = set(re.findall(r"[^\W\d_]+", text.lower()))
+    if words and words <= _YES:
+        return ["Ja"]
+    if words and words <= _NO:
+        return ["Nein"]
+    return []
+
+
+@dataclass(frozen=True)
+class FieldRule:
+    kind: str
+    # Matched against the PDF field name and the /TU label
+    name: re.Pattern
+    label: re.Pattern
+    # Labels of fields that look like the kind but take more than one value
+    exclude: re.Pattern
+    find: object
+
+    def applies(self, name, field):
+        # Without the validation hints, e.g. "Validierung: fünfstellige Postleitzahl"
+        label = _VALIDATION.sub("", str(field.label or ""))
+        if self.exclude.search(name) or self.exclude.search(label):
+            return False
+        return bool(self.name.search(name) or self.label.search(label))
+
+
+_NEVER = re.compile(r"(?!)")
+
+FIELD_RULES = (
+    FieldRule("iban", re.compile(r"IBAN"), re.compile(r"\bIBAN\b"), _NEVER, find_ibans),
+    FieldRule(
+        "date",
+        re.compile(r"^date|Date|Datum"),
+        re.compile(r"^Datum;|TT\.MM\.JJJJ|DD\.MM\.YYYY"),
+        re.compile(r"Ort.Datum|Zwei Datumsangaben|von/bis", re.IGNORECASE),
+        find_dates,
+    ),
+    FieldRule("plz", re.compile(r"Plz|PLZ"), re.compile(r"Postleitzahl"), _NEVER, find_postal_codes),
+    FieldRule(
+        "phone", re.compile(r"Tel(\[\d+\])?$"), re.compile(r"Telefon"), _NEVER, find_phone_numbers
+    ),
+)
+
+
+class RuleExtractor:
+    """Resolves the structured fields of one template from the user turns of a chat."""
+
+    def __init__(self, json_fields, rules=FIELD_RULES):
+        json_fields = as_template(json_fields)
+        self.order = {name: i for i, name in enumerate(json_fields)}
+        # {name: kind} and {kind: finder} of the fields a rule applies to
+        self.kinds = {}
+        self.finders = {"yesno": find_yes_no}
+        for name, field in json_fields.items():
+            if field.is_button:
+                if not negated_label(field.label):
+                    self.kinds[name] = "yesno"
+                continue
+            for rule in rules:
+                if field.is_text and rule.applies(name, field):
+                    self.kinds[name] = rule.kind
+                    self.finders[rule.kind] = rule.find
+                    break
+        keywords = {name: label_keywords(json_fields[name].label) for name in self.kinds}
+        # Words on many fields of the form, e.g. "Lebenssituation" on every
+        # field of section C, do not identify a field
+        shared = Counter(s for stems in keywords.values() for s in stems)
+        limit = max(MIN_SHARED_FIELDS, int(len(keywords) * MAX_KEYWORD_SHARE))
+        self.keywords = {
+            name: {s for s in stems if shared[s] <= limit} for name, stems in keywords.items()
+        }
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def _attribute(self, question, kind, values):
+        """Field of kind the question asks for, None if no label word is mentioned."""
+        asked = content_stems(question)
+        scores = {}
+        for name, field_kind in self.kinds.items():
+            if field_kind == kind:
+                score = len(self.keywords[name] & asked)
+                if score:
+                    scores[name] = score
+        if not scores:
+            return None
+        best = max(scores.values())
+        candidates = sorted((n for n, s in scores.items() if s == best), key=self.order.get)
+        if kind == "yesno" and len(candidates) > 1:
+            # A bare yes/no carries no hint which of several boxes is meant
+            return None
+        open_candidates = [n for n in candidates if not values.get(n)]
+        return (open_candidates or candidates)[0]
+
+    def extract(self, messages, known=None, with_turns=False):
+        """
+        Returns ({field: value}, consumed) for messages, consumed holds the
+        indices of user turns that carry nothing beyond the resolved value.
+        known are values from earlier extractions, used to break ties.
+        with_turns adds {field: index of the user turn it was resolved from}.
+        """
+        values = dict(known or {})
+        resolved = {}
+        resolved_at = {}
+        # Last turn with a value of a kind that could not be attributed, a
+        # later unattributed date may correct an earlier one
+        unattributed_at = {}
+        consumed = set()
+        question = ""
+
+        for i, message in enumerate(messages):
+            content = str(message.get("content") or "")
+            if message["role"] == "assistant":
+                question = content
+                continue
+            if message["role"] != "user":
+                continue
+
+            unattributed = []
+            for kind, find in self.finders.items():
+                found = find(content)
+                if not found:
+                    continue
+                name = self._attribute(question, kind, values) if len(found) == 1 else None
+                if name is None:
+                    unattributed.append(kind)
+                    continue
+                values[name] = resolved[name] = found[0]
+                resolved_at[name] = i
+                if self._remaining_words(content, kind) == 0:
+                    consumed.add(i)
+            # A phone number also looks like a postal code, only turns
+            # without any attributed value make earlier values doubtful
+            if i not in resolved_at.values():
+                for kind in unattributed:
+                    if kind != "yesno":
+                        unattributed_at[kind] = i
+            question = ""
+
+        for name in list(resolved):
+            if unattributed_at.get(self.kinds[name], -1) > resolved_at[name]:
+                del resolved[name]
+        if with_turns:
+            return resolved, consumed, {name: resolved_at[name] for name in resolved}
+        return resolved, consumed
+
+    def _remaining_words(self, content, kind):
+        """Words of content besides the value of kind and yes/no filler."""
+        if kind == "yesno":
+            return 0
+        text = content
+        if kind == "iban":
+            # Only the validated span, the groups of an IBAN are separate words
+            for start, end, _ in reversed(list(_iban_matches(text))):
+                text = f"{text[:start]} {text[end:]}"
+        elif kind == "date":
+            text = _ISO_DATE.sub(" ", _DATE.sub(" ", text))
+        elif kind == "plz":
+            text = _PLZ.sub(" ", text)
+        elif kind == "phone":
+            text = _PHONE.sub(" ", text)
+        return sum(1 for w in re.findall(r"[^\W_]+", text) if w.lower() not in _FILLER)
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+
+from talkdoc_core.field_rules import RuleExtractor
+from talkdoc_core.prompts import (
+    filter_json_fields,
+    get_language_prompt,
+    get_sectioned_system_prompt_body,
+    get_system_prompt_body,
+    get_system_prompt_date_footer,
+)
+from talkdoc_core.sections import FormSections
+from talkdoc_core.template_model import FormTemplate, load_template
+
+logging.basicConfig(level=logging.INFO)
+
+# Rendered prompts kept by the prompt store, a few per form and day
+MAX_SHARED_PROMPTS = 256
+
+
+def freeze(obj):
+    """Recursively converts dicts to read-only mappings and lists to tuples."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """Inverse of freeze, returns plain (mutable) dicts and lists."""
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class PromptStore:
+    """
+    Process wide store of the rendered system prompts.
+
+    The date footer makes every system_prompt call build a new string of
+    several kilobytes. The store hands out one instance per distinct text,
+    so the messages of all sessions on a form reference the same prompt.
+    """
+
+    def __init__(self, max_entries=MAX_SHARED_PROMPTS):
+        self.max_entries = max_entries
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def share(self, text):
+        """Returns the stored string equal to text, storing text if it is new."""
+        with self._lock:
+            shared = self._texts.get(text)
+            if shared is not None:
+                self._texts.move_to_end(text)
+                return shared
+            if len(self._texts) >= self.max_entries:
+                # Least recently used first, e.g. the prompts of the previous day
+                self._texts.popitem(last=False)
+            shared = self._texts[text] = text
+            return shared
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._texts))
+
+
+_prompt_store = PromptStore()
+
+
+def get_prompt_store():
+    """Returns the process wide PromptStore."""
+    return _prompt_store
+
+
+def shared_system_messages(body, today=None, language=None):
+    """System messages of a chat with the prompt texts taken from the prompt store."""
+    store = get_prompt_store()
+    messages = [
+        {"role": "system", "content": store.share(body + get_system_prompt_date_footer(today))}
+    ]
+    if language:
+        messages.append({"role": "system", "content": store.share(get_language_prompt(language))})
+    return messages
+
+
+@dataclass(frozen=True)
+class FormEntry:
+    """Shared, read-only view of one form from form_mapping.json."""
+
+    name: str
+    form_id: str
+    template_path: Path
+    pdf_path: Path
+    template: FormTemplate
+    filtered_fields: MappingProxyType
+    system_prompt_body: str
+    content_hash: str
+    sections: FormSections
+    rules: RuleExtractor
+
+    def system_prompt(self, today=None, scoped=False):
+        # The date footer is rendered on every call so it rolls over by itself,
+        # the body before it stays byte-identical for prompt caching. The
+        # scoped body leaves the fields to sections.message, sent per turn
+        body = get_sectioned_system_prompt_body() if scoped else self.system_prompt_body
+        return body + get_system_prompt_date_footer(today)
+
+    def system_messages(self, today=None, language=None, scoped=False):
+        body = get_sectioned_system_prompt_body() if scoped else self.system_prompt_body
+        return shared_system_messages(body, today, language)
+
+
+class FormRegistry:
+    """
+    Process wide cache of the forms listed in form_mapping.json.
+
+    Templates are parsed once and handed out as immutable views. An entry is
+    reloaded when the template file changes: a cheap mtime/size check runs on
+    every access and the content hash decides whether a reload is needed.
+    """
+
+    def __init__(self, mapping_path="form_mapping.json", base_dir=None):
+        self.mapping_path = Path(mapping_path)
+        self.base_dir = (
+            Path(base_dir) if base_dir else self.mapping_path.resolve().parent
+        )
+        self._lock = threading.RLock()
+        self._mapping = None
+        self._mapping_signature = None
+        self._entries = {}
+        self._signatures = {}
+
+    def _resolve(self, path):
+        path = Path(path)
+        return path if path.is_absolute() else self.base_dir / path
+
+    def forms(self):
+        """Returns the (read-only) form mapping, reloading it if the file changed."""
+        with self._lock:
+            signature = _file_signature(self.mapping_path)
+            if signature != self._mapping_signature:
+                with open(self.mapping_path, "r", encoding="utf-8") as file:
+                    self._mapping = freeze(json.load(file))
+                self._mapping_signature = signature
+            return self._mapping
+
+    def get(self, name):
+        with self._lock:
+            mapping = self.forms()
+            if name not in mapping:
+                raise KeyError(f"Form {name} not found in {self.mapping_path}")
+
+            template_path = self._resolve(mapping[name]["template_path"])
+            signature = _file_signature(template_path)
+            entry = self._entries.get(name)
+
+            if entry is not None and entry.template_path == template_path:
+                if self._signatures[name] == signature:
+                    return entry
+                # mtime changed (e.g. touched or re-deployed), check the content
+                if _file_hash(template_path) == entry.content_hash:
+                    self._signatures[name] = signature
+                    return entry
+
+            entry = self._load(name, mapping[name], template_path)
+            self._entries[name] = entry
+            self._signatures[name] = signature
+            return entry
+
+    def get_by_id(self, form_id):
+        """Looks a form up by the id field of form_mapping.json."""
+        for name, form in self.forms().items():
+            if form["id"] == form_id:
+                return self.get(name)
+        raise KeyError(f"Form with id {form_id} not found in {self.mapping_path}")
+
+    def _load(self, name, form, template_path):
+        logging.info(f"Loading form template {template_path}")
+        with open(template_path, "rb") as file:
+            raw = file.read()
+        # From the compiled artifact next to the JSON if it is up to date
+        template = load_template(template_path, raw)
+
+        return FormEntry(
+            name=name,
+            form_id=form["id"],
+            template_path=template_path,
+            pdf_path=self._resolve(form["pdf_path"]),
+            template=template,
+            filtered_fields=freeze(filter_json_fields(template)),
+            system_prompt_body=get_system_prompt_body(template),
+            content_hash=template.source_hash,
+            sections=FormSections(template),
+            rules=RuleExtractor(template),
+        )
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self._signatures.clear()
+                self._mapping_signature = None
+            else:
+                self._entries.pop(name, None)
+                self._signatures.pop(name, None)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_form_registry(mapping_path="form_mapping.json"):
+    """Returns the process wide registry for the given mapping file."""
+    key = Path(mapping_path).resolve()
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = FormRegistry(key)
+        return _registries[key]
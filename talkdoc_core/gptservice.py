@@ -1,44 +1,415 @@
+from talkdoc_core import metrics
 from talkdoc_core.prompts import get_system_prompt_for_chat
+from talkdoc_core.response_cache import cache_key, response_cache_from_env
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import asyncio
+import concurrent.futures
+import hashlib
+import httpx
 import logging
+import random
+import threading
+import time
+
+from dataclasses import dataclass, field
 
 logging.basicConfig(level=logging.INFO)
 
+# Validation results per API key hash: {key_hash: (is_valid, expires_at)}
+API_KEY_VALID_TTL = 3600
+API_KEY_INVALID_TTL = 60
+_api_key_status = {}
+_api_key_lock = threading.Lock()
 
-class GPTService:
-    def __init__(self, api_key: str):
+_services = {}
+_services_lock = threading.Lock()
+
+# Shared by all services, configured from the environment on first use
+_response_cache = None
+_response_cache_loaded = False
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+# All OpenAI calls of the process run on one event loop thread and share one
+# HTTP connection pool, the sync API submits coroutines to this loop
+_loop = None
+_http_client = None
+_loop_lock = threading.Lock()
+
+
+@dataclass
+class TokenUsage:
+    """Token counts summed over responses, cached_tokens are the prompt tokens served from the provider's prefix cache."""
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def cache_hit_rate(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def add(self, usage):
+        """Adds the usage of one OpenAI response, returns its (prompt_tokens, cached_tokens)."""
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_tokens += cached
+            self.completion_tokens += usage.completion_tokens
+        return usage.prompt_tokens, cached
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hit_rate": round(self.cache_hit_rate, 4),
+            }
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def get_response_cache():
+    """Returns the shared response cache (see response_cache_from_env), None if it is disabled."""
+    global _response_cache, _response_cache_loaded
+    with _services_lock:
+        if not _response_cache_loaded:
+            _response_cache = response_cache_from_env()
+            _response_cache_loaded = True
+        return _response_cache
+
+
+def get_gpt_service(api_key: str) -> "GPTService":
+    """Returns one GPTService per API key so the HTTP connection pool is reused across reruns."""
+    key_hash = hash_api_key(api_key)
+    cache = get_response_cache()
+    with _services_lock:
+        if key_hash not in _services:
+            _services[key_hash] = GPTService(api_key, cache=cache)
+        return _services[key_hash]
+
+
+def get_async_gpt_service(api_key: str) -> "AsyncGPTService":
+    """The AsyncGPTService behind get_gpt_service, usage and cache are shared with it."""
+    return get_gpt_service(api_key).aservice
+
+
+def get_event_loop():
+    """Returns the process wide event loop all OpenAI calls run on, started on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="gptservice-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def get_http_client():
+    """Returns the HTTP connection pool shared by all OpenAI clients."""
+    global _http_client
+    with _loop_lock:
+        if _http_client is None:
+            _http_client = DefaultAsyncHttpxClient(limits=HTTP_LIMITS)
+        return _http_client
+
+
+def run_sync(coro, timeout=None):
+    """Runs coro on the shared loop and waits for it, the coroutine is cancelled if the wait ends early."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        # Timeout or KeyboardInterrupt in the calling thread
+        future.cancel()
+        raise
+
+
+async def _on_event_loop(coro):
+    # Lets callers on any event loop await work bound to the shared loop,
+    # cancelling the caller cancels the task on the shared loop as well
+    loop = get_event_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+_STREAM_END = object()
+
+
+def _span_error(exc):
+    # error label of a gpt_chat span, a stopped or cancelled stream is not a failure of the request
+    if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    return type(exc).__name__
+
+
+async def _next_chunk(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _STREAM_END
+
+
+def is_retryable(error):
+    return isinstance(
+        error,
+        (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError),
+    )
+
+
+def retry_delay(attempt, error=None, base=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter, a Retry-After header of a 429/5xx is respected."""
+    delay = random.uniform(0, min(max_delay, base * 2**attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, min(max_delay, float(response.headers.get("retry-after"))))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+class AsyncGPTService:
+    def __init__(
+        self,
+        api_key: str,
+        cache=None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_url: str = None,
+    ):
         self.api_key = api_key
-        self.client = OpenAI(api_key=api_key)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # Retries are handled here, the client makes one attempt per call.
+        # base_url (default: OPENAI_BASE_URL) can point at talkdoc_core.stub_server
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=get_http_client(),
+            max_retries=0,
+        )
+        self.usage = TokenUsage()
+        # Optional ResponseCache for non-streaming calls
+        self.cache = cache
 
-    def chat(
+    async def chat(
         self,
         messages,
         model: str = "gpt-4.1",
         stream: bool = True,
         json_mode: bool = False,
+        timeout: float = None,
     ):
+        """
+        Returns the message content, or an async iterator of chunks if stream.
+
+        429, 5xx and connection errors are retried with jittered exponential
+        backoff, timeout (seconds) applies to every attempt.
+        """
+        span = metrics.span("gpt_chat", model=model, stream=stream, json_mode=json_mode)
+        if stream:
+            try:
+                stream_response = await _on_event_loop(
+                    self._chat(messages, model, True, json_mode, timeout, span)
+                )
+            except BaseException as e:
+                span.set(error=_span_error(e))
+                span.end()
+                raise
+            return self._iter_stream(stream_response, model, span)
+        with span:
+            return await _on_event_loop(
+                self._chat(messages, model, False, json_mode, timeout, span)
+            )
+
+    async def _chat(self, messages, model, stream, json_mode, timeout, span=metrics.NOOP_SPAN):
         try:
             params = {
                 "model": model,
                 "messages": messages,
                 "stream": stream,
+                "timeout": timeout or self.timeout,
             }
+            if stream:
+                # The last chunk then carries the usage incl. cached tokens
+                params["stream_options"] = {"include_usage": True}
 
             if json_mode:
                 params["response_format"] = {"type": "json_object"}
 
-            response = self.client.chat.completions.create(**params)
+            key = None
+            if self.cache is not None and not stream:
+                key = cache_key(model, messages, params.get("response_format"))
+                cached = self.cache.get(key)
+                span.set(cache="hit" if cached is not None else "miss")
+                if cached is not None:
+                    return cached
+
+            response = await self._create_with_retries(params)
 
             if stream:
                 return response
 
-            return response.choices[0].message.content
+            self._record_usage(response.usage, model)
+            content = response.choices[0].message.content
+            if key is not None:
+                self.cache.put(key, content, model)
+            return content
 
+        except asyncio.CancelledError:
+            logging.info(f"{model} request cancelled")
+            raise
         except Exception as e:
             logging.error(f"error: {e}")
             raise
 
+    async def _create_with_retries(self, params):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.chat.completions.create(**params)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_delay(attempt, e)
+                logging.warning(
+                    f"{params['model']} request failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.2f} seconds"
+                )
+                await asyncio.sleep(delay)
+
+    async def _iter_stream(self, response, model, span=metrics.NOOP_SPAN):
+        iterator = response.__aiter__()
+        first_token = True
+        error = None
+        try:
+            while True:
+                chunk = await _on_event_loop(_next_chunk(iterator))
+                if chunk is _STREAM_END:
+                    return
+                if chunk.usage is not None:
+                    self._record_usage(chunk.usage, model)
+                # The usage chunk has no choices, callers only see content chunks
+                if chunk.choices:
+                    if first_token and chunk.choices[0].delta.content:
+                        first_token = False
+                        metrics.observe("gpt_time_to_first_token", span.elapsed(), model=model)
+                    yield chunk
+        except BaseException as e:
+            error = _span_error(e)
+            raise
+        finally:
+            # Also ends the span of a stream the caller stops early
+            if error is not None:
+                span.set(error=error)
+            span.end()
+            # Closes the connection when the caller stops early or is cancelled
+            if hasattr(response, "close"):
+                await _on_event_loop(response.close())
+
+    def _record_usage(self, usage, model):
+        if usage is None:
+            return
+        prompt_tokens, cached_tokens = self.usage.add(usage)
+        metrics.inc("gpt_tokens_total", prompt_tokens, model=model, kind="prompt")
+        metrics.inc("gpt_tokens_total", cached_tokens, model=model, kind="cached")
+        metrics.inc("gpt_tokens_total", usage.completion_tokens, model=model, kind="completion")
+        logging.info(
+            f"{model} usage: {prompt_tokens} prompt tokens ({cached_tokens} cached), "
+            f"{usage.completion_tokens} completion tokens"
+        )
+
+    async def check_openai_api_key(
+        self, ttl: float = API_KEY_VALID_TTL, invalid_ttl: float = API_KEY_INVALID_TTL
+    ):
+        # Cached per key hash, invalid keys are cached for a shorter time
+        key_hash = hash_api_key(self.api_key)
+        now = time.monotonic()
+        with _api_key_lock:
+            cached = _api_key_status.get(key_hash)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        try:
+            await _on_event_loop(self.client.models.list())
+            is_valid = True
+        except openai.AuthenticationError:
+            logging.error("Invalid OpenAI API key")
+            is_valid = False
+
+        with _api_key_lock:
+            _api_key_status[key_hash] = (
+                is_valid,
+                now + (ttl if is_valid else invalid_ttl),
+            )
+        return is_valid
+
+
+class GPTService:
+    """Blocking wrapper around AsyncGPTService, safe to call from any thread."""
+
+    def __init__(
+        self,
+        api_key: str,
+        cache=None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_url: str = None,
+    ):
+        self.api_key = api_key
+        self.aservice = AsyncGPTService(
+            api_key,
+            cache=cache,
+            timeout=timeout,
+            max_retries=max_retries,
+            base_url=base_url,
+        )
+
+    @property
+    def client(self):
+        return self.aservice.client
+
+    @client.setter
+    def client(self, client):
+        self.aservice.client = client
+
+    @property
+    def cache(self):
+        return self.aservice.cache
+
+    @property
+    def usage(self):
+        return self.aservice.usage
+
+    def chat(
+        self,
+        messages,
+        model: str = "gpt-4.1",
+        stream: bool = True,
+        json_mode: bool = False,
+        timeout: float = None,
+    ):
+        response = run_sync(
+            self.aservice.chat(messages, model, stream, json_mode, timeout)
+        )
+        if stream:
+            return _iter_sync(response)
+        return response
+
     def add_system_prompt_for_chat(self, json_fields):
         return [{"role": "system", "content": get_system_prompt_for_chat(json_fields)}]
 
@@ -48,10 +419,19 @@ class GPTService:
     def add_assistant_response(self, messages, response):
         return messages + [{"role": "assistant", "content": response}]
 
-    def check_openai_api_key(self):
-        try:
-            self.client.models.list()
-            return True
-        except openai.AuthenticationError:
-            logging.error("Invalid OpenAI API key")
-            return False
+    def check_openai_api_key(
+        self, ttl: float = API_KEY_VALID_TTL, invalid_ttl: float = API_KEY_INVALID_TTL
+    ):
+        return run_sync(self.aservice.check_openai_api_key(ttl, invalid_ttl))
+
+
+def _iter_sync(async_iterator):
+    # Pulls the chunks of a stream one by one from the shared loop
+    try:
+        while True:
+            chunk = run_sync(_next_chunk(async_iterator))
+            if chunk is _STREAM_END:
+                return
+            yield chunk
+    finally:
+        run_sync(async_iterator.aclose())
@@ -0,0 +1,116 @@
+"""
+Opening messages per form and language.
+
+A greeting only depends on the form template, the language and the prompt
+mode (full or section-scoped system prompt), so it is generated once and
+shared by all sessions until its TTL expires. Greetings are stored when a
+session streams one and can be pre-generated in the background for a list
+of languages, a new session then renders its first message without waiting
+for the model. Both paths send greeting_messages, so a cached greeting does
+not depend on which of them produced it.
+"""
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from talkdoc_core.gptservice import hash_api_key
+
+logging.basicConfig(level=logging.INFO)
+
+GREETING_TTL = 24 * 3600
+# Shown in the language select of Chat.py, None keeps the default of the prompt
+LANGUAGES = {
+    "Deutsch": None,
+    "English": "Englisch",
+    "Türkçe": "Türkisch",
+    "العربية": "Arabisch",
+    "Українська": "Ukrainisch",
+    "Русский": "Russisch",
+}
+
+
+def greeting_messages(form, language=None, scoped=False):
+    """The messages a greeting is generated from, the first turn of a chat."""
+    messages = form.system_messages(language=language, scoped=scoped)
+    if scoped:
+        # No answers yet, the first section
+        messages.append(form.sections.message({}))
+    return messages
+
+
+class GreetingCache:
+    def __init__(self, ttl=GREETING_TTL, max_workers=4):
+        self.ttl = ttl
+        # {(form_id, content_hash, language, scoped): (greeting, expires_at)}
+        self._greetings = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pregenerated = set()
+
+    @staticmethod
+    def _key(form, language, scoped):
+        # The content hash rolls the greeting over when the template changes
+        return (form.form_id, form.content_hash, language, scoped)
+
+    def get(self, form, language=None, scoped=False):
+        with self._lock:
+            cached = self._greetings.get(self._key(form, language, scoped))
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def put(self, form, greeting, language=None, scoped=False):
+        with self._lock:
+            self._greetings[self._key(form, language, scoped)] = (
+                greeting,
+                time.monotonic() + self.ttl,
+            )
+
+    def generate(self, gpt, form, language=None, scoped=False):
+        """Returns the cached greeting or generates (and caches) a new one."""
+        greeting = self.get(form, language, scoped)
+        if greeting is None:
+            greeting = gpt.chat(greeting_messages(form, language, scoped), stream=False)
+            self.put(form, greeting, language, scoped)
+        return greeting
+
+    def pregenerate(self, gpt, forms, languages=(None,), scoped=False):
+        """Generates the missing greetings of all forms and languages concurrently, returns the futures."""
+        futures = []
+        for form in forms:
+            for language in languages:
+                if self.get(form, language, scoped) is None:
+                    future = self._executor.submit(self.generate, gpt, form, language, scoped)
+                    future.add_done_callback(self._log_failure)
+                    futures.append(future)
+        return futures
+
+    def pregenerate_once(self, gpt, forms, languages=(None,), scoped=False):
+        """pregenerate for the first caller per API key, language set and mode, later calls return []."""
+        key = (hash_api_key(gpt.api_key), tuple(languages), scoped)
+        with self._lock:
+            if key in self._pregenerated:
+                return []
+            self._pregenerated.add(key)
+        return self.pregenerate(gpt, forms, languages, scoped)
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            logging.error(f"Greeting pre-generation failed: {future.exception()}")
+
+
+_greeting_cache = None
+_greeting_cache_lock = threading.Lock()
+
+
+def get_greeting_cache():
+    """Returns the process wide GreetingCache."""
+    global _greeting_cache
+    with _greeting_cache_lock:
+        if _greeting_cache is None:
+            _greeting_cache = GreetingCache()
+        return _greeting_cache
@@ -0,0 +1,230 @@
+"""
+Lightweight spans and metrics for the request path.
+
+Disabled by default, every call then returns after one flag check. Enable it
+with TALKDOC_METRICS=1 (or metrics.enable()); TALKDOC_METRICS_JSONL=<path>
+additionally appends every observation as one JSON line.
+
+    with metrics.span("pdf_ops", stage="write"):
+        writer.write(output)
+    metrics.inc("gpt_tokens_total", usage.prompt_tokens, kind="prompt")
+
+Durations are histograms named <name>_seconds, counters keep their name.
+to_prometheus() renders everything in the Prometheus text format.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from time import perf_counter
+
+logging.basicConfig(level=logging.INFO)
+
+# Upper bounds in seconds, from PDF field updates up to slow model answers
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_enabled = os.getenv("TALKDOC_METRICS") == "1"
+_jsonl_path = os.getenv("TALKDOC_METRICS_JSONL")
+_lock = threading.Lock()
+# {(name, labels): [bucket counts..., sum, count]} and {(name, labels): value}
+_histograms = {}
+_counters = {}
+
+
+def enabled():
+    return _enabled
+
+
+def enable(jsonl_path=None):
+    global _enabled, _jsonl_path
+    _enabled = True
+    if jsonl_path is not None:
+        _jsonl_path = str(jsonl_path)
+
+
+def disable():
+    global _enabled, _jsonl_path
+    _enabled = False
+    _jsonl_path = None
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _emit(kind, name, value, labels):
+    record = {"ts": time.time(), "type": kind, "name": name, "value": value, **dict(labels)}
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        with open(_jsonl_path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+
+def observe(name, seconds, **labels):
+    """Records a duration in the histogram <name>_seconds."""
+    if not _enabled:
+        return
+    name = f"{name}_seconds"
+    key = (name, _labels(labels))
+    with _lock:
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [0] * (len(DEFAULT_BUCKETS) + 2)
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound:
+                state[i] += 1
+        state[-2] += seconds
+        state[-1] += 1
+    if _jsonl_path:
+        _emit("histogram", name, seconds, key[1])
+
+
+def inc(name, value=1, **labels):
+    """Adds value to the counter name."""
+    if not _enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    if _jsonl_path:
+        _emit("counter", name, value, key[1])
+
+
+class Span:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = perf_counter()
+
+    def set(self, **labels):
+        """Adds labels known only after the span started, e.g. a cache hit."""
+        self.labels.update(labels)
+
+    def elapsed(self):
+        return perf_counter() - self.start
+
+    def end(self):
+        observe(self.name, self.elapsed(), **self.labels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.labels.setdefault("error", exc_type.__name__)
+        self.end()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **labels):
+        pass
+
+    def elapsed(self):
+        return 0.0
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **labels):
+    """Times a block as <name>_seconds, usable as context manager or with span.end()."""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, labels)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "histograms": {
+                name + _format_labels(labels): {"sum": state[-2], "count": state[-1]}
+                for (name, labels), state in _histograms.items()
+            },
+            "counters": {
+                name + _format_labels(labels): value
+                for (name, labels), value in _counters.items()
+            },
+        }
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def to_prometheus():
+    """Renders all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+
+    typed = set()
+    for (name, labels), state in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        for bound, count in zip(DEFAULT_BUCKETS, state):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {state[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """
+    Writes to_prometheus() atomically, e.g. for the node exporter textfile
+    collector. Every writer uses its own temporary file, sessions export
+    concurrently.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".metrics-", suffix=".tmp"
+    )
+    try:
+        # mkstemp creates the file private, the exporter may run as another user
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(to_prometheus())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
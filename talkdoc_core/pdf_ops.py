@@ -1,50 +1,113 @@
 import json
-from pypdf import PdfReader, PdfWriter
+from pypdf import PageObject, PdfReader, PdfWriter
 from pypdf.constants import AnnotationDictionaryAttributes as AA
-from pypdf.generic import NameObject, TextStringObject
-import requests
+from pypdf.generic import (
+    ArrayObject,
+    BooleanObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+    TextStringObject,
+)
+import logging
+import mmap
 import os
+import re
+import struct
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
+from time import perf_counter
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+from talkdoc_core import metrics
+from talkdoc_core.downloads import download_linked_documents
+from talkdoc_core.template_model import (  # noqa: F401 - re-exported for callers of pdf_ops
+    NO_ANSWERS,
+    RADIO_FLAG,
+    YES_ANSWERS,
+    answer_state,
+    as_template,
+    button_state,
+)
+
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+# Start of a cross-reference stream object, e.g. "700 0 obj"
+_XREF_STREAM_START = re.compile(rb"\s*\d+\s+\d+\s+obj\b")
+
+# Text field flags (/Ff) and annotation flags (/F) used for appearances
+MULTILINE_FLAG = 1 << 12
+COMB_FLAG = 1 << 24
+HIDDEN_FLAGS = 2 | 32
+# Auto-sized text (font size 0 in /DA) is capped here and shrunk to fit the width
+MAX_AUTO_FONT_SIZE = 12
+MIN_FONT_SIZE = 4
+# Width in 1/1000 em of glyphs without metrics in the PDF (standard fonts)
+DEFAULT_GLYPH_WIDTH = 556
+# Standard 14 fonts referenced by /DA without an entry in /DR
+STANDARD_FONTS = {"/Helv": "/Helvetica", "/Helvetica": "/Helvetica"}
+
+_DA_FONT = re.compile(r"(/[^\s/]+)\s+([\d.]+)\s+Tf")
 
 
 def download_pdfs_from_links(pdf_path, id):
-    reader = PdfReader(pdf_path)
-    links = []
-    for page in reader.pages:
-        for annot in page.annotations:
-            annot = annot.get_object()
-            if annot[AA.Subtype] == "/Link":
-                links.append(annot["/A"]["/URI"])
+    # Concurrent, resumable downloader, see talkdoc_core.downloads
+    return download_linked_documents(pdf_path, id)
 
-    folder = Path(f"./documents/{id}")
-    if not os.path.exists(folder):
-        os.mkdir(folder)
 
-    for link in links:
-        if link.endswith(".pdf"):
-            response = requests.get(link)
+def index_form_widgets(reader):
+    """
+    Maps the qualified name of every field to the pages and widgets showing it.
 
-            filename = link.split("/")[-1]
-            filepath = Path(f"{folder}/{filename}")
-            with open(filepath, "wb") as pdf_file:
-                pdf_file.write(response.content)
+    Built in one pass over the page annotations instead of one page scan per
+    field as reader.get_pages_showing_field does.
+    """
+    index = {}
+    for page_num, annotation_index, annotation, field in _iter_widgets(reader):
+        entry = index.setdefault(
+            _qualified_name(field), {"pages": [], "widgets": []}
+        )
+        if page_num not in entry["pages"]:
+            entry["pages"].append(page_num)
+        # Appearance states are only needed for the export values of buttons
+        states = _widget_states(annotation) if field.get("/FT") == "/Btn" else ()
+        entry["widgets"].append(WidgetRef(page_num, annotation_index, states))
+    return index
 
-            print(f"Downloaded PDF file: {filename}")
 
+def extract_fields_from_form(pdf_path, output_path=None, return_stats=False):
+    """
+    Extracts the form fields of a PDF into the template JSON format.
 
-def extract_fields_from_form(pdf_path):
+    The template is written to output_path, by default <pdf name>.json in the
+    current directory. With return_stats=True a dict with timings and counts
+    is returned alongside the template.
+    """
+    start = perf_counter()
     reader = PdfReader(pdf_path)
-    json_name = os.path.basename(pdf_path).split(".")[0] + ".json"
+    json_name = output_path or os.path.basename(pdf_path).split(".")[0] + ".json"
 
     print(f"Extracting form fields from {pdf_path} to {json_name}")
 
     alt_form = reader.get_fields()
+    parsed = perf_counter()
+    widget_index = index_form_widgets(reader)
+    indexed = perf_counter()
+
     form_dict_alt = {}
     for key, value in alt_form.items():
         if key=="chbxStatusPersonBesonderGrundWeitJa":
                 continue
         field_id = value.get("/T")
-        if field_id:
+        if field_id and key in widget_index:
             form_dict_alt[field_id] = {}
             form_dict_alt[field_id]["hidden_fields"] = {}
             form_dict_alt[field_id]["/TU"] = value.get("/TU")
@@ -58,59 +121,890 @@ def extract_fields_from_form(pdf_path):
                 ]
                 form_dict_alt[field_id]["hidden_fields"]["on_state"] = on_state
                 form_dict_alt[field_id]["hidden_fields"]["off_state"] = value.get("/V")
-            # print(key)
-            form_dict_alt[field_id]["page"] = reader.get_pages_showing_field(value)[
-                0
-            ].page_number
+
+            if value.get("/FT") == "/Btn" and (value.get("/Ff") or 0) & RADIO_FLAG:
+                # Export value of each radio kid, in widget order
+                form_dict_alt[field_id]["hidden_fields"]["export_values"] = [
+                    next((x for x in widget.states if x != "/Off"), None)
+                    for widget in widget_index[key]["widgets"]
+                ]
+
+            form_dict_alt[field_id]["page"] = widget_index[key]["pages"][0]
+    extracted = perf_counter()
 
     with open(f"{json_name}", "w", encoding="utf-8") as j_file:
         json.dump(form_dict_alt, j_file, ensure_ascii=False, indent=4)
 
-    return form_dict_alt
+    end = perf_counter()
+    if metrics.enabled():
+        metrics.observe("pdf_ops", parsed - start, op="extract", stage="parse")
+        metrics.observe("pdf_ops", indexed - parsed, op="extract", stage="index")
+        metrics.observe("pdf_ops", extracted - indexed, op="extract", stage="extract")
+        metrics.observe("pdf_ops", end - extracted, op="extract", stage="write")
 
+    if not return_stats:
+        return form_dict_alt
+
+    stats = {
+        "fields": len(form_dict_alt),
+        "widgets": sum(len(v["widgets"]) for v in widget_index.values()),
+        "pages": len(reader.pages),
+        "parse_seconds": parsed - start,
+        "index_seconds": indexed - parsed,
+        "extract_seconds": extracted - indexed,
+        "write_seconds": end - extracted,
+        "total_seconds": end - start,
+    }
+    return form_dict_alt, stats
+
+
+class WidgetRef(NamedTuple):
+    page: int
+    # Position in the page's /Annots array, identical in the reader and in a
+    # writer created with writer.append(reader)
+    index: int
+    # Appearance states (/AP /N keys) of widgets with an on/off appearance
+    states: tuple
+
+
+@dataclass(frozen=True)
+class FieldPlan:
+    name: str
+    field_type: str
+    radio: bool
+    widgets: tuple
+    on_state: Optional[str] = None
+    off_state: str = "/Off"
+
+    def resolve(self, answer):
+        """Maps an answer from the extraction JSON to the PDF value, None if unusable."""
+        if self.field_type != "/Btn":
+            return str(answer)
+        # Same mapping as FieldSpec.button_state, the states here come from the PDF itself
+        return button_state(answer, self.radio, self.on_state, self.off_state)
+
+
+@dataclass(frozen=True)
+class AppearanceFont:
+    """A simple (single byte, WinAnsi) font of the form's /DR with its glyph widths."""
+
+    name: str
+    # 256 widths in 1/1000 em, by character code
+    widths: tuple
+    # Base font for standard fonts missing from /DR, written inline into the resources
+    standard: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, name, font):
+        if font.get("/Subtype") not in ("/Type1", "/TrueType"):
+            return None
+        widths = [DEFAULT_GLYPH_WIDTH] * 256
+        descriptor = font.get("/FontDescriptor")
+        if descriptor is not None and "/MissingWidth" in descriptor:
+            widths = [float(descriptor["/MissingWidth"])] * 256
+        first_char = int(font.get("/FirstChar", 0))
+        for code, width in enumerate(font.get("/Widths") or [], start=first_char):
+            if 0 <= code < 256:
+                widths[code] = float(width)
+        return cls(name, tuple(widths))
+
+    def encode(self, text):
+        return text.encode("cp1252", errors="replace")
+
+    def width(self, encoded, size):
+        return sum(self.widths[code] for code in encoded) * size / 1000
+
+    def resource(self):
+        return DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject(self.standard),
+                NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+            }
+        )
+
+
+class WidgetGeometry(NamedTuple):
+    width: float
+    height: float
+    font: str
+    # 0 for auto size
+    font_size: float
+    # Colour operators of /DA, e.g. "0 g"
+    color: str
+    # /Q: 0 left, 1 centered, 2 right
+    align: int
+    multiline: bool
+    # Number of comb cells, 0 for normal fields
+    comb: int
+
+
+def _escape_text(encoded):
+    return (
+        encoded.replace(b"\\", b"\\\\")
+        .replace(b"(", b"\\(")
+        .replace(b")", b"\\)")
+        .replace(b"\r", b"\\r")
+    )
+
+
+class AppearanceGenerator:
+    """
+    Builds the /AP streams of filled text widgets for one template.
+
+    Fonts of /DR and the geometry of every text widget are read once when the
+    template is compiled, a fill only lays out the new values. Widgets that
+    cannot be drawn this way (rotated, composite fonts) are left out, see
+    __contains__.
+    """
+
+    def __init__(self, reader):
+        acro_form = reader.trailer["/Root"].get("/AcroForm") or DictionaryObject()
+        dr_fonts = (acro_form.get("/DR") or DictionaryObject()).get("/Font") or DictionaryObject()
+        self.fonts = {}
+        self.geometry = {}
+        for page_num, index, annotation, field in _iter_widgets(reader):
+            if field.get("/FT") != "/Tx" or _widget_states(annotation):
+                continue
+            geometry = self._geometry(annotation, field, acro_form, dr_fonts)
+            if geometry is not None:
+                self.geometry[(page_num, index)] = geometry
+        # Font resources with the template's object numbers, for incremental updates
+        self.template_resources = self.resources(acro_form)
+
+    def _font(self, name, dr_fonts):
+        if name not in self.fonts:
+            font = None
+            if name in dr_fonts:
+                font = AppearanceFont.from_dict(name, dr_fonts[name].get_object())
+            elif name in STANDARD_FONTS:
+                font = AppearanceFont(name, (DEFAULT_GLYPH_WIDTH,) * 256, STANDARD_FONTS[name])
+            self.fonts[name] = font
+        return self.fonts[name]
+
+    def _geometry(self, annotation, field, acro_form, dr_fonts):
+        if (annotation.get("/MK") or {}).get("/R", 0):
+            return None
+        da = annotation.get("/DA") or field.get("/DA") or acro_form.get("/DA") or "/Helv 0 Tf 0 g"
+        match = _DA_FONT.search(da)
+        if match is None or self._font(match.group(1), dr_fonts) is None:
+            return None
+
+        x1, y1, x2, y2 = (float(v) for v in annotation["/Rect"])
+        flags = field.get("/Ff", 0)
+        max_length = field.get("/MaxLen", 0)
+        return WidgetGeometry(
+            width=abs(x2 - x1),
+            height=abs(y2 - y1),
+            font=match.group(1),
+            font_size=float(match.group(2)),
+            color=(da[: match.start()] + da[match.end() :]).strip() or "0 g",
+            align=int(annotation.get("/Q", field.get("/Q", acro_form.get("/Q", 0)))),
+            multiline=bool(flags & MULTILINE_FLAG),
+            comb=max_length if flags & COMB_FLAG and max_length else 0,
+        )
+
+    def __contains__(self, widget):
+        return (widget.page, widget.index) in self.geometry
+
+    def resources(self, acro_form):
+        """/Resources of the streams, fonts referenced from acro_form's /DR of the target document."""
+        dr_fonts = (acro_form.get("/DR") or DictionaryObject()).get("/Font") or DictionaryObject()
+        fonts = DictionaryObject()
+        for name in {geometry.font for geometry in self.geometry.values()}:
+            font = self.fonts[name]
+            if font.standard is not None:
+                fonts[NameObject(name)] = font.resource()
+            else:
+                fonts[NameObject(name)] = dr_fonts.raw_get(name)
+        return DictionaryObject({NameObject("/Font"): fonts})
+
+    def stream(self, widget, value, resources):
+        """Returns the normal appearance of widget showing value."""
+        geometry = self.geometry[(widget.page, widget.index)]
+        stream = DecodedStreamObject()
+        stream.set_data(self._content(geometry, self.fonts[geometry.font], value))
+        stream.update(
+            {
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject(
+                    [FloatObject(0), FloatObject(0), FloatObject(geometry.width), FloatObject(geometry.height)]
+                ),
+                NameObject("/Resources"): resources,
+            }
+        )
+        return stream
+
+    def _lines(self, geometry, font, value):
+        """Returns the font size and the encoded lines of value."""
+        width = geometry.width - 4
+        if not geometry.multiline:
+            line = font.encode(" ".join(value.split()))
+            size = geometry.font_size
+            if not size:
+                size = min(MAX_AUTO_FONT_SIZE, (geometry.height - 2) / 1.2)
+                text_width = font.width(line, size)
+                if text_width > width > 0:
+                    size = max(MIN_FONT_SIZE, size * width / text_width)
+            return size, [line]
+
+        size = geometry.font_size or MAX_AUTO_FONT_SIZE
+        lines = []
+        for paragraph in value.splitlines() or [""]:
+            line = b""
+            for word in font.encode(paragraph).split(b" "):
+                candidate = line + b" " + word if line else word
+                if line and font.width(candidate, size) > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = candidate
+            lines.append(line)
+        return size, lines
+
+    def _content(self, geometry, font, value):
+        size, lines = self._lines(geometry, font, value)
+        width, height = geometry.width, geometry.height
+        ops = [
+            b"/Tx BMC",
+            b"q",
+            f"1 1 {width - 2:.2f} {height - 2:.2f} re W n".encode("ascii"),
+            b"BT",
+            f"{geometry.font} {size:.2f} Tf {geometry.color}".encode("ascii"),
+        ]
+        if geometry.multiline:
+            baseline = height - 2 - size * 0.9
+        else:
+            # Vertically centered on the cap height
+            baseline = (height - size * 0.7) / 2
+
+        placed = []
+        if geometry.comb:
+            cell = width / geometry.comb
+            for i, code in enumerate(lines[0][: geometry.comb]):
+                char = bytes((code,))
+                placed.append((cell * i + (cell - font.width(char, size)) / 2, baseline, char))
+        else:
+            for i, line in enumerate(lines):
+                text_width = font.width(line, size)
+                x = (2, (width - text_width) / 2, width - 2 - text_width)[min(geometry.align, 2)]
+                placed.append((x, baseline - i * size * 1.15, line))
+        for x, y, text in placed:
+            ops.append(f"1 0 0 1 {x:.2f} {y:.2f} Tm".encode("ascii"))
+            ops.append(b"(" + _escape_text(text) + b") Tj")
+
+        ops += [b"ET", b"Q", b"EMC"]
+        return b"\n".join(ops)
+
+
+@dataclass(frozen=True)
+class FillPlan:
+    """
+    Precompiled mapping from field name to the widget annotations of a template PDF.
+
+    Built once per template, a fill groups the values by page and updates every
+    widget directly instead of rescanning the page annotations for each field.
+    """
+
+    fields: MappingProxyType
+    # Cached fonts and widget geometry for the text appearances
+    appearances: Optional[AppearanceGenerator] = None
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def group_by_page(self, values):
+        pages = defaultdict(list)
+        for name, answer in values.items():
+            if name not in self.fields:
+                raise ValueError(f"Field {name} not found in the original PDF")
+
+            field = self.fields[name]
+            value = field.resolve(answer)
+            if value is None:
+                logging.warning(f"Skipping field {name}, cannot map answer {answer} to a button state")
+                continue
+
+            for widget in field.widgets:
+                pages[widget.page].append((widget, field, value))
+        return pages
+
+    def apply(self, writer, values):
+        writer.set_need_appearances_writer(False)
+        resources = None
+
+        for page_num, widgets in self.group_by_page(values).items():
+            page = writer.pages[page_num]
+            annotations = page["/Annots"]
+            for widget, field, value in widgets:
+                annotation_ref = annotations[widget.index]
+                annotation = annotation_ref.get_object()
+
+                if field.field_type == "/Btn":
+                    _set_button_state(annotation, _field_dict(annotation), widget, value)
+                elif widget.states:
+                    # Text field drawn with checkbox appearances (seen in the
+                    # Einbürgerung form), pypdf cannot regenerate it so only set /V
+                    _field_dict(annotation)[NameObject("/V")] = TextStringObject(value)
+                elif self.appearances is not None and widget in self.appearances:
+                    if resources is None:
+                        # One resource dictionary shared by all streams of the fill
+                        resources = writer._add_object(
+                            self.appearances.resources(writer.root_object["/AcroForm"])
+                        )
+                    _field_dict(annotation)[NameObject("/V")] = TextStringObject(value)
+                    stream = self.appearances.stream(widget, value, resources)
+                    annotation[NameObject(AA.AP)] = DictionaryObject(
+                        {NameObject("/N"): writer._add_object(stream)}
+                    )
+                else:
+                    # Let pypdf build the text appearance stream, restricted to this widget
+                    writer.update_page_form_field_values(
+                        _single_widget_page(page, annotation_ref),
+                        {field.name: value},
+                        auto_regenerate=None,
+                    )
+
+    def changed_objects(self, reader, values):
+        """
+        Returns {object number: (generation, copy)} of the annotation, field
+        and AcroForm dictionaries changed by a fill, for an incremental update.
+
+        The copies are shallow, the reader's objects stay untouched. New
+        appearance streams of text widgets get the next free object numbers,
+        widgets the generator cannot draw lose their stale appearance and
+        /NeedAppearances asks the viewer to draw them.
+        """
+        objects = {}
+        next_number = [reader.trailer["/Size"]]
+
+        def add(obj):
+            number = next_number[0]
+            next_number[0] += 1
+            objects[number] = (0, obj)
+            return IndirectObject(number, 0, reader)
+
+        def modify(ref):
+            if not isinstance(ref, IndirectObject):
+                raise ValueError("Incremental updates need indirect widget and field objects")
+            if ref.idnum not in objects:
+                objects[ref.idnum] = (ref.generation, DictionaryObject(ref.get_object()))
+            return objects[ref.idnum][1]
+
+        need_appearances = False
+        resources = None
+        for page_num, widgets in self.group_by_page(values).items():
+            annotations = reader.pages[page_num]["/Annots"]
+            for widget, field, value in widgets:
+                annotation_ref = annotations[widget.index]
+                original = annotation_ref.get_object()
+                annotation = modify(annotation_ref)
+                if _field_dict(original) is original:
+                    field_dict = annotation
+                else:
+                    field_dict = modify(original.raw_get("/Parent"))
+
+                if field.field_type == "/Btn":
+                    _set_button_state(annotation, field_dict, widget, value)
+                else:
+                    field_dict[NameObject("/V")] = TextStringObject(value)
+                    if self.appearances is not None and widget in self.appearances:
+                        if resources is None:
+                            resources = add(self.appearances.template_resources)
+                        stream = self.appearances.stream(widget, value, resources)
+                        annotation[NameObject(AA.AP)] = DictionaryObject(
+                            {NameObject("/N"): add(stream)}
+                        )
+                    elif not widget.states:
+                        annotation.pop(NameObject("/AP"), None)
+                        need_appearances = True
+
+        if need_appearances:
+            root_ref = reader.trailer.raw_get("/Root")
+            acro_form_ref = root_ref.get_object().raw_get("/AcroForm")
+            if isinstance(acro_form_ref, IndirectObject):
+                acro_form = modify(acro_form_ref)
+            else:
+                acro_form = DictionaryObject(acro_form_ref)
+                modify(root_ref)[NameObject("/AcroForm")] = acro_form
+            acro_form[NameObject("/NeedAppearances")] = BooleanObject(True)
+        return objects
+
+
+def _field_dict(annotation):
+    if ("/FT" in annotation and "/T" in annotation) or "/Parent" not in annotation:
+        return annotation
+    return annotation["/Parent"].get_object()
+
+
+def _qualified_name(field):
+    names = []
+    while field is not None:
+        if "/T" in field:
+            names.append(field["/T"])
+        field = field["/Parent"].get_object() if "/Parent" in field else None
+    return ".".join(reversed(names))
+
+
+def _widget_states(annotation):
+    # Keys of the normal appearance dictionary, empty if it is a single stream
+    if "/AP" not in annotation or "/N" not in annotation["/AP"]:
+        return ()
+    normal_appearance = annotation["/AP"]["/N"].get_object()
+    if isinstance(normal_appearance, StreamObject):
+        return ()
+    return tuple(normal_appearance.keys())
+
+
+def _iter_widgets(reader):
+    """Yields (page_num, annotation index, widget, field dict) in a single pass over all pages."""
+    for page_num, page in enumerate(reader.pages):
+        for index, annotation_ref in enumerate(page.get("/Annots") or []):
+            annotation = annotation_ref.get_object()
+            if annotation.get(AA.Subtype) != "/Widget":
+                continue
+            yield page_num, index, annotation, _field_dict(annotation)
+
+
+def _set_button_state(annotation, field_dict, widget, value):
+    # Same semantics as PdfWriter.update_page_form_field_values for buttons
+    state = NameObject(value if value in widget.states else "/Off")
+    field_dict[NameObject("/V")] = NameObject(value)
+    annotation[NameObject(AA.AS)] = state
+    annotation[NameObject("/V")] = state
 
-def fillPDF(pdf_path, source_json, response):
-    try:
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
 
+def _single_widget_page(page, annotation_ref):
+    view = PageObject(pdf=page.pdf, indirect_reference=page.indirect_reference)
+    view[NameObject("/Annots")] = ArrayObject([annotation_ref])
+    view[NameObject("/Rotate")] = NumberObject(page.rotation)
+    return view
+
+
+def compile_fill_plan(pdf):
+    """Builds a FillPlan from a PdfReader or a path to the template PDF."""
+    reader = pdf if isinstance(pdf, PdfReader) else PdfReader(pdf)
+
+    widgets = defaultdict(list)
+    field_dicts = {}
+    for page_num, index, annotation, field in _iter_widgets(reader):
+        name = field.get("/T")
+        if name is None:
+            continue
+
+        widgets[name].append(WidgetRef(page_num, index, _widget_states(annotation)))
+        field_dicts.setdefault(name, field)
+
+    fields = {}
+    for name, field_widgets in widgets.items():
+        field = field_dicts[name]
+        field_type = field.get("/FT")
+        on_state = None
+        if field_type == "/Btn":
+            on_states = [
+                state
+                for widget in field_widgets
+                for state in widget.states
+                if state != "/Off"
+            ]
+            on_state = on_states[0] if on_states else None
+
+        fields[name] = FieldPlan(
+            name=name,
+            field_type=field_type,
+            radio=bool(field.get("/Ff", 0) & RADIO_FLAG),
+            widgets=tuple(field_widgets),
+            on_state=on_state,
+        )
+
+    return FillPlan(MappingProxyType(fields), AppearanceGenerator(reader))
+
+
+class PdfTemplate:
+    """
+    A template PDF parsed once and kept in memory together with its FillPlan.
+
+    The reader is shared by all fills of the template, the lock serialises
+    access because PdfReader seeks on the underlying stream. pdf_bytes is a
+    bytes object or a read-only mmap of the template file.
+    """
+
+    def __init__(self, pdf_bytes, name=None):
+        self.name = name
+        self.pdf_bytes = pdf_bytes
+        # Where the last cross-reference section starts, the /Prev of an incremental update
+        self.startxref = _find_startxref(pdf_bytes[-1024:])
+        with metrics.span("pdf_ops", op="template", stage="parse"):
+            stream = pdf_bytes if isinstance(pdf_bytes, mmap.mmap) else BytesIO(pdf_bytes)
+            self.reader = PdfReader(stream)
+        with metrics.span("pdf_ops", op="template", stage="compile"):
+            self.fill_plan = compile_fill_plan(self.reader)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_path(cls, pdf_path, use_mmap=False):
+        with open(pdf_path, "rb") as pdf_file:
+            if use_mmap:
+                # The mapping stays valid after the file is closed, pages are
+                # shared with the page cache instead of copied into the process
+                return cls(mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ), name=str(pdf_path))
+            return cls(pdf_file.read(), name=str(pdf_path))
+
+
+def _find_startxref(tail):
+    offsets = _STARTXREF.findall(tail)
+    if not offsets:
+        raise ValueError("No startxref found at the end of the PDF")
+    return int(offsets[-1])
+
+
+def incremental_default():
+    """True if FILL_SAVE_MODE=incremental, the save mode used when none is given."""
+    return os.getenv("FILL_SAVE_MODE") == "incremental"
+
+
+def flatten_default():
+    """True if FILL_SAVE_MODE=flatten."""
+    return os.getenv("FILL_SAVE_MODE") == "flatten"
+
+
+def resolve_save_mode(incremental=None, flatten=None):
+    """
+    Returns (incremental, flatten) with the defaults of FILL_SAVE_MODE for the
+    ones left None. A flattened PDF is never saved incrementally by default,
+    asking for both raises ValueError.
+    """
+    if flatten is None:
+        flatten = flatten_default()
+    if incremental is None:
+        incremental = incremental_default() and not flatten
+    if incremental and flatten:
+        raise ValueError("A flattened PDF cannot be saved as an incremental update")
+    return incremental, flatten
+
+
+@lru_cache(maxsize=16)
+def _cached_pdf_template(pdf_path, mtime_ns, size, use_mmap=False):
+    return PdfTemplate.from_path(pdf_path, use_mmap=use_mmap)
+
+
+def load_pdf_template(pdf_path, use_mmap=None):
+    """
+    Returns the cached PdfTemplate of a template PDF, reloaded when the file changes.
+
+    With use_mmap (default: PDF_TEMPLATE_MMAP=1) the template bytes are mapped
+    instead of read. Replace template files (e.g. os.replace) instead of
+    rewriting them in place while the app runs.
+    """
+    if use_mmap is None:
+        use_mmap = os.getenv("PDF_TEMPLATE_MMAP") == "1"
+    pdf_path = str(Path(pdf_path).resolve())
+    stat = os.stat(pdf_path)
+    return _cached_pdf_template(pdf_path, stat.st_mtime_ns, stat.st_size, use_mmap)
+
+
+def get_fill_plan(pdf_path):
+    """Returns the cached FillPlan of a template PDF, recompiled when the file changes."""
+    return load_pdf_template(pdf_path).fill_plan
+
+
+def _normal_appearance(annotation):
+    """Reference to the appearance stream a viewer shows for annotation, None if there is none."""
+    normal = (annotation.get("/AP") or DictionaryObject()).raw_get("/N")
+    if normal is None:
+        return None
+    if isinstance(normal.get_object(), StreamObject):
+        return normal
+    state = annotation.get(AA.AS)
+    return normal.get_object().raw_get(state) if state in normal.get_object() else None
+
+
+def _placement(appearance, rect):
+    """cm operands mapping the appearance's /BBox (after its /Matrix) onto rect."""
+    x1, y1, x2, y2 = (float(v) for v in appearance.get("/BBox", (0, 0, 1, 1)))
+    a, b, c, d, e, f = (float(v) for v in appearance.get("/Matrix", (1, 0, 0, 1, 0, 0)))
+    xs, ys = zip(*((x * a + y * c + e, x * b + y * d + f) for x in (x1, x2) for y in (y1, y2)))
+    rx1, ry1, rx2, ry2 = (float(v) for v in rect)
+    rx1, rx2 = sorted((rx1, rx2))
+    ry1, ry2 = sorted((ry1, ry2))
+    sx = (rx2 - rx1) / (max(xs) - min(xs)) if max(xs) > min(xs) else 1
+    sy = (ry2 - ry1) / (max(ys) - min(ys)) if max(ys) > min(ys) else 1
+    return f"{sx:.6f} 0 0 {sy:.6f} {rx1 - min(xs) * sx:.4f} {ry1 - min(ys) * sy:.4f}"
+
+
+def _flatten_form(writer):
+    """
+    Draws the current appearance of every visible widget into its page and
+    removes the widgets and the AcroForm, the result has no editable fields.
+    """
+    for page in writer.pages:
+        annotations = page.get("/Annots")
+        if not annotations:
+            continue
+
+        resources = DictionaryObject(page.get("/Resources") or DictionaryObject())
+        xobjects = DictionaryObject(resources.get("/XObject") or DictionaryObject())
+        drawing = []
+        kept = ArrayObject()
+        for annotation_ref in annotations:
+            annotation = annotation_ref.get_object()
+            if annotation.get(AA.Subtype) != "/Widget":
+                kept.append(annotation_ref)
+                continue
+            appearance = _normal_appearance(annotation)
+            if appearance is None or annotation.get("/F", 0) & HIDDEN_FLAGS:
+                continue
+            name = NameObject(f"/TdFlat{len(drawing)}")
+            xobjects[name] = appearance
+            placement = _placement(appearance.get_object(), annotation["/Rect"])
+            drawing.append(f"q {placement} cm {name} Do Q")
+
+        if drawing:
+            resources[NameObject("/XObject")] = xobjects
+            page[NameObject("/Resources")] = resources
+            # The page content is wrapped in q/Q so its graphics state does not leak into the fields
+            before, after = DecodedStreamObject(), DecodedStreamObject()
+            before.set_data(b"q")
+            after.set_data(("Q\n" + "\n".join(drawing)).encode("ascii"))
+            contents = page.raw_get("/Contents")
+            if contents is None:
+                contents = []
+            elif isinstance(contents.get_object(), ArrayObject):
+                contents = list(contents.get_object())
+            else:
+                contents = [contents]
+            page[NameObject("/Contents")] = ArrayObject(
+                [writer._add_object(before), *contents, writer._add_object(after)]
+            )
+        if kept:
+            page[NameObject("/Annots")] = kept
+        else:
+            del page["/Annots"]
+
+    writer.root_object.pop(NameObject("/AcroForm"), None)
+
+
+def _write_filled_pdf(reader, fill_plan, values, output_stream, flatten=False):
+    writer = PdfWriter()
+    with metrics.span("pdf_ops", op="fill", stage="clone"):
         writer.append(reader)
+    with metrics.span("pdf_ops", op="fill", stage="fill"):
+        fill_plan.apply(writer, values)
+    if flatten:
+        with metrics.span("pdf_ops", op="fill", stage="flatten"):
+            _flatten_form(writer)
+    with metrics.span("pdf_ops", op="fill", stage="write"):
+        writer.write(output_stream)
+
+
+def _runs(numbers):
+    """Splits sorted object numbers into runs of consecutive numbers (xref subsections)."""
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][-1] + 1 == number:
+            runs[-1].append(number)
+        else:
+            runs.append([number])
+    return runs
+
+
+def _xref_is_stream(reader, startxref):
+    """
+    True if the cross-reference section at startxref is a stream, False for
+    an xref table. The merged trailer of pypdf does not tell, a file can end
+    in a table after earlier stream sections and the other way round.
+    """
+    stream = reader.stream
+    position = stream.tell()
+    try:
+        stream.seek(startxref)
+        head = stream.read(32)
+    finally:
+        stream.seek(position)
+    if head.lstrip().startswith(b"xref"):
+        return False
+    if _XREF_STREAM_START.match(head):
+        return True
+    logging.warning(f"No cross-reference section at offset {startxref}, using the trailer")
+    return reader.trailer.get("/Type") == "/XRef"
+
+
+def _write_increment(reader, fill_plan, values, offset, startxref, output_stream):
+    """
+    Writes a fill as an incremental update of the document read by reader:
+    the changed objects, a cross-reference section for them and a trailer
+    pointing back to the original one. offset is the length of the original
+    document, the update is meant to be written right after it.
+
+    The cross-reference section has the format of the original, a table or
+    a cross-reference stream.
+    """
+    if reader.is_encrypted:
+        raise ValueError("Incremental updates of encrypted PDFs are not supported")
+
+    with metrics.span("pdf_ops", op="fill", stage="fill"):
+        objects = fill_plan.changed_objects(reader, values)
+
+    with metrics.span("pdf_ops", op="fill", stage="write"):
+        buffer = BytesIO()
+        # The original may end without a newline after %%EOF
+        buffer.write(b"\n")
+        positions = {}
+        for number in sorted(objects):
+            generation, obj = objects[number]
+            positions[number] = (offset + buffer.tell(), generation)
+            buffer.write(f"{number} {generation} obj\n".encode("ascii"))
+            obj.write_to_stream(buffer)
+            buffer.write(b"\nendobj\n")
+
+        trailer = reader.trailer
+        entries = {
+            NameObject("/Root"): trailer.raw_get("/Root"),
+            NameObject("/Prev"): NumberObject(startxref),
+        }
+        for key in ("/Info", "/ID"):
+            if key in trailer:
+                entries[NameObject(key)] = trailer.raw_get(key)
+        size = max(trailer["/Size"], max(objects, default=0) + 1)
+        xref_start = offset + buffer.tell()
+
+        if _xref_is_stream(reader, startxref):
+            # The stream lists itself, as the next free object number
+            positions[size] = (xref_start, 0)
+            runs = _runs(sorted(positions))
+            xref = StreamObject()
+            xref.set_data(
+                b"".join(
+                    struct.pack(">BIH", 1, *positions[number]) for run in runs for number in run
+                )
+            )
+            xref.update(entries)
+            xref.update(
+                {
+                    NameObject("/Type"): NameObject("/XRef"),
+                    NameObject("/Size"): NumberObject(size + 1),
+                    NameObject("/W"): ArrayObject([NumberObject(w) for w in (1, 4, 2)]),
+                    NameObject("/Index"): ArrayObject(
+                        [NumberObject(n) for run in runs for n in (run[0], len(run))]
+                    ),
+                }
+            )
+            buffer.write(f"{size} 0 obj\n".encode("ascii"))
+            xref.write_to_stream(buffer)
+            buffer.write(b"\nendobj\n")
+        else:
+            buffer.write(b"xref\n")
+            for run in _runs(sorted(positions)):
+                buffer.write(f"{run[0]} {len(run)}\n".encode("ascii"))
+                for number in run:
+                    position, generation = positions[number]
+                    buffer.write(f"{position:010d} {generation:05d} n\r\n".encode("ascii"))
+            entries[NameObject("/Size")] = NumberObject(size)
+            buffer.write(b"trailer\n")
+            DictionaryObject(entries).write_to_stream(buffer)
+            buffer.write(b"\n")
+
+        buffer.write(f"startxref\n{xref_start}\n%%EOF\n".encode("ascii"))
+        output_stream.write(buffer.getvalue())
+
+
+def _fill_increment(template, values):
+    """Returns the incremental update of a fill of template, without the original bytes."""
+    increment = BytesIO()
+    with template.lock:
+        _write_increment(
+            template.reader,
+            template.fill_plan,
+            values,
+            len(template.pdf_bytes),
+            template.startxref,
+            increment,
+        )
+    return increment.getvalue()
+
+
+def write_filled_pdf(template, values, output_stream, incremental=None, flatten=None):
+    """
+    Fills a PdfTemplate and writes the filled document to output_stream.
+
+    With incremental (default: FILL_SAVE_MODE=incremental) the original bytes
+    are written unchanged, straight from the template's buffer or mmap, and
+    followed by an update with only the changed field objects, so the work
+    per fill grows with the number of filled fields instead of the document.
+    flatten (default: FILL_SAVE_MODE=flatten) draws the fields into the pages
+    and removes the form, it always rewrites the document.
+    """
+    incremental, flatten = resolve_save_mode(incremental, flatten)
+
+    values = {k: v for k, v in values.items() if v}
+    if incremental:
+        increment = _fill_increment(template, values)
+        output_stream.write(memoryview(template.pdf_bytes))
+        output_stream.write(increment)
+        return
+    with template.lock:
+        _write_filled_pdf(template.reader, template.fill_plan, values, output_stream, flatten)
+
+
+def fill_pdf_bytes(template, values, incremental=None, flatten=None):
+    """
+    Fills a template PDF in memory and returns the filled document as bytes.
+
+    template is a PdfTemplate or a path to a template PDF (loaded through the
+    template cache). Empty answers are skipped, unknown fields raise ValueError.
+    incremental and flatten select the save mode, see write_filled_pdf.
+    """
+    if not isinstance(template, PdfTemplate):
+        template = load_pdf_template(template)
+    incremental, flatten = resolve_save_mode(incremental, flatten)
+
+    values = {k: v for k, v in values.items() if v}
+    if incremental:
+        # The original bytes are copied once, into the returned document
+        return b"".join((template.pdf_bytes, _fill_increment(template, values)))
+
+    output = BytesIO()
+    write_filled_pdf(template, values, output, incremental=incremental, flatten=flatten)
+    return output.getvalue()
+
+
+def fillPDF(pdf_path, source_json, response, fill_plan=None, incremental=None, flatten=None):
+    try:
+        incremental, flatten = resolve_save_mode(incremental, flatten)
+
+        with metrics.span("pdf_ops", op="fill", stage="parse"):
+            reader = PdfReader(pdf_path)
+
+        if fill_plan is None:
+            fill_plan = compile_fill_plan(reader)
+
+        template = as_template(source_json)
 
         # TODO : Implement retry mechanism
+        values = {}
         for k, v in response.items():
 
             if v:
                 print(f"Filling field {k} with value {v}")
 
-                if k not in source_json.keys():
+                if k not in template:
                     raise ValueError(f"Field {k} not found in the original PDF")
 
-                page_num = source_json[k]["page"]
-                if source_json[k].get("type") == "/Tx":
-                    value = v
-
-                elif source_json[k].get("type") == "/Btn":
-                    if v.strip().lower() == "ja" or v.strip().lower() == "yes":
-                        # 49152 is radio button in teh form
-                        if source_json[k]["hidden_fields"].get("FF") != 49152:
-                            value = source_json[k]["hidden_fields"].get("on_state")
-                        else:
-                            value = "/0"
-
-                    elif v.strip().lower() == "nein" or v.strip().lower() == "no":
-                        if source_json[k]["hidden_fields"].get("FF") != 49152:
-                            value = source_json[k]["hidden_fields"].get("off_state")
-                        else:
-                            value = "/1"
-
-                writer.update_page_form_field_values(
-                    writer.pages[page_num],
-                    {k: value},
-                    auto_regenerate=False,
-                )
+                values[k] = v
 
-        with open(pdf_path, "wb") as output_stream:
-            writer.write(output_stream)
+        if incremental:
+            # Only the update is appended, the rest of the file stays as it is
+            size = os.path.getsize(pdf_path)
+            with open(pdf_path, "rb") as pdf_file:
+                pdf_file.seek(max(0, size - 1024))
+                startxref = _find_startxref(pdf_file.read())
+            with open(pdf_path, "ab") as output_stream:
+                _write_increment(reader, fill_plan, values, size, startxref, output_stream)
+        else:
+            with open(pdf_path, "wb") as output_stream:
+                _write_filled_pdf(reader, fill_plan, values, output_stream, flatten)
 
     except Exception as e:
         print(f"Error filling PDF: {e}")
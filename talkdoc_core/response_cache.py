@@ -0,0 +1,267 @@
+"""
+Content-addressed cache for non-streaming GPTService.chat responses.
+
+The key is the SHA-256 of the model, the messages and the response format.
+Entries live in a bounded in-memory LRU and, when a directory is given, in an
+on-disk tier (one JSON file per key) that evicts the least recently used
+files once it grows beyond max_disk_bytes. In replay mode nothing is
+recorded and a miss raises CacheMissError, so tests and benchmarks can run
+offline against previously recorded responses.
+
+The disk tier stores the chat transcripts of the requests in plain text,
+including the applicants' personal data (names, dates of birth, IBANs),
+and it is shared by all users of the process. It is off unless a directory
+is given. Entries expire after disk_ttl seconds (a day by default) and are
+purged when the cache opens, or with
+
+    python -m talkdoc_core.response_cache .response_cache [--all]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_DISK_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_TTL = 24 * 3600
+
+
+class CacheMissError(KeyError):
+    """Raised in replay mode when no recorded response exists for a request."""
+
+
+def cache_key(model, messages, response_format=None):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "response_format": response_format},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    expired: int = 0
+
+    @property
+    def hit_rate(self):
+        hits = self.memory_hits + self.disk_hits
+        return hits / (hits + self.misses) if hits + self.misses else 0.0
+
+    def as_dict(self):
+        return {**asdict(self), "hit_rate": round(self.hit_rate, 4)}
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        directory=None,
+        max_disk_bytes=DEFAULT_MAX_DISK_BYTES,
+        replay=False,
+        disk_ttl=DEFAULT_DISK_TTL,
+    ):
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.replay = replay
+        # Seconds a response stays on disk, None keeps it until evicted by
+        # size. Recorded responses never expire in replay mode
+        self.disk_ttl = None if replay else disk_ttl
+        self.stats = CacheStats()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.purge_expired()
+            self._disk_bytes = sum(p.stat().st_size for p in self._disk_entries())
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _disk_entries(self):
+        return self.directory.glob("*/*.json")
+
+    def _expired(self, created, now=None):
+        return self.disk_ttl is not None and (now or time.time()) - created > self.disk_ttl
+
+    def purge_expired(self):
+        """Deletes the disk entries older than disk_ttl, returns their number."""
+        if not self.directory or self.disk_ttl is None:
+            return 0
+        now = time.time()
+        purged = 0
+        for path in list(self._disk_entries()):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    created = json.load(file).get("created", 0)
+            except (OSError, ValueError):
+                created = 0
+            if self._expired(created, now):
+                path.unlink(missing_ok=True)
+                purged += 1
+        if purged:
+            logging.info(f"Purged {purged} expired responses from {self.directory}")
+        return purged
+
+    def get(self, key):
+        """Returns the cached response or None, raises CacheMissError on a miss in replay mode."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return self._memory[key]
+
+        response = self._read_disk(key)
+        with self._lock:
+            if response is None:
+                self.stats.misses += 1
+            else:
+                self.stats.disk_hits += 1
+                self._remember(key, response)
+
+        if response is None and self.replay:
+            raise CacheMissError(f"No recorded response for {key}")
+        return response
+
+    def put(self, key, response, model=None):
+        if self.replay:
+            return
+        with self._lock:
+            self.stats.stores += 1
+            self._remember(key, response)
+        if self.directory:
+            self._write_disk(key, response, model)
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+        if self._expired(entry.get("created", 0)):
+            with self._lock:
+                if path.exists():
+                    self._disk_bytes -= path.stat().st_size
+                    path.unlink(missing_ok=True)
+                self.stats.expired += 1
+            return None
+        if not self.replay:
+            # The modification time orders the entries for eviction
+            os.utime(path)
+        return entry["response"]
+
+    def _write_disk(self, key, response, model):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Own temporary file per writer, sessions may miss on the same prompt
+        # at once. mkstemp creates it readable by the owner only
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{key}-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(
+                    {"key": key, "model": model, "created": int(time.time()), "response": response},
+                    file,
+                    ensure_ascii=False,
+                )
+            with self._lock:
+                old_size = path.stat().st_size if path.exists() else 0
+                os.replace(tmp_path, path)
+                self._disk_bytes += path.stat().st_size - old_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk(keep=path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict_disk(self, keep):
+        entries = sorted(
+            ((p.stat().st_mtime_ns, p) for p in self._disk_entries() if p != keep),
+            key=lambda entry: entry[0],
+        )
+        for _, path in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+            self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.directory:
+                for path in self._disk_entries():
+                    path.unlink(missing_ok=True)
+                self._disk_bytes = 0
+
+
+def response_cache_from_env():
+    """
+    Builds the shared cache from the environment, None if caching is off.
+
+    RESPONSE_CACHE=1 enables the in-memory LRU, RESPONSE_CACHE_DIR adds the
+    disk tier (plain text transcripts, see the module docstring) that keeps
+    responses for RESPONSE_CACHE_TTL seconds, RESPONSE_CACHE_REPLAY=1 serves
+    recorded responses only.
+    """
+    directory = os.getenv("RESPONSE_CACHE_DIR")
+    if not (directory or os.getenv("RESPONSE_CACHE")):
+        return None
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        directory=directory,
+        max_disk_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", DEFAULT_MAX_DISK_BYTES)),
+        replay=os.getenv("RESPONSE_CACHE_REPLAY") == "1",
+        disk_ttl=int(os.getenv("RESPONSE_CACHE_TTL", DEFAULT_DISK_TTL)),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purges the disk tier of the response cache")
+    parser.add_argument("directory", help="the RESPONSE_CACHE_DIR to purge")
+    parser.add_argument("--all", action="store_true", help="delete every entry, not only expired ones")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_DISK_TTL, help="seconds an entry is kept")
+    args = parser.parse_args(argv)
+
+    cache = ResponseCache(directory=args.directory, disk_ttl=args.ttl)
+    if args.all:
+        cache.clear()
+    print(f"{sum(1 for _ in cache._disk_entries())} responses left in {args.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
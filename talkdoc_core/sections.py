@@ -0,0 +1,141 @@
+"""
+Section-scoped chat prompts for large forms.
+
+Instead of the whole field list, the chat model gets a short outline of all
+sections with their progress and the field lines of the current section
+only, so the prompt size per turn no longer grows with the form. Sections
+follow the template order: runs of fields on the same PDF page, split evenly
+above max_fields fields and merged with their neighbours while the merged
+section stays within max_fields.
+The current section follows the conversation: it holds the field after the
+last answered one (in template order), skipped fields do not hold it back.
+"""
+
+import logging
+import math
+
+from collections import Counter
+from dataclasses import dataclass
+
+from talkdoc_core.prompts import CompactFields, _label_prefixes, get_section_prompt
+from talkdoc_core.template_model import as_template
+
+logging.basicConfig(level=logging.INFO)
+
+MAX_SECTION_FIELDS = 30
+
+
+@dataclass(frozen=True)
+class Section:
+    # Sorted page indices
+    pages: tuple
+    title: str
+    # Field names in template order
+    fields: tuple
+    # Compact field lines, with the aliases of the whole form
+    text: str
+
+    @property
+    def label(self):
+        pages = ", ".join(str(page) for page in self.pages)
+        label = f"Seite {pages}" if len(self.pages) == 1 else f"Seiten {pages}"
+        return f"{label} – {self.title}" if self.title else label
+
+
+def _section_title(labels):
+    """Heading shared by at least half of the labels, e.g. "A. Persönliche Daten", or ""."""
+    counts = Counter()
+    for label in labels:
+        # Drop the field kind ("Ausfüllfeld; ...") in front of the hierarchy
+        if "; " in label:
+            label = label.split("; ", 1)[1]
+        prefixes = _label_prefixes(label)
+        if prefixes:
+            counts[prefixes[0].rstrip(" ;>-:")] += 1
+    if not counts:
+        return ""
+    title, count = counts.most_common(1)[0]
+    return title if count > 1 and 2 * count >= len(labels) else ""
+
+
+class FormSections:
+    def __init__(self, json_fields, max_fields=MAX_SECTION_FIELDS):
+        self.json_fields = json_fields = as_template(json_fields)
+        self.compact = CompactFields(json_fields)
+        self.order = list(json_fields)
+        self.sections = tuple(self._split(max_fields))
+        self._section_of = {
+            name: i for i, section in enumerate(self.sections) for name in section.fields
+        }
+        self._position = {name: i for i, name in enumerate(self.order)}
+
+    def _split(self, max_fields):
+        # Runs in template order, the order the chat walks through the form
+        runs = []
+        for name, field in self.json_fields.items():
+            if not runs or runs[-1][0] != field.page:
+                runs.append((field.page, []))
+            runs[-1][1].append(name)
+
+        groups = []
+        for page, names in runs:
+            # Even chunks, e.g. 81 fields become 3 x 27 instead of 30 + 30 + 21
+            count = math.ceil(len(names) / max_fields)
+            bounds = [len(names) * i // count for i in range(count + 1)]
+            for start, end in zip(bounds, bounds[1:]):
+                chunk = names[start:end]
+                if groups and len(groups[-1]) + len(chunk) <= max_fields:
+                    groups[-1] += chunk
+                else:
+                    groups.append(list(chunk))
+
+        for fields in groups:
+            labels = [
+                " ".join(str(self.json_fields[name].label or "").split())
+                for name in fields
+            ]
+            subset = {name: self.json_fields[name] for name in fields}
+            yield Section(
+                pages=tuple(sorted({field.page for field in subset.values()})),
+                title=_section_title(labels),
+                fields=tuple(fields),
+                text=CompactFields(subset, names=self.compact.names).text,
+            )
+
+    def current(self, values):
+        """Index of the section holding the field after the last answered one."""
+        answered = [self._position[k] for k, v in values.items() if v and k in self._position]
+        if not answered:
+            return 0
+        following = min(max(answered) + 1, len(self.order) - 1)
+        return self._section_of[self.order[following]]
+
+    def outline(self, values, current):
+        lines = []
+        for i, section in enumerate(self.sections):
+            answered = sum(1 for name in section.fields if values.get(name))
+            marker = " ← aktuell" if i == current else ""
+            lines.append(
+                f"{i + 1}. {section.label}: {answered}/{len(section.fields)} beantwortet{marker}"
+            )
+        return "\n".join(lines)
+
+    def prompt(self, values):
+        if not self.sections:
+            return get_section_prompt("", 0, 0, "", "")
+        current = self.current(values)
+        section = self.sections[current]
+        return get_section_prompt(
+            self.outline(values, current),
+            sum(1 for name in self.order if values.get(name)),
+            len(self.order),
+            f"{current + 1}. {section.label}",
+            section.text,
+        )
+
+    def message(self, values):
+        """System message for the end of the chat context, values are the extracted answers."""
+        return {"role": "system", "content": self.prompt(values)}
+
+    def __len__(self):
+        return len(self.sections)
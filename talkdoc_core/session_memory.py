@@ -0,0 +1,78 @@
+"""
+Memory report of one chat session.
+
+Sizes the objects a session keeps in st.session_state. Objects reachable
+from the shared data (the FormEntry or FormBundle with its template,
+sections and rules, the prompt store, the cached greeting) are counted once
+as shared and not per session, so the own bytes of a session are what grows
+with its conversation: messages, extracted values and the context summary.
+Sizes are sys.getsizeof over the object graph, an estimate rather than an
+exact allocation count.
+"""
+
+import gc
+import logging
+import sys
+import types
+
+from dataclasses import dataclass
+
+logging.basicConfig(level=logging.INFO)
+
+# Neither owned by a session nor shared form data, not followed
+_SKIP_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+    types.FrameType,
+)
+
+
+def _walk(roots, skip_ids):
+    """Yields the objects reachable from roots, each once, without the ones in skip_ids."""
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in skip_ids or isinstance(obj, _SKIP_TYPES):
+            continue
+        skip_ids.add(id(obj))
+        yield obj
+        stack.extend(gc.get_referents(obj))
+
+
+@dataclass(frozen=True)
+class MemoryReport:
+    # {session state key: bytes owned by the session}
+    own: dict
+    # Bytes of the shared data, the same for every session on the form
+    shared: int
+
+    @property
+    def total_own(self):
+        return sum(self.own.values())
+
+    def format(self):
+        largest = sorted(self.own.items(), key=lambda item: item[1], reverse=True)
+        parts = ", ".join(f"{key} {size / 1024:.1f} KB" for key, size in largest)
+        return (
+            f"Session {self.total_own / 1024:.1f} KB own ({parts}), "
+            f"{self.shared / 1024:.1f} KB shared"
+        )
+
+
+def session_memory_report(state, shared_roots=()):
+    """
+    Returns the MemoryReport of a session, state maps the session state keys
+    to their values. An object referenced from several keys is counted for
+    the first key only.
+    """
+    seen = set()
+    shared_size = sum(sys.getsizeof(obj) for obj in _walk(shared_roots, seen))
+    own = {
+        key: sum(sys.getsizeof(obj) for obj in _walk([value], seen))
+        for key, value in state.items()
+    }
+    return MemoryReport(own=own, shared=shared_size)
@@ -0,0 +1,268 @@
+"""
+Local stand-in for the OpenAI chat completions API, for offline end-to-end
+runs, load tests and benchmarks.
+
+    python -m talkdoc_core.stub_server --port 8001 --latency 0.3 --token-rate 80
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 streamlit run Chat.py
+
+Supports POST /v1/chat/completions (incl. SSE streaming, stream_options and
+response_format json_object) and GET /v1/models. Answers come from scripted
+responses (first rule whose match is contained in the last message) or,
+without a match, a fixed greeting, for json_object requests a JSON object
+that answers every field listed in the prompt.
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Union
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_REPLY = "Hallo! Ich begleite Sie durch den Antrag. Wie lautet Ihr Vorname?"
+
+# Field keys of the compact field list ("f1|T|...") and of the JSON encoding ("'name': {'/TU'")
+_COMPACT_FIELD = re.compile(r"^\s*(f\d+)\|([A-Z])\|", re.MULTILINE)
+_JSON_FIELD = re.compile(r"'([^']+)': \{'/TU': (?:'[^']*'|\"[^\"]*\"|None), 'type': '(/\w+)'")
+_TOKEN = re.compile(r"\S+\s*|\s+")
+# The field block of the extraction prompts, the examples before it are ignored
+_FIELD_BLOCK = re.compile(r"<input_json><!\[CDATA\[(.*?)\]\]></input_json>", re.DOTALL)
+
+
+@dataclass
+class ScriptedResponse:
+    content: Union[str, dict]
+    # Substring of the last message, None matches every request
+    match: Optional[str] = None
+
+    def text(self):
+        if isinstance(self.content, str):
+            return self.content
+        return json.dumps(self.content, ensure_ascii=False)
+
+
+@dataclass
+class StubConfig:
+    # Seconds before the first token
+    latency: float = 0.0
+    # Streamed tokens per second, 0 sends them without delay
+    token_rate: float = 0.0
+    # Share of requests answered with 429
+    error_rate: float = 0.0
+    responses: list = field(default_factory=list)
+
+    @classmethod
+    def load_script(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as file:
+            rules = json.load(file)
+        return cls(responses=[ScriptedResponse(**rule) for rule in rules], **kwargs)
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def answer_fields(prompt):
+    """Answers every field of the field block in prompt, "Ja" for buttons and "Test" otherwise."""
+    block = _FIELD_BLOCK.search(prompt)
+    if block:
+        prompt = block.group(1)
+    fields = _COMPACT_FIELD.findall(prompt) or [
+        (name, "B" if field_type == "/Btn" else "T")
+        for name, field_type in _JSON_FIELD.findall(prompt)
+    ]
+    return {name: "Ja" if field_type == "B" else "Test" for name, field_type in fields}
+
+
+class StubState:
+    def __init__(self, config):
+        self.config = config
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def reply(self, body):
+        messages = body.get("messages") or []
+        last = str(messages[-1].get("content", "")) if messages else ""
+        for rule in self.config.responses:
+            if rule.match is None or rule.match in last:
+                return rule.text()
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_object":
+            return json.dumps(answer_fields(last), ensure_ascii=False)
+        return DEFAULT_REPLY
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                200, {"object": "list", "data": [{"id": "gpt-4.1", "object": "model", "created": 0, "owned_by": "stub"}]}
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        config = self.state.config
+        number = self.state.count_request()
+        if config.error_rate and random.random() < config.error_rate:
+            self._send_json(429, {"error": {"message": "Rate limit reached (stub)", "type": "requests"}})
+            return
+
+        content = self.state.reply(body)
+        completion_id = f"chatcmpl-stub-{number}"
+        model = body.get("model", "gpt-4.1")
+        prompt_text = "".join(str(m.get("content", "")) for m in body.get("messages") or [])
+        tokens = _TOKEN.findall(content)
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt_text),
+            "completion_tokens": len(tokens),
+            "total_tokens": estimate_tokens(prompt_text) + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+        time.sleep(config.latency)
+        if not body.get("stream"):
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content},
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, **extra):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                **extra,
+            }
+            self._send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        try:
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}}])
+            for token in tokens:
+                if config.token_rate:
+                    time.sleep(1 / config.token_rate)
+                event([{"index": 0, "delta": {"content": token}}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event([], usage=usage)
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. a cancelled stream
+            pass
+
+
+class StubServer:
+    """Runs the stub on a background thread, port 0 picks a free port."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        handler = type("Handler", (StubHandler,), {"state": StubState(self.config)})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.state = handler.state
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="streamed tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--script", help='JSON list of {"match": ..., "content": ...} rules')
+    args = parser.parse_args(argv)
+
+    options = {"latency": args.latency, "token_rate": args.token_rate, "error_rate": args.error_rate}
+    config = StubConfig.load_script(args.script, **options) if args.script else StubConfig(**options)
+    server = StubServer(config, args.host, args.port)
+    logging.info(f"Stub server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Typed field model of the form templates.
+
+The templates in form_templates/ map each PDF field name to
+
+    {"hidden_fields": {"FF": 49152, "on_state": ..., "off_state": ...},
+     "/TU": "label", "type": "/Btn", "page": 0}
+
+FormTemplate turns such a dict into FieldSpec objects with the field flags
+decoded (49152 = RADIO | NO_TOGGLE_TO_OFF) and the button states
+normalized, the prompts, the extraction and the PDF fill read these typed
+attributes instead of string keys. as_template accepts a FormTemplate, a
+template dict or a dict of FieldSpecs (e.g. a subset of a template).
+
+compile_template writes a template as a compact artifact next to the JSON
+(<name>.tplc: a zlib compressed pickle of column arrays). load_template
+reads it instead of the JSON when it was compiled from the same content:
+
+    python -m talkdoc_core.template_model form_templates/*.json
+
+The artifacts are pickles, only load the ones built from your own templates.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import pickle
+import zlib
+
+from array import array
+from collections.abc import Mapping
+from enum import IntFlag
+from pathlib import Path
+from typing import Optional
+
+logging.basicConfig(level=logging.INFO)
+
+TEMPLATE_FORMAT = 1
+COMPILED_SUFFIX = ".tplc"
+
+# Answers accepted for buttons, compared lower case and stripped
+YES_ANSWERS = ("ja", "yes", "on")
+NO_ANSWERS = ("nein", "no", "off")
+
+
+class FieldFlag(IntFlag):
+    """Bits of the /Ff field flags (PDF 1.7, tables 221, 226 and 228)."""
+
+    READ_ONLY = 1
+    REQUIRED = 1 << 1
+    NO_EXPORT = 1 << 2
+    MULTILINE = 1 << 12
+    PASSWORD = 1 << 13
+    NO_TOGGLE_TO_OFF = 1 << 14
+    RADIO = 1 << 15
+    PUSHBUTTON = 1 << 16
+    DO_NOT_SPELL_CHECK = 1 << 22
+    DO_NOT_SCROLL = 1 << 23
+    COMB = 1 << 24
+
+
+# /Ff bit 16, set for radio button groups (49152 in the templates = radio + NoToggleToOff)
+RADIO_FLAG = int(FieldFlag.RADIO)
+
+
+def answer_state(answer):
+    """True for a yes/on answer, False for no/off, None for anything else."""
+    answer = str(answer).strip().lower()
+    if answer in YES_ANSWERS:
+        return True
+    if answer in NO_ANSWERS:
+        return False
+    return None
+
+
+def button_state(answer, radio, on_state, off_state=None):
+    """
+    PDF state of a button for a yes/no answer, None if the answer or the on
+    state is unknown. Shared by FieldSpec and the fill plans of pdf_ops.
+    """
+    state = answer_state(answer)
+    if state is None:
+        return None
+    # Radio groups in our forms use export value /0 for yes and /1 for no
+    if radio:
+        return "/0" if state else "/1"
+    return on_state if state else (off_state or "/Off")
+
+
+def _state(name):
+    # Appearance state names, stored with and without the leading slash
+    if name is None:
+        return None
+    name = str(name)
+    return name if name.startswith("/") else f"/{name}"
+
+
+class FieldSpec:
+    """One field of a template. Read-only, instances are shared between sessions."""
+
+    __slots__ = (
+        "name",
+        "label",
+        "field_type",
+        "page",
+        "flags",
+        "on_state",
+        "off_state",
+        "export_values",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        label: Optional[str],
+        field_type: Optional[str],
+        page: int = 0,
+        flags: FieldFlag = FieldFlag(0),
+        on_state: Optional[str] = None,
+        off_state: Optional[str] = None,
+        export_values: tuple = (),
+    ):
+        set_slot = object.__setattr__
+        set_slot(self, "name", name)
+        set_slot(self, "label", label)
+        set_slot(self, "field_type", field_type)
+        set_slot(self, "page", page)
+        set_slot(self, "flags", FieldFlag(flags))
+        set_slot(self, "on_state", _state(on_state))
+        set_slot(self, "off_state", _state(off_state))
+        set_slot(self, "export_values", tuple(_state(v) for v in export_values))
+
+    @classmethod
+    def from_json(cls, name, field):
+        hidden = field.get("hidden_fields") or {}
+        return cls(
+            name=name,
+            label=field.get("/TU"),
+            field_type=field.get("type"),
+            page=field.get("page", 0),
+            flags=FieldFlag(hidden.get("FF") or 0),
+            on_state=hidden.get("on_state"),
+            off_state=hidden.get("off_state"),
+            export_values=hidden.get("export_values") or (),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"FieldSpec is read-only, use replace() to change {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError("FieldSpec is read-only")
+
+    def replace(self, **changes):
+        values = {slot: getattr(self, slot) for slot in self.__slots__}
+        values.update(changes)
+        return FieldSpec(**values)
+
+    @property
+    def is_button(self):
+        return self.field_type == "/Btn"
+
+    @property
+    def is_text(self):
+        return self.field_type == "/Tx"
+
+    @property
+    def radio(self):
+        return self.is_button and FieldFlag.RADIO in self.flags
+
+    @property
+    def multiline(self):
+        return self.is_text and FieldFlag.MULTILINE in self.flags
+
+    @property
+    def yes_state(self):
+        return self.button_state(YES_ANSWERS[0])
+
+    @property
+    def no_state(self):
+        return self.button_state(NO_ANSWERS[0])
+
+    def button_state(self, answer):
+        """PDF state for a yes/no answer, None if the answer or the on state is unknown."""
+        return button_state(answer, self.radio, self.on_state, self.off_state)
+
+    def to_prompt_dict(self):
+        """The attributes shown to the model, the template dict without hidden_fields."""
+        return {"/TU": self.label, "type": self.field_type, "page": self.page}
+
+    def __eq__(self, other):
+        if not isinstance(other, FieldSpec):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.name, self.field_type, self.page))
+
+    def __repr__(self):
+        return f"FieldSpec({self.name!r}, {self.field_type}, page={self.page}, flags={self.flags!r})"
+
+    def __reduce__(self):
+        return (FieldSpec, tuple(getattr(self, slot) for slot in self.__slots__))
+
+    @classmethod
+    def _restore(cls, values):
+        # Values in slot order, already normalized, e.g. from a compiled template
+        spec = object.__new__(cls)
+        for setter, value in zip(_SLOT_SETTERS, values):
+            setter(spec, value)
+        return spec
+
+
+# The slot descriptors set the values without the read-only __setattr__
+_SLOT_SETTERS = tuple(getattr(FieldSpec, slot).__set__ for slot in FieldSpec.__slots__)
+
+
+class FormTemplate(Mapping):
+    """Read-only {field name: FieldSpec} in template order."""
+
+    __slots__ = ("_fields", "source_hash", "_prompt_fields")
+
+    def __init__(self, fields, source_hash=None):
+        self._fields = dict(fields)
+        self.source_hash = source_hash
+        self._prompt_fields = None
+
+    @classmethod
+    def from_json(cls, json_fields, source_hash=None):
+        return cls(
+            ((name, FieldSpec.from_json(name, field)) for name, field in json_fields.items()),
+            source_hash,
+        )
+
+    def __getitem__(self, name):
+        return self._fields[name]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return f"FormTemplate({len(self)} fields)"
+
+    def prompt_fields(self):
+        """{name: FieldSpec.to_prompt_dict()}, built once and shared, do not modify."""
+        if self._prompt_fields is None:
+            self._prompt_fields = {
+                name: field.to_prompt_dict() for name, field in self._fields.items()
+            }
+        return self._prompt_fields
+
+    def _columns(self):
+        fields = list(self._fields.values())
+        types = sorted({f.field_type or "" for f in fields})
+        return {
+            "format": TEMPLATE_FORMAT,
+            "source_hash": self.source_hash,
+            "names": [f.name for f in fields],
+            "labels": [f.label for f in fields],
+            "types": types,
+            "type_index": array("B", [types.index(f.field_type or "") for f in fields]),
+            "pages": array("H", [f.page for f in fields]),
+            "flags": array("I", [int(f.flags) for f in fields]),
+            "states": [(f.on_state, f.off_state, f.export_values) for f in fields],
+        }
+
+    @classmethod
+    def _from_columns(cls, columns):
+        if columns.get("format") != TEMPLATE_FORMAT:
+            raise ValueError(f"Unsupported compiled template format {columns.get('format')}")
+        types = [t or None for t in columns["types"]]
+        # A template uses a handful of distinct flag values
+        flags = {value: FieldFlag(value) for value in set(columns["flags"])}
+        return cls(
+            (
+                (
+                    name,
+                    FieldSpec._restore(
+                        (name, label, types[type_index], page, flags[flag], *states)
+                    ),
+                )
+                for name, label, type_index, page, flag, states in zip(
+                    columns["names"],
+                    columns["labels"],
+                    columns["type_index"],
+                    columns["pages"],
+                    columns["flags"],
+                    columns["states"],
+                )
+            ),
+            columns["source_hash"],
+        )
+
+    def to_bytes(self):
+        return zlib.compress(pickle.dumps(self._columns(), protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls._from_columns(pickle.loads(zlib.decompress(data)))
+
+
+def as_template(fields):
+    """Returns fields as FormTemplate, fields is a FormTemplate or a dict of template dicts or FieldSpecs."""
+    if isinstance(fields, FormTemplate):
+        return fields
+    return FormTemplate(
+        (name, field if isinstance(field, FieldSpec) else FieldSpec.from_json(name, field))
+        for name, field in fields.items()
+    )
+
+
+def compiled_path(template_path):
+    return Path(template_path).with_suffix(COMPILED_SUFFIX)
+
+
+def compile_template(template_path, output_path=None):
+    """Compiles a template JSON into its binary artifact, returns the artifact path."""
+    with open(template_path, "rb") as file:
+        raw = file.read()
+    template = FormTemplate.from_json(json.loads(raw), hashlib.sha256(raw).hexdigest())
+    output_path = Path(output_path or compiled_path(template_path))
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    tmp_path.write_bytes(template.to_bytes())
+    tmp_path.replace(output_path)
+    return output_path
+
+
+def load_template(template_path, raw=None):
+    """
+    Loads a template as FormTemplate, from its compiled artifact if that was
+    built from the current JSON and from the JSON otherwise. raw are the
+    JSON bytes if the caller has read them already.
+    """
+    if raw is None:
+        with open(template_path, "rb") as file:
+            raw = file.read()
+    source_hash = hashlib.sha256(raw).hexdigest()
+
+    artifact = compiled_path(template_path)
+    if artifact.exists():
+        try:
+            template = FormTemplate.from_bytes(artifact.read_bytes())
+            if template.source_hash == source_hash:
+                return template
+            logging.info(f"Compiled template {artifact} is stale, loading the JSON")
+        except Exception as e:
+            # Truncated or incompatible pickles fail with about any error
+            logging.warning(f"Cannot read compiled template {artifact}: {e}")
+    return FormTemplate.from_json(json.loads(raw), source_hash)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compiles form templates to <name>.tplc")
+    parser.add_argument("templates", nargs="+", help="template JSON files")
+    args = parser.parse_args(argv)
+
+    for template_path in args.templates:
+        output_path = compile_template(template_path)
+        print(
+            f"{template_path}: {Path(template_path).stat().st_size} -> "
+            f"{output_path.stat().st_size} bytes ({output_path})"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,255 @@
+import json
+import threading
+import time
+
+from talkdoc_core.agents import (
+    IncrementalExtractor,
+    get_json_from_chat_history_agent,
+    get_json_from_chat_history_sharded,
+    shard_fields,
+    validate_extracted_json,
+)
+from talkdoc_core.gptservice import GPTService
+
+
+FIELDS = {
+    "txtfPersonVorname": {"/TU": "Vorname", "type": "/Tx", "page": 0},
+    "txtfPersonNachname": {"/TU": "Nachname", "type": "/Tx", "page": 0},
+    "chbxKonto": {"/TU": "Konto vorhanden", "type": "/Btn", "page": 1},
+    "txtfIBAN": {"/TU": "IBAN", "type": "/Tx", "page": 2},
+}
+
+MESSAGES = [
+    {"role": "system", "content": "system"},
+    {"role": "user", "content": "Ich heiße Max Mustermann"},
+    {"role": "assistant", "content": "Danke"},
+]
+
+
+class FakeGPT(GPTService):
+    def __init__(self, delay=0.0):
+        super().__init__("sk-test")
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def chat(self, messages, model="gpt-4.1", stream=True, json_mode=False):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return json.dumps(
+            {"txtfPersonVorname": "Max", "chbxKonto": "Ja", "halluziniert": "x"}
+        )
+
+
+def test_shard_fields_by_page_and_size():
+    assert [list(s) for s in shard_fields(FIELDS)] == [
+        ["txtfPersonVorname", "txtfPersonNachname"],
+        ["chbxKonto"],
+        ["txtfIBAN"],
+    ]
+    assert len(shard_fields(FIELDS, max_fields_per_shard=1)) == 4
+
+
+def test_validate_extracted_json():
+    assert validate_extracted_json({"txtfIBAN": None, "other": "x"}, FIELDS) == {
+        "txtfPersonVorname": "",
+        "txtfPersonNachname": "",
+        "chbxKonto": "",
+        "txtfIBAN": "",
+    }
+
+
+def test_sharded_extraction_runs_concurrently():
+    gpt = FakeGPT(delay=0.2)
+
+    start = time.perf_counter()
+    json_res, stats = get_json_from_chat_history_sharded(gpt, MESSAGES, FIELDS)
+    elapsed = time.perf_counter() - start
+
+    assert gpt.calls == 3
+    assert elapsed < 0.5
+    assert json_res == {
+        "txtfPersonVorname": "Max",
+        "txtfPersonNachname": "",
+        "chbxKonto": "Ja",
+        "txtfIBAN": "",
+    }
+    assert [s["pages"] for s in stats] == [[0], [1], [2]]
+    assert all(s["seconds"] >= 0.2 for s in stats)
+
+
+class ScriptedGPT(GPTService):
+    def __init__(self, responses):
+        super().__init__("sk-test")
+        self.responses = list(responses)
+        self.prompts = []
+
+    def chat(self, messages, model="gpt-4.1", stream=True, json_mode=False):
+        self.prompts.append(messages[-1]["content"])
+        return json.dumps(self.responses.pop(0))
+
+
+def test_incremental_extractor_processes_only_new_turns():
+    gpt = ScriptedGPT(
+        [
+            {"txtfPersonVorname": "Max"},
+            {"txtfPersonVorname": "Moritz", "unknown": "x"},
+        ]
+    )
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie ist Ihr Vorname?"},
+        {"role": "user", "content": "Max"},
+        {"role": "assistant", "content": "Wie ist Ihr Nachname?"},
+    ]
+
+    assert extractor.update(gpt, messages) == {"txtfPersonVorname": "Max"}
+    # Nothing new, no model call
+    assert extractor.update(gpt, messages) == {}
+
+    messages += [
+        {"role": "user", "content": "Korrektur: ich heiße Moritz"},
+        {"role": "assistant", "content": "Notiert"},
+    ]
+    assert extractor.update_in_background(gpt, messages).result() == {
+        "txtfPersonVorname": "Moritz"
+    }
+
+    assert extractor.values["txtfPersonVorname"] == "Moritz"
+    assert len(gpt.prompts) == 2
+    assert "Wie ist Ihr Vorname?" not in gpt.prompts[1]
+    assert "Wie ist Ihr Nachname?" in gpt.prompts[1]
+    assert "'f1': 'Max'" in gpt.prompts[1]
+
+
+IBAN = "DE89 3704 0044 0532 0130 00"
+
+
+def test_incremental_extractor_resolves_structured_answers_locally():
+    gpt = ScriptedGPT([{"txtfPersonVorname": "Max"}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie lautet Ihre IBAN?"},
+        {"role": "user", "content": IBAN.replace(" ", "")},
+        {"role": "assistant", "content": "Wie ist Ihr Vorname?"},
+    ]
+
+    assert extractor.update(gpt, messages) == {"txtfIBAN": IBAN}
+    assert gpt.prompts == []
+
+    messages += [
+        {"role": "user", "content": "Max"},
+        {"role": "assistant", "content": "Danke"},
+    ]
+    assert extractor.update(gpt, messages) == {"txtfPersonVorname": "Max"}
+    assert len(gpt.prompts) == 1
+
+
+def test_incremental_extractor_sends_partly_resolved_answers_to_the_model():
+    gpt = ScriptedGPT([{"txtfIBAN": ""}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie lautet Ihre IBAN?"},
+        {"role": "user", "content": f"Meine IBAN ist {IBAN}, bei der Sparkasse"},
+        {"role": "assistant", "content": "Danke"},
+    ]
+
+    assert extractor.update(gpt, messages) == {"txtfIBAN": IBAN}
+    assert len(gpt.prompts) == 1
+
+
+def test_incremental_extractor_sends_answers_after_an_iban_to_the_model():
+    gpt = ScriptedGPT([{"txtfPersonVorname": "Max"}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie lautet Ihre IBAN?"},
+        {"role": "user", "content": f"{IBAN} und mein Name ist Max"},
+        {"role": "assistant", "content": "Danke"},
+    ]
+
+    assert extractor.update(gpt, messages) == {"txtfIBAN": IBAN, "txtfPersonVorname": "Max"}
+    assert len(gpt.prompts) == 1
+
+
+def test_incremental_extractor_skips_all_leading_system_messages():
+    gpt = ScriptedGPT([{"txtfPersonVorname": "Max"}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "system", "content": "Antworte auf Englisch."},
+        {"role": "assistant", "content": "Wie ist Ihr Vorname?"},
+        {"role": "user", "content": "Max"},
+        {"role": "assistant", "content": "Danke"},
+    ]
+
+    assert extractor.pending_messages(messages) == messages[2:]
+    assert extractor.update(gpt, messages) == {"txtfPersonVorname": "Max"}
+    assert "Englisch" not in gpt.prompts[0]
+
+
+def test_full_extraction_sends_only_unresolved_fields():
+    gpt = ScriptedGPT([{"f1": "Max"}])
+    messages = MESSAGES + [
+        {"role": "assistant", "content": "Wie lautet Ihre IBAN?"},
+        {"role": "user", "content": IBAN},
+    ]
+
+    json_res = get_json_from_chat_history_agent(gpt, messages, FIELDS)
+
+    assert json_res == {"txtfPersonVorname": "Max", "txtfIBAN": IBAN}
+    assert "|IBAN" not in gpt.prompts[0]
+    assert "|Vorname" in gpt.prompts[0]
+
+
+def test_partly_resolved_answers_are_still_sent_to_the_model():
+    gpt = ScriptedGPT([{"f1": "Max"}])
+    messages = MESSAGES + [
+        {"role": "assistant", "content": "Wie lautet Ihre IBAN?"},
+        {"role": "user", "content": f"Meine IBAN ist {IBAN}"},
+    ]
+
+    json_res = get_json_from_chat_history_agent(gpt, messages, FIELDS)
+
+    assert json_res == {"txtfPersonVorname": "Max", "txtfIBAN": IBAN}
+    assert "|IBAN" in gpt.prompts[0]
+
+
+def test_incremental_extractor_keeps_only_answered_fields():
+    gpt = ScriptedGPT([{"txtfPersonVorname": "Max"}, {"txtfPersonVorname": ""}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie ist Ihr Vorname?"},
+        {"role": "user", "content": "Max"},
+    ]
+
+    assert extractor.values == {}
+    extractor.update(gpt, messages)
+    assert extractor.values == {"txtfPersonVorname": "Max"}
+
+    messages += [{"role": "user", "content": "Das weiß ich doch nicht mehr"}]
+    assert extractor.update(gpt, messages) == {"txtfPersonVorname": ""}
+    assert extractor.values == {}
+
+
+def test_snapshot_is_a_copy_of_the_values():
+    gpt = ScriptedGPT([{"txtfPersonVorname": "Max"}])
+    extractor = IncrementalExtractor(FIELDS)
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "assistant", "content": "Wie ist Ihr Vorname?"},
+        {"role": "user", "content": "Max"},
+    ]
+
+    before = extractor.snapshot()
+    extractor.update_in_background(gpt, messages).result()
+    after = extractor.snapshot()
+
+    assert before == {} and after == {"txtfPersonVorname": "Max"}
+    after["txtfPersonVorname"] = "Moritz"
+    assert extractor.values["txtfPersonVorname"] == "Max"
@@ -0,0 +1,102 @@
+import json
+import zipfile
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+
+from talkdoc_core.batch import fill_batch, iter_responses, main, safe_filename
+
+
+@pytest.fixture
+def responses_jsonl(tmp_path):
+    path = tmp_path / "responses.jsonl"
+    lines = [
+        {"id": "max", "response": {"txtfPersonVorname": "Max"}},
+        {"txtfPersonVorname": "Erika"},
+        {"id": "broken", "response": {"unknown": "x"}},
+    ]
+    path.write_text("\n".join(json.dumps(line) for line in lines), encoding="utf-8")
+    return path
+
+
+def test_iter_responses_jsonl(responses_jsonl):
+    names = [name for name, _ in iter_responses(responses_jsonl)]
+    assert names == ["max", "responses_00002", "broken"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_fill_batch_to_zip(responses_jsonl, tmp_path, workers):
+    output = tmp_path / "filled.zip"
+    results = fill_batch("anek", responses_jsonl, output, workers=workers)
+
+    by_name = {r.name: r for r in results}
+    assert by_name["max"].ok and by_name["responses_00002"].ok
+    assert not by_name["broken"].ok
+    assert "ValueError" in by_name["broken"].error
+
+    with zipfile.ZipFile(output) as archive:
+        assert sorted(archive.namelist()) == ["max.pdf", "responses_00002.pdf"]
+        fields = PdfReader(BytesIO(archive.read("max.pdf"))).get_fields()
+        assert fields["txtfPersonVorname"]["/V"] == "Max"
+
+
+def test_cli_writes_directory_and_report(tmp_path):
+    responses = tmp_path / "responses"
+    responses.mkdir()
+    (responses / "a.json").write_text(json.dumps({"txtfPersonVorname": "A"}))
+    report = tmp_path / "report.json"
+
+    exit_code = main(
+        [
+            "anek",
+            str(responses),
+            "--out",
+            str(tmp_path / "out"),
+            "--workers",
+            "1",
+            "--report",
+            str(report),
+        ]
+    )
+
+    assert exit_code == 0
+    assert (tmp_path / "out" / "a.pdf").exists()
+    assert json.loads(report.read_text())[0]["ok"]
+
+
+def test_malformed_line_fails_only_its_record(tmp_path):
+    path = tmp_path / "responses.jsonl"
+    path.write_text(
+        '{"id": "max", "response": {"txtfPersonVorname": "Max"}}\n'
+        '{"id": "cut", "response": {"txtfPerson\n'
+        '{"id": "erika", "response": {"txtfPersonVorname": "Erika"}}\n',
+        encoding="utf-8",
+    )
+
+    results = fill_batch("anek", path, tmp_path / "out", workers=1)
+
+    assert [(r.name, r.ok) for r in results] == [
+        ("max", True),
+        ("responses_00002", False),
+        ("erika", True),
+    ]
+    assert "JSONDecodeError" in results[1].error
+
+
+def test_output_names_stay_in_the_output_directory(tmp_path):
+    path = tmp_path / "responses.jsonl"
+    ids = ["../x", "x", "X", "a/../../b c"]
+    path.write_text(
+        "\n".join(json.dumps({"id": i, "response": {"txtfPersonVorname": "Max"}}) for i in ids),
+        encoding="utf-8",
+    )
+    out = tmp_path / "out"
+
+    results = fill_batch("anek", path, out, workers=1)
+
+    assert all(r.ok for r in results)
+    # Unique also on case-insensitive file systems
+    assert {p.name for p in out.iterdir()} == {"x.pdf", "x_2.pdf", "X_3.pdf", "b_c.pdf"}
+    assert not (tmp_path / "x.pdf").exists()
+    assert safe_filename("..") == "document"
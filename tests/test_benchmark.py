@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+
+def run_benchmark(*args):
+    return subprocess.run(
+        [sys.executable, "scripts/benchmark.py", "--forms", "anlagevm", "--repeat", "1", *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": "."},
+    )
+
+
+def test_benchmark_report(tmp_path):
+    out = tmp_path / "bench.json"
+    assert run_benchmark("--out", str(out)).returncode == 0
+
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert set(report["results"]) == {
+        f"anlagevm/{name}"
+        for name in (
+            "extract",
+            "template_load",
+            "template_load_compiled",
+            "fill",
+            "fill_cached_template",
+            "fill_incremental",
+            "fill_flatten",
+            "filter_json_fields",
+            "compact_fields",
+            "system_prompt",
+            "section_prompt",
+            "extraction_prompt",
+            "parse_answer",
+            "rule_extract",
+        )
+    }
+    assert all(r["median"] > 0 for r in report["results"].values())
+
+
+def test_benchmark_detects_regressions(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    run_benchmark("--only", "fill", "--save-baseline", str(baseline))
+
+    report = json.loads(baseline.read_text(encoding="utf-8"))
+    report["results"]["anlagevm/fill"]["median"] /= 10
+    baseline.write_text(json.dumps(report), encoding="utf-8")
+
+    result = run_benchmark("--only", "fill", "--baseline", str(baseline))
+    assert result.returncode == 1
+    assert "REGRESSION" in result.stdout
@@ -0,0 +1,88 @@
+import io
+import zipfile
+
+import pytest
+from pypdf import PdfReader
+
+from talkdoc_core.agents import IncrementalExtractor
+from talkdoc_core.bundle import BundleRegistry, fill_bundle, get_bundle_registry
+from talkdoc_core.form_registry import get_form_registry
+
+BUNDLE = "Bürgergeld mit Anlage EK und Anlage VM"
+
+
+@pytest.fixture
+def bundle():
+    return get_bundle_registry().get(BUNDLE)
+
+
+def test_shared_fields_are_asked_once(bundle):
+    forms = {form.form_id: form for form in bundle.forms}
+    union = sum(len(form.template) for form in bundle.forms)
+
+    assert [form.form_id for form in bundle.forms] == ["buergergeld", "anek", "anlagevm"]
+    # 5 fields shared by all three forms, 5 by two of them
+    assert len(bundle.template) == union - 15
+    assert bundle.aliases["txtfPersonVorname"] == (
+        ("buergergeld", "txtfPersonVorname"),
+        ("anek", "txtfPersonVorname"),
+        ("anlagevm", "txtfPersonVorname"),
+    )
+    assert "txtfPersonVorname" in bundle.shared_fields()
+    # The label of the first form is used for a shared field
+    assert "1 - Vorname der antragstellenden Person" not in bundle.system_prompt_body
+    # Pages of the attachments follow the main form
+    last_page = max(f.page for f in forms["buergergeld"].template.values())
+    assert bundle.template["dateBGGebDatum"].page > last_page
+    assert get_bundle_registry().get(BUNDLE) is bundle
+
+
+def test_split_sends_shared_answers_to_every_form(bundle):
+    per_form = bundle.split({"txtfPersonVorname": "Max", "txtfIBAN": "DE89 3704 0044 0532 0130 00"})
+
+    assert per_form["buergergeld"] == {
+        "txtfPersonVorname": "Max",
+        "txtfIBAN": "DE89 3704 0044 0532 0130 00",
+    }
+    assert per_form["anek"] == {"txtfPersonVorname": "Max"}
+    assert per_form["anlagevm"] == {"txtfPersonVorname": "Max"}
+
+
+def test_one_extractor_covers_the_bundle(bundle):
+    extractor = IncrementalExtractor.for_form(bundle)
+
+    assert extractor.json_fields is bundle.template
+    assert extractor.compact_fields is bundle.sections.compact
+    assert set(extractor.compact_fields.names) == set(bundle.template)
+    assert extractor.values == {}
+
+
+@pytest.mark.parametrize("workers", [1, None])
+def test_fill_bundle_returns_one_zip(bundle, workers):
+    data = fill_bundle(bundle, {"txtfPersonVorname": "Max", "txtfPersonNachname": "Muster"}, workers)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == [
+            "filled_buergergeld.pdf",
+            "filled_anek.pdf",
+            "filled_anlagevm.pdf",
+        ]
+        for name in archive.namelist():
+            fields = PdfReader(io.BytesIO(archive.read(name))).get_fields()
+            assert fields["txtfPersonVorname"]["/V"] == "Max"
+            assert fields["txtfPersonNachname"]["/V"] == "Muster"
+
+
+def test_bundle_mapping_is_parsed_once(tmp_path, monkeypatch):
+    path = tmp_path / "bundle_mapping.json"
+    registry = BundleRegistry(path, get_form_registry())
+    assert registry.bundles() == {}
+
+    path.write_text('{"B": {"id": "b", "forms": ["anek"]}}', encoding="utf-8")
+    first = registry.bundles()
+    assert first["B"]["forms"] == ("anek",)
+
+    loads = []
+    monkeypatch.setattr("talkdoc_core.bundle.json.load", lambda file: loads.append(file))
+    assert registry.bundles() is first
+    assert loads == []
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from talkdoc_core.context import ConversationContext, estimate_tokens
+from talkdoc_core.gptservice import GPTService
+
+
+class SummaryGPT(GPTService):
+    def __init__(self):
+        super().__init__("sk-test")
+        self.release = threading.Event()
+        self.prompts = []
+
+    def chat(self, messages, model="gpt-4.1", stream=True, json_mode=False):
+        self.release.wait(5)
+        self.prompts.append(messages[-1]["content"])
+        return f"Zusammenfassung {len(self.prompts)}"
+
+
+def conversation(turns):
+    messages = [
+        {"role": "system", "content": "Formular"},
+        {"role": "assistant", "content": "Frage 0"},
+    ]
+    for i in range(turns):
+        messages += [
+            {"role": "user", "content": f"Antwort {i}"},
+            {"role": "assistant", "content": f"Frage {i + 1}"},
+        ]
+    return messages
+
+
+def test_short_conversation_is_sent_unchanged():
+    messages = conversation(2)
+    assert ConversationContext(keep_turns=3).build(messages, SummaryGPT()) == messages
+
+
+def test_old_turns_are_folded_in_the_background():
+    gpt = SummaryGPT()
+    context = ConversationContext(keep_turns=2, min_fold_messages=2)
+    messages = conversation(5)
+
+    # The summary is still running, nothing is dropped and nothing blocks
+    assert context.build(messages, gpt) == messages
+
+    gpt.release.set()
+    context.wait()
+    built = context.build(messages + [{"role": "user", "content": "Antwort 5"}], gpt)
+
+    assert built[0] == messages[0]
+    assert built[1]["role"] == "system"
+    assert "Zusammenfassung 1" in built[1]["content"]
+    # The tail starts with the question before the oldest kept answer
+    assert built[2:] == messages[-5:] + [{"role": "user", "content": "Antwort 5"}]
+    assert "Antwort 0" in gpt.prompts[0]
+    assert "Antwort 3" not in gpt.prompts[0]
+
+
+def test_token_budget_bounds_the_verbatim_tail():
+    gpt = SummaryGPT()
+    gpt.release.set()
+    context = ConversationContext(keep_turns=10, token_budget=60, min_fold_messages=1)
+    messages = conversation(3)
+    messages[3]["content"] = "x" * 400
+
+    context.build(messages, gpt)
+    context.wait()
+    built = context.build(messages, gpt)
+
+    assert estimate_tokens(built[2:]) <= 60
+    assert built[-1] == messages[-1]
+
+
+def test_reset_drops_running_summaries():
+    gpt = SummaryGPT()
+    context = ConversationContext(keep_turns=1, min_fold_messages=1)
+    messages = conversation(3)
+
+    context.build(messages, gpt)
+    context.reset()
+    gpt.release.set()
+    context.wait()
+
+    assert context.summary == ""
+    assert context.covered == 0
+
+
+class FailingGPT(SummaryGPT):
+    def chat(self, messages, model="gpt-4.1", stream=True, json_mode=False):
+        raise RuntimeError("rate limited")
+
+
+def test_failing_summaries_are_reported(caplog):
+    gpt = FailingGPT()
+    context = ConversationContext(keep_turns=1, token_budget=20, min_fold_messages=1)
+    messages = conversation(6)
+
+    for attempt in range(1, 4):
+        context.build(messages, gpt)
+        # The failure is counted in the done callback, after the future completes
+        deadline = time.monotonic() + 5
+        while context.failures < attempt and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert context.failures == 3
+    assert "Chat summary failed (3 in a row)" in caplog.text
+
+    built = context.build(messages, gpt)
+    # The older turns stay in the context, over the budget
+    assert len(built) == len(messages)
+    assert "exceeds the budget of 20, the last 3 summaries failed" in caplog.text
+
+    context.reset()
+    assert context.failures == 0
@@ -0,0 +1,195 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pypdf import PdfWriter
+from pypdf.annotations import Link
+
+from talkdoc_core import downloads
+from talkdoc_core.downloads import (
+    DocumentDownloader,
+    download_linked_documents,
+    extract_pdf_links,
+)
+
+
+DOCUMENTS = {
+    "/merkblatt.pdf": b"%PDF-1.4 merkblatt" * 1000,
+    "/hinweise.pdf": b"%PDF-1.4 hinweise" * 500,
+}
+
+
+class DocumentHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+    send_etag = True
+    # Bytes sent before the connection drops, None sends the whole body
+    truncate = None
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, dict(self.headers)))
+        body = DOCUMENTS.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.send_etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        status, start = 200, 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == etag:
+            status, start = 206, int(self.headers["Range"][6:-1])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        self.send_response(status)
+        if self.send_etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        if self.truncate is not None:
+            self.wfile.write(body[start : self.truncate])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    DocumentHandler.requests_seen = []
+    DocumentHandler.send_etag = True
+    DocumentHandler.truncate = None
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), DocumentHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_download_and_skip_unchanged(server, tmp_path):
+    urls = [server + path for path in DOCUMENTS]
+
+    first = DocumentDownloader(tmp_path).download_all(urls)
+    assert [r.status for r in first] == ["downloaded", "downloaded"]
+    assert (tmp_path / "merkblatt.pdf").read_bytes() == DOCUMENTS["/merkblatt.pdf"]
+
+    second = DocumentDownloader(tmp_path).download_all(urls)
+    assert [r.status for r in second] == ["unchanged", "unchanged"]
+    assert "If-None-Match" in DocumentHandler.requests_seen[-1][1]
+
+
+def test_unchanged_by_hash_without_etag(server, tmp_path):
+    DocumentHandler.send_etag = False
+    urls = [server + "/hinweise.pdf"]
+
+    DocumentDownloader(tmp_path).download_all(urls)
+    result = DocumentDownloader(tmp_path).download_all(urls)
+
+    assert result[0].status == "unchanged"
+    assert not (tmp_path / "hinweise.pdf.part").exists()
+
+
+def test_resume_partial_download(server, tmp_path):
+    url = server + "/merkblatt.pdf"
+    body = DOCUMENTS["/merkblatt.pdf"]
+    DocumentDownloader(tmp_path).download_all([url])
+
+    # Simulate an interrupted download of a new version
+    downloader = DocumentDownloader(tmp_path)
+    (tmp_path / "merkblatt.pdf").unlink()
+    (tmp_path / "merkblatt.pdf.part").write_bytes(body[:1000])
+    downloader.manifest[url]["partial_etag"] = downloader.manifest[url]["etag"]
+
+    result = downloader.download_all([url])
+
+    assert result[0].status == "resumed"
+    assert result[0].bytes == len(body) - 1000
+    assert (tmp_path / "merkblatt.pdf").read_bytes() == body
+
+
+def test_partial_etag_survives_a_crash(server, tmp_path, monkeypatch):
+    url = server + "/merkblatt.pdf"
+    body = DOCUMENTS["/merkblatt.pdf"]
+    # Small chunks, so the bytes before the drop reach the .part file
+    monkeypatch.setattr(downloads, "CHUNK_SIZE", 256)
+    DocumentHandler.truncate = 1000
+
+    assert DocumentDownloader(tmp_path).download_all([url])[0].status == "failed"
+    assert (tmp_path / "merkblatt.pdf.part").exists()
+
+    # A new process only has the manifest on disk
+    DocumentHandler.truncate = None
+    result = DocumentDownloader(tmp_path).download_all([url])
+
+    assert result[0].status == "resumed"
+    assert (tmp_path / "merkblatt.pdf").read_bytes() == body
+
+
+def test_complete_part_file_is_finished(server, tmp_path):
+    url = server + "/merkblatt.pdf"
+    body = DOCUMENTS["/merkblatt.pdf"]
+    DocumentDownloader(tmp_path).download_all([url])
+
+    # Interrupted after the last byte, before the rename
+    downloader = DocumentDownloader(tmp_path)
+    (tmp_path / "merkblatt.pdf").unlink()
+    (tmp_path / "merkblatt.pdf.part").write_bytes(body)
+    downloader.manifest[url]["partial_etag"] = downloader.manifest[url]["etag"]
+
+    result = downloader.download_all([url])
+
+    assert result[0].status == "resumed"
+    assert DocumentHandler.requests_seen[-1][1]["Range"] == f"bytes={len(body)}-"
+    assert (tmp_path / "merkblatt.pdf").read_bytes() == body
+    assert not (tmp_path / "merkblatt.pdf.part").exists()
+    assert downloader.manifest[url]["sha256"] == hashlib.sha256(body).hexdigest()
+
+
+def test_same_basename_gets_its_own_file(server, tmp_path, monkeypatch):
+    monkeypatch.setitem(DOCUMENTS, "/alt/merkblatt.pdf", b"%PDF-1.4 alt" * 100)
+    urls = [server + "/merkblatt.pdf", server + "/alt/merkblatt.pdf", server + "/x%2Fy.pdf"]
+
+    downloader = DocumentDownloader(tmp_path)
+    filenames = [downloader.filename(url) for url in urls]
+    results = downloader.download_all(urls[:2])
+
+    assert filenames[0] == "merkblatt.pdf"
+    assert filenames[1].startswith("merkblatt-") and filenames[1].endswith(".pdf")
+    assert filenames[2] == "y.pdf"
+    assert [r.status for r in results] == ["downloaded", "downloaded"]
+    assert (tmp_path / filenames[1]).read_bytes() == DOCUMENTS["/alt/merkblatt.pdf"]
+    # The names are kept by later runs
+    assert DocumentDownloader(tmp_path).filename(urls[1]) == filenames[1]
+
+
+def test_failed_download_is_reported(server, tmp_path):
+    result = DocumentDownloader(tmp_path).download_all([server + "/missing.pdf"])
+
+    assert result[0].status == "failed"
+    assert "404" in result[0].error
+
+
+def test_download_linked_documents(server, tmp_path):
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    for path in DOCUMENTS:
+        writer.add_annotation(0, Link(rect=(10, 10, 50, 50), url=server + path))
+    pdf_path = tmp_path / "form.pdf"
+    with open(pdf_path, "wb") as pdf_file:
+        writer.write(pdf_file)
+
+    assert extract_pdf_links(pdf_path) == [server + path for path in DOCUMENTS]
+
+    results = download_linked_documents(pdf_path, "form", root=tmp_path / "documents")
+    assert all(r.status == "downloaded" for r in results)
+    assert (tmp_path / "documents" / "form" / "manifest.json").exists()
@@ -1,8 +1,34 @@
-from pdfai.pdf_ops import extract_fields_from_form
-import os
+import json
+
+from talkdoc_core.pdf_ops import extract_fields_from_form
 
 
-# TODO: Make paths relative
 pdf_path = "pdfs/ek_anlage_v2.pdf"
 
-extract_fields_from_form(pdf_path)
+
+def test_extract_fields_from_form(tmp_path):
+    output_path = tmp_path / "ek_anlage_v2.json"
+
+    form_dict, stats = extract_fields_from_form(
+        pdf_path, output_path=output_path, return_stats=True
+    )
+
+    with open("form_templates/ek_anlage_v2.json", "r", encoding="utf-8") as file:
+        template = json.load(file)
+    assert form_dict.keys() == template.keys()
+    assert all(form_dict[k]["page"] == v["page"] for k, v in template.items())
+
+    with open(output_path, "r", encoding="utf-8") as file:
+        assert json.load(file) == form_dict
+    assert stats["fields"] == len(form_dict)
+    assert stats["total_seconds"] > 0
+
+
+def test_extract_radio_export_values(tmp_path):
+    form_dict = extract_fields_from_form(
+        "pdfs/Buergergeld_Antrag_v3.pdf", output_path=tmp_path / "bg.json"
+    )
+
+    hidden_fields = form_dict["rbtnPersonSVRVNr"]["hidden_fields"]
+    assert hidden_fields["FF"] == 49152
+    assert hidden_fields["export_values"] == ["/0", "/1"]
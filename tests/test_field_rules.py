@@ -0,0 +1,152 @@
+import json
+
+from talkdoc_core.field_rules import (
+    RuleExtractor,
+    find_dates,
+    find_ibans,
+    find_phone_numbers,
+    find_postal_codes,
+    find_yes_no,
+    iban_valid,
+)
+
+
+def test_values_are_normalized_and_validated():
+    assert find_dates("am 1.2.1990") == ["01.02.1990"]
+    assert find_dates("1990-02-01") == ["01.02.1990"]
+    assert find_dates("31.02.1990") == []
+
+    assert iban_valid("DE89370400440532013000")
+    assert not iban_valid("DE89370400440532013001")
+    assert find_ibans("de89370400440532013000, danke") == ["DE89 3704 0044 0532 0130 00"]
+    assert find_ibans("DE89 3704 0044 0532 0130 00 danke") == ["DE89 3704 0044 0532 0130 00"]
+
+    assert find_postal_codes("79098 Freiburg") == ["79098"]
+    assert find_postal_codes("+49 761 123456") == []
+    assert find_phone_numbers("+49 761 123456") == ["+49 761 123456"]
+
+    assert find_yes_no("Ja, genau!") == ["Ja"]
+    assert find_yes_no("Nein") == ["Nein"]
+    assert find_yes_no("Ja, aber nur teilweise") == []
+
+
+def buergergeld():
+    with open("form_templates/Buergergeld_Antrag_v3.json", "r", encoding="utf-8") as file:
+        return RuleExtractor(json.load(file))
+
+
+def chat(*turns):
+    messages = [{"role": "system", "content": "system"}]
+    for question, answer in turns:
+        messages += [
+            {"role": "assistant", "content": question},
+            {"role": "user", "content": answer},
+        ]
+    return messages
+
+
+def test_answers_are_attributed_to_the_question():
+    rules = buergergeld()
+    resolved, consumed = rules.extract(
+        chat(
+            ("Wie lautet dein Geburtsdatum?", "01.02.1990"),
+            ("Wie lautet deine Postleitzahl?", "79098"),
+            ("Unter welcher Telefonnummer bist du erreichbar?", "0761 123456"),
+            ("Wie lautet deine IBAN?", "Meine IBAN ist DE89 3704 0044 0532 0130 00"),
+            ("Ab welchem Datum möchtest du Bürgergeld beantragen?", "ab dem 1.3.2025"),
+            ("Wie heißt du?", "Max Mustermann"),
+        )
+    )
+
+    assert resolved == {
+        "datePersonGebDatum": "01.02.1990",
+        "txtfPersonPlz": "79098",
+        "txtfPersonTel": "0761 123456",
+        "txtfIBAN": "DE89 3704 0044 0532 0130 00",
+        "datePersonAntragBUEG": "01.03.2025",
+    }
+    # Answers with words besides the value still go to the model
+    assert consumed == {2, 4, 6}
+
+
+def test_generic_question_words_do_not_attribute_answers():
+    rules = buergergeld()
+
+    resolved, _ = rules.extract(
+        chat(("Haben Sie eine Bankverbindung bzw. ein Konto?", "Ja"))
+    )
+    assert resolved == {}
+
+    resolved, _ = rules.extract(
+        chat(("Haben Sie eine Telefonnummer?", "Ja, 0176 1234567"))
+    )
+    assert resolved == {"txtfPersonTel": "0176 1234567"}
+
+    resolved, _ = rules.extract(chat(("Wann sind Sie geboren?", "01.02.1990")))
+    assert "datePersonGetrennt" not in resolved
+
+
+def test_negated_checkboxes_are_left_to_the_model():
+    rules = buergergeld()
+
+    assert "chbxKonto" not in rules.kinds
+    assert "chbxWohnsitz" not in rules.kinds
+
+
+def test_answers_with_more_than_the_value_are_not_consumed():
+    rules = buergergeld()
+
+    resolved, consumed = rules.extract(
+        chat(("Wie lauten Postleitzahl und Wohnort?", "10115 Berlin"))
+    )
+    assert resolved == {"txtfPersonPlz": "10115"}
+    assert consumed == set()
+
+
+def test_ambiguous_answers_are_left_to_the_model():
+    rules = buergergeld()
+
+    # Two dates in one answer, a date without a matching question
+    resolved, consumed = rules.extract(
+        chat(
+            ("Wann warst du beschäftigt?", "vom 01.01.2020 bis 31.12.2021"),
+            ("Wie heißt du?", "Max, geboren am 01.02.1990"),
+        )
+    )
+    assert resolved == {}
+    assert consumed == set()
+
+    # A later date that cannot be attributed may be a correction
+    resolved, _ = rules.extract(
+        chat(
+            ("Wie lautet dein Geburtsdatum?", "01.02.1990"),
+            ("Noch etwas?", "Sorry, es ist der 02.01.1990"),
+        )
+    )
+    assert resolved == {}
+
+
+def test_iban_followed_by_other_answers_is_not_consumed():
+    rules = buergergeld()
+
+    resolved, consumed = rules.extract(
+        chat(
+            (
+                "Wie lautet deine IBAN?",
+                "DE89 3704 0044 0532 0130 00 und ich bin ledig und wohne in Berlin",
+            ),
+            ("Wie lautet deine IBAN?", "DE89 3704 0044 0532 0130 00."),
+        )
+    )
+    assert resolved == {"txtfIBAN": "DE89 3704 0044 0532 0130 00"}
+    assert consumed == {4}
+
+
+def test_validation_hints_do_not_classify_fields():
+    rules = buergergeld()
+
+    # The Ort labels mention the Postleitzahl in their validation hint
+    for name in ("txtfPersonOrt", "txtfLeistungstraegerOrt", "txtfAGOrt"):
+        assert name not in rules.kinds
+    resolved, _ = rules.extract(chat(("Wie lautet dein Wohnort?", "10115 Berlin")))
+    assert "txtfPersonOrt" not in resolved
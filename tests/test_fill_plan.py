@@ -0,0 +1,271 @@
+import json
+import re
+import shutil
+from io import BytesIO
+
+import pytest
+from pypdf import PdfReader
+
+from talkdoc_core.pdf_ops import (
+    compile_fill_plan,
+    fill_pdf_bytes,
+    fillPDF,
+    get_fill_plan,
+    load_pdf_template,
+    resolve_save_mode,
+)
+from talkdoc_core.template_model import as_template
+
+
+BG_PDF = "pdfs/Buergergeld_Antrag_v3.pdf"
+BG_TEMPLATE = "form_templates/Buergergeld_Antrag_v3.json"
+
+
+def load_template(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def widget_of(reader, name):
+    return next(
+        annotation.get_object()
+        for page in reader.pages
+        for annotation in page.get("/Annots") or []
+        if annotation.get_object().get("/T") == name
+    )
+
+
+def test_plan_resolves_button_states():
+    plan = get_fill_plan(BG_PDF)
+
+    checkbox = plan.fields["chbxPersonMaennlich"]
+    assert not checkbox.radio
+    assert checkbox.resolve("Ja") == "/selektiert"
+    assert checkbox.resolve("nein") == "/Off"
+
+    radio = plan.fields["rbtnPersonSVRVNr"]
+    assert radio.radio
+    assert len(radio.widgets) == 2
+    assert radio.resolve("yes") == "/0"
+    assert radio.resolve("vielleicht") is None
+
+
+def test_plan_and_template_agree_on_button_states():
+    plan = get_fill_plan(BG_PDF)
+    template = as_template(load_template(BG_TEMPLATE))
+
+    for name, field in plan.fields.items():
+        spec = template.get(name)
+        if field.field_type != "/Btn" or spec is None or spec.on_state != field.on_state:
+            continue
+        for answer in ("Ja", "nein", "vielleicht"):
+            assert field.resolve(answer) == spec.button_state(answer)
+
+
+def test_plan_is_cached_per_file():
+    assert get_fill_plan(BG_PDF) is get_fill_plan(BG_PDF)
+
+
+def test_fill_pdf_with_plan(tmp_path):
+    pdf_path = tmp_path / "filled.pdf"
+    shutil.copy(BG_PDF, pdf_path)
+    response = {
+        "txtfPersonVorname": "Max",
+        "chbxPersonMaennlich": "Ja",
+        "rbtnPersonSVRVNr": "Nein",
+        "txtfPersonNachname": "",
+    }
+
+    assert fillPDF(pdf_path, load_template(BG_TEMPLATE), response, get_fill_plan(BG_PDF))
+
+    fields = PdfReader(pdf_path).get_fields()
+    assert fields["txtfPersonVorname"]["/V"] == "Max"
+    assert fields["chbxPersonMaennlich"]["/V"] == "/selektiert"
+    assert fields["rbtnPersonSVRVNr"]["/V"] == "/1"
+
+
+def test_fill_buttons_without_hidden_fields(tmp_path):
+    # afa_v3.json has no hidden_fields, the states come from the PDF itself
+    pdf_path = tmp_path / "afa.pdf"
+    shutil.copy("pdfs/afa_v2.pdf", pdf_path)
+    plan = compile_fill_plan(str(pdf_path))
+    source_json = load_template("form_templates/afa_v3.json")
+
+    assert fillPDF(pdf_path, source_json, {"RVnummerbeantragt[0]": "Ja"}, plan)
+    fields = {v["/T"]: v for v in PdfReader(pdf_path).get_fields().values()}
+    assert fields["RVnummerbeantragt[0]"]["/V"] == "/1"
+
+
+def test_unknown_field_fails(tmp_path):
+    pdf_path = tmp_path / "filled.pdf"
+    shutil.copy(BG_PDF, pdf_path)
+
+    assert not fillPDF(pdf_path, load_template(BG_TEMPLATE), {"unknown": "x"})
+
+
+def test_fill_pdf_bytes_reuses_template():
+    template = load_pdf_template(BG_PDF)
+    assert load_pdf_template(BG_PDF) is template
+
+    first = fill_pdf_bytes(template, {"txtfPersonVorname": "Max"})
+    second = fill_pdf_bytes(BG_PDF, {"txtfPersonVorname": "Erika", "txtfPersonNachname": ""})
+
+    assert PdfReader(BytesIO(first)).get_fields()["txtfPersonVorname"]["/V"] == "Max"
+    assert PdfReader(BytesIO(second)).get_fields()["txtfPersonVorname"]["/V"] == "Erika"
+    assert "/V" not in template.reader.get_fields()["txtfPersonVorname"]
+
+
+def test_fill_pdf_bytes_unknown_field():
+    with pytest.raises(ValueError):
+        fill_pdf_bytes(BG_PDF, {"unknown": "x"})
+
+
+def test_unmapped_button_answer_is_skipped(caplog):
+    filled = fill_pdf_bytes(BG_PDF, {"chbxPersonMaennlich": "vielleicht"})
+
+    assert PdfReader(BytesIO(filled)).get_fields()["chbxPersonMaennlich"]["/V"] == "/Off"
+    assert "cannot map answer vielleicht" in caplog.text
+
+
+@pytest.mark.parametrize(
+    # Both end with an xref table after earlier sections
+    "pdf_path",
+    ["pdfs/Antrag_auf_Einbürgerung_v3.pdf", BG_PDF],
+)
+def test_incremental_fill_appends_to_the_original(pdf_path):
+    template = load_pdf_template(pdf_path)
+    text_field = next(
+        name
+        for name, field in template.fill_plan.fields.items()
+        if field.field_type == "/Tx" and not field.widgets[0].states
+    )
+    values = {text_field: "Max"}
+    if pdf_path == BG_PDF:
+        values.update({"chbxPersonMaennlich": "Ja", "rbtnPersonSVRVNr": "Nein"})
+
+    filled = fill_pdf_bytes(template, values, incremental=True)
+    rewritten = fill_pdf_bytes(template, values, incremental=False)
+
+    assert filled.startswith(bytes(template.pdf_bytes))
+    assert len(filled) - len(template.pdf_bytes) < 10_000
+    reader = PdfReader(BytesIO(filled), strict=True)
+    fields = reader.get_fields()
+    expected = PdfReader(BytesIO(rewritten)).get_fields()
+    for name in values:
+        assert fields[name]["/V"] == expected[name]["/V"]
+    assert b"(Max) Tj" in widget_of(reader, text_field)["/AP"]["/N"].get_data()
+    assert "/V" not in template.reader.get_fields()[text_field]
+
+
+@pytest.mark.parametrize(
+    "pdf_path, stream",
+    [(BG_PDF, False), ("pdfs/anlage_vm.pdf", True)],
+)
+def test_incremental_fill_keeps_the_xref_format(pdf_path, stream):
+    template = load_pdf_template(pdf_path)
+    text_field = next(
+        name
+        for name, field in template.fill_plan.fields.items()
+        if field.field_type == "/Tx" and not field.widgets[0].states
+    )
+
+    filled = fill_pdf_bytes(template, {text_field: "Max"}, incremental=True)
+
+    # The new section is where the new startxref points
+    startxref = int(re.findall(rb"startxref\s+(\d+)", filled)[-1])
+    section = filled[startxref : startxref + 40]
+    if stream:
+        assert re.match(rb"\d+ 0 obj\s*<<", section) and b"/XRef" in filled[startxref:]
+    else:
+        assert section.startswith(b"xref")
+    reader = PdfReader(BytesIO(filled), strict=True)
+    assert reader.get_fields()[text_field]["/V"] == "Max"
+
+
+def test_incremental_fill_sets_button_appearance():
+    filled = fill_pdf_bytes(BG_PDF, {"chbxPersonMaennlich": "Ja"}, incremental=True)
+
+    assert widget_of(PdfReader(BytesIO(filled)), "chbxPersonMaennlich")["/AS"] == "/selektiert"
+
+
+def test_mmap_template_gives_the_same_document():
+    mapped = load_pdf_template(BG_PDF, use_mmap=True)
+    assert mapped is not load_pdf_template(BG_PDF, use_mmap=False)
+
+    values = {"txtfPersonVorname": "Max", "chbxPersonMaennlich": "Ja"}
+    assert fill_pdf_bytes(mapped, values, incremental=True) == fill_pdf_bytes(
+        load_pdf_template(BG_PDF, use_mmap=False), values, incremental=True
+    )
+
+
+def test_fill_pdf_incremental_appends_to_the_file(tmp_path):
+    pdf_path = tmp_path / "filled.pdf"
+    shutil.copy(BG_PDF, pdf_path)
+    original = pdf_path.read_bytes()
+    template = load_template(BG_TEMPLATE)
+
+    assert fillPDF(pdf_path, template, {"txtfPersonVorname": "Max"}, incremental=True)
+    # A second fill builds on the first update
+    assert fillPDF(pdf_path, template, {"txtfPersonNachname": "Muster"}, incremental=True)
+
+    assert pdf_path.read_bytes().startswith(original)
+    fields = PdfReader(pdf_path, strict=True).get_fields()
+    assert fields["txtfPersonVorname"]["/V"] == "Max"
+    assert fields["txtfPersonNachname"]["/V"] == "Muster"
+
+
+def test_text_appearance_is_generated():
+    filled = fill_pdf_bytes(BG_PDF, {"txtfPersonNachname": "Müller (Jr)"}, incremental=False)
+
+    appearance = widget_of(PdfReader(BytesIO(filled)), "txtfPersonNachname")["/AP"]["/N"]
+    assert b"(M\xfcller \\(Jr\\)) Tj" in appearance.get_data()
+    assert "/Roboto-Regular" in appearance["/Resources"]["/Font"]
+
+
+def test_comb_field_places_one_character_per_cell():
+    template = load_pdf_template("pdfs/afa_v2.pdf")
+    generator = template.fill_plan.appearances
+    (page, index), geometry = next(
+        (key, geometry) for key, geometry in generator.geometry.items() if geometry.comb
+    )
+    widget = next(
+        widget
+        for field in template.fill_plan.fields.values()
+        for widget in field.widgets
+        if (widget.page, widget.index) == (page, index)
+    )
+
+    data = generator.stream(widget, "12345", generator.template_resources).get_data()
+    assert data.count(b" Tj") == 5
+
+
+def test_flatten_removes_the_form():
+    filled = fill_pdf_bytes(
+        BG_PDF, {"txtfPersonVorname": "Maximilian", "chbxPersonMaennlich": "Ja"}, flatten=True
+    )
+
+    reader = PdfReader(BytesIO(filled), strict=True)
+    assert "/AcroForm" not in reader.trailer["/Root"]
+    assert not reader.get_fields()
+    assert all(
+        annotation.get_object().get("/Subtype") != "/Widget"
+        for page in reader.pages
+        for annotation in page.get("/Annots") or []
+    )
+    assert "Maximilian" in reader.pages[0].extract_text()
+
+
+def test_flatten_is_not_incremental():
+    with pytest.raises(ValueError):
+        fill_pdf_bytes(BG_PDF, {"txtfPersonVorname": "Max"}, incremental=True, flatten=True)
+
+
+def test_save_mode_defaults_follow_the_environment(monkeypatch):
+    monkeypatch.setenv("FILL_SAVE_MODE", "incremental")
+    assert resolve_save_mode() == (True, False)
+    assert resolve_save_mode(flatten=True) == (False, True)
+    monkeypatch.setenv("FILL_SAVE_MODE", "flatten")
+    assert resolve_save_mode() == (False, True)
+    assert resolve_save_mode(incremental=False, flatten=False) == (False, False)
+    with pytest.raises(ValueError):
+        resolve_save_mode(incremental=True)
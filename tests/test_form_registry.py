@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from talkdoc_core.form_registry import FormRegistry, PromptStore
+
+
+TEMPLATE = {
+    "txtfPersonVorname": {
+        "hidden_fields": {"FF": 0},
+        "/TU": "Vorname",
+        "type": "/Tx",
+        "page": 0,
+    }
+}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    (tmp_path / "template.json").write_text(json.dumps(TEMPLATE), encoding="utf-8")
+    mapping = {
+        "Test": {
+            "template_path": "template.json",
+            "pdf_path": "form.pdf",
+            "id": "test",
+        }
+    }
+    (tmp_path / "form_mapping.json").write_text(json.dumps(mapping), encoding="utf-8")
+    return FormRegistry(tmp_path / "form_mapping.json")
+
+
+def test_entry_is_cached_and_read_only(registry):
+    entry = registry.get("Test")
+
+    assert registry.get("Test") is entry
+    assert entry.form_id == "test"
+    assert "hidden_fields" not in entry.filtered_fields["txtfPersonVorname"]
+    with pytest.raises(AttributeError):
+        entry.template["txtfPersonVorname"].page = 1
+    with pytest.raises(TypeError):
+        entry.template["txtfPersonVorname"] = None
+
+
+def test_touch_without_change_keeps_entry(registry, tmp_path):
+    entry = registry.get("Test")
+    path = tmp_path / "template.json"
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert registry.get("Test") is entry
+
+
+def test_changed_template_is_reloaded(registry, tmp_path):
+    entry = registry.get("Test")
+    template = dict(TEMPLATE, txtfPersonNachname=TEMPLATE["txtfPersonVorname"])
+    (tmp_path / "template.json").write_text(json.dumps(template), encoding="utf-8")
+
+    reloaded = registry.get("Test")
+    assert reloaded is not entry
+    assert "txtfPersonNachname" in reloaded.template
+
+
+def test_system_prompt_date_is_rendered_per_call(registry):
+    entry = registry.get("Test")
+
+    assert "Today's date is 2024-01-01." in entry.system_prompt("2024-01-01")
+    assert "Today's date is 2024-01-02." in entry.system_prompt("2024-01-02")
+    assert entry.system_prompt().startswith(entry.system_prompt_body)
+
+
+def test_sessions_share_the_system_prompt(registry):
+    entry = registry.get("Test")
+
+    first = entry.system_messages("2024-01-01", language="English")
+    second = entry.system_messages("2024-01-01", language="English")
+    assert first is not second
+    assert all(a["content"] is b["content"] for a, b in zip(first, second))
+    assert entry.system_messages("2024-01-02")[0]["content"] != first[0]["content"]
+
+
+def test_prompt_store_evicts_the_least_recently_used():
+    store = PromptStore(max_entries=2)
+    store.share("a")
+    store.share("b")
+    store.share("a")
+    store.share("c")
+
+    assert list(store) == ["a", "c"]
@@ -0,0 +1,227 @@
+import asyncio
+import concurrent.futures
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from talkdoc_core import gptservice
+from talkdoc_core.gptservice import AsyncGPTService, GPTService, get_gpt_service
+
+
+class FakeModels:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    async def list(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+
+
+USAGE = {
+    "prompt_tokens": 2000,
+    "completion_tokens": 10,
+    "total_tokens": 2010,
+    "prompt_tokens_details": {"cached_tokens": 1536},
+}
+
+
+async def aiter_chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.params = None
+
+    async def create(self, **params):
+        self.params = params
+        if not params["stream"]:
+            return ChatCompletion.model_validate(
+                {
+                    "id": "1",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": params["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": "Hallo"},
+                        }
+                    ],
+                    "usage": USAGE,
+                }
+            )
+
+        chunk = {"id": "1", "object": "chat.completion.chunk", "created": 0, "model": params["model"]}
+        return aiter_chunks(
+            [
+                ChatCompletionChunk.model_validate(
+                    {**chunk, "choices": [{"index": 0, "delta": {"content": "Hallo"}}]}
+                ),
+                ChatCompletionChunk.model_validate({**chunk, "choices": [], "usage": USAGE}),
+            ]
+        )
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.models = FakeModels(error)
+        self.chat = type("FakeChat", (), {"completions": FakeCompletions()})()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    gptservice._api_key_status.clear()
+    gptservice._services.clear()
+    yield
+    gptservice._api_key_status.clear()
+    gptservice._services.clear()
+
+
+def test_service_is_reused_per_key():
+    assert get_gpt_service("sk-a") is get_gpt_service("sk-a")
+    assert get_gpt_service("sk-a") is not get_gpt_service("sk-b")
+
+
+def test_valid_key_is_checked_once():
+    gpt = get_gpt_service("sk-valid")
+    gpt.client = FakeClient()
+
+    assert gpt.check_openai_api_key()
+    assert gpt.check_openai_api_key()
+    assert gpt.client.models.calls == 1
+
+
+def test_invalid_key_is_cached_with_short_ttl():
+    request = httpx.Request("GET", "https://api.openai.com/v1/models")
+    error = openai.AuthenticationError(
+        "invalid", response=httpx.Response(401, request=request), body=None
+    )
+    gpt = get_gpt_service("sk-invalid")
+    gpt.client = FakeClient(error)
+
+    assert not gpt.check_openai_api_key(invalid_ttl=0)
+    assert not gpt.check_openai_api_key()
+    assert gpt.client.models.calls == 2
+
+    assert not gpt.check_openai_api_key()
+    assert gpt.client.models.calls == 2
+
+
+def test_cached_tokens_are_reported():
+    gpt = get_gpt_service("sk-usage")
+    gpt.client = FakeClient()
+
+    assert gpt.chat([], stream=False) == "Hallo"
+    chunks = list(gpt.chat([]))
+
+    assert [c.choices[0].delta.content for c in chunks] == ["Hallo"]
+    assert gpt.client.chat.completions.params["stream_options"] == {"include_usage": True}
+    assert gpt.usage.as_dict() == {
+        "requests": 2,
+        "prompt_tokens": 4000,
+        "cached_tokens": 3072,
+        "completion_tokens": 20,
+        "cache_hit_rate": 0.768,
+    }
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError(
+        "rate limited", response=httpx.Response(429, request=request), body=None
+    )
+
+
+class FlakyCompletions(FakeCompletions):
+    def __init__(self, errors, delay=0.0):
+        super().__init__()
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def create(self, **params):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super().create(**params)
+
+
+def flaky_service(errors, delay=0.0, **kwargs):
+    service = AsyncGPTService("sk-test", **kwargs)
+    service.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=FlakyCompletions(errors, delay))
+    )
+    return service
+
+
+def test_retries_rate_limits(monkeypatch):
+    monkeypatch.setattr(gptservice, "retry_delay", lambda attempt, error=None: 0)
+    service = flaky_service([rate_limit_error(), rate_limit_error()])
+
+    assert asyncio.run(service.chat([], stream=False)) == "Hallo"
+    assert service.client.chat.completions.calls == 3
+
+    service = flaky_service([rate_limit_error()] * 3, max_retries=2)
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(service.chat([], stream=False))
+    assert service.client.chat.completions.calls == 3
+
+    service = flaky_service([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        asyncio.run(service.chat([], stream=False))
+    assert service.client.chat.completions.calls == 1
+
+
+def test_retry_delay_is_jittered_and_respects_retry_after():
+    delays = {gptservice.retry_delay(3) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(0 <= d <= gptservice.RETRY_BASE_DELAY * 8 for d in delays)
+
+    error = rate_limit_error()
+    error.response.headers["retry-after"] = "2"
+    assert gptservice.retry_delay(0, error) == 2.0
+
+
+def test_calls_run_concurrently_and_can_be_cancelled():
+    service = flaky_service([], delay=0.2)
+
+    async def many_calls():
+        return await asyncio.gather(*(service.chat([], stream=False) for _ in range(20)))
+
+    start = time.perf_counter()
+    assert asyncio.run(many_calls()) == ["Hallo"] * 20
+    assert time.perf_counter() - start < 1
+
+    slow = flaky_service([], delay=10)
+
+    async def cancel_call():
+        task = asyncio.create_task(slow.chat([], stream=False))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel_call())
+    time.sleep(0.05)
+    assert slow.client.chat.completions.cancelled
+
+    sync = GPTService("sk-test")
+    sync.client = flaky_service([], delay=10).client
+    with pytest.raises(concurrent.futures.TimeoutError):
+        gptservice.run_sync(sync.aservice.chat([], stream=False), timeout=0.1)
+    time.sleep(0.05)
+    assert sync.client.chat.completions.cancelled
@@ -0,0 +1,78 @@
+import threading
+
+from talkdoc_core.form_registry import get_form_registry
+from talkdoc_core.gptservice import GPTService
+from talkdoc_core.greetings import GreetingCache, greeting_messages
+
+
+class GreetingGPT(GPTService):
+    def __init__(self):
+        super().__init__("sk-test")
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def chat(self, messages, model="gpt-4.1", stream=True, json_mode=False):
+        with self.lock:
+            self.calls.append(messages)
+        language = messages[-1]["content"] if len(messages) > 1 else "Deutsch"
+        return f"Hallo ({language[:30]})"
+
+
+def forms():
+    registry = get_form_registry("form_mapping.json")
+    return [registry.get(name) for name in registry.forms()]
+
+
+def test_greeting_is_generated_once_per_form_and_language():
+    gpt = GreetingGPT()
+    cache = GreetingCache()
+    form = forms()[0]
+
+    assert cache.generate(gpt, form) == cache.generate(gpt, form)
+    english = cache.generate(gpt, form, "Englisch")
+
+    assert "Englisch" in english
+    assert len(gpt.calls) == 2
+    assert gpt.calls[1][-1]["role"] == "system"
+    assert cache.get(forms()[1]) is None
+
+
+def test_greetings_expire():
+    gpt = GreetingGPT()
+    cache = GreetingCache(ttl=0)
+    form = forms()[0]
+
+    cache.put(form, "Hallo")
+    assert cache.get(form) is None
+    cache.generate(gpt, form)
+    cache.generate(gpt, form)
+    assert len(gpt.calls) == 2
+
+
+def test_pregenerate_all_forms_and_languages_once():
+    gpt = GreetingGPT()
+    cache = GreetingCache()
+    all_forms = forms()
+
+    futures = cache.pregenerate_once(gpt, all_forms, [None, "Englisch"])
+    assert all(f.result() for f in futures)
+    assert cache.pregenerate_once(gpt, all_forms, [None, "Englisch"]) == []
+    assert cache.pregenerate(gpt, all_forms, [None, "Englisch"]) == []
+
+    assert len(gpt.calls) == 2 * len(all_forms)
+    assert all(cache.get(form, "Englisch") for form in all_forms)
+
+
+def test_scoped_greetings_are_cached_apart():
+    cache = GreetingCache()
+    gpt = GreetingGPT()
+    form = forms()[0]
+
+    full = cache.generate(gpt, form)
+    cache.generate(gpt, form, scoped=True)
+
+    assert len(gpt.calls) == 2
+    assert cache.get(form) == full
+    # The scoped greeting sees the first section like a streamed one
+    assert gpt.calls[1] == greeting_messages(form, scoped=True)
+    assert gpt.calls[1][-1] == form.sections.message({})
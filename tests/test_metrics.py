@@ -0,0 +1,115 @@
+import json
+import threading
+
+import pytest
+
+from talkdoc_core import metrics
+from talkdoc_core.gptservice import GPTService
+from talkdoc_core.pdf_ops import PdfTemplate, fill_pdf_bytes
+from talkdoc_core.stub_server import StubConfig, StubServer
+
+
+@pytest.fixture
+def enabled_metrics(tmp_path):
+    metrics.reset()
+    metrics.enable(jsonl_path=tmp_path / "metrics.jsonl")
+    yield tmp_path / "metrics.jsonl"
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.reset()
+    with metrics.span("work") as span:
+        span.set(cache="hit")
+    metrics.inc("calls_total")
+
+    assert span is metrics.NOOP_SPAN
+    assert metrics.snapshot() == {"histograms": {}, "counters": {}}
+
+
+def test_prometheus_and_jsonl_export(enabled_metrics, tmp_path):
+    with metrics.span("work", stage="fill"):
+        pass
+    metrics.observe("work", 3, stage="fill")
+    metrics.inc("calls_total", 2, model="gpt-4.1")
+    with pytest.raises(ValueError):
+        with metrics.span("work", stage="write"):
+            raise ValueError
+
+    text = metrics.to_prometheus()
+    assert "# TYPE work_seconds histogram" in text
+    assert 'work_seconds_bucket{stage="fill",le="0.005"} 1' in text
+    assert 'work_seconds_bucket{stage="fill",le="+Inf"} 2' in text
+    assert 'work_seconds_count{stage="fill"} 2' in text
+    assert 'work_seconds_count{error="ValueError",stage="write"} 1' in text
+    assert '# TYPE calls_total counter\ncalls_total{model="gpt-4.1"} 2' in text
+
+    metrics.write_prometheus(tmp_path / "metrics.prom")
+    assert (tmp_path / "metrics.prom").read_text(encoding="utf-8") == text
+
+    records = [json.loads(line) for line in enabled_metrics.read_text(encoding="utf-8").splitlines()]
+    assert [r["name"] for r in records] == ["work_seconds", "work_seconds", "calls_total", "work_seconds"]
+    assert records[1]["value"] == 3 and records[1]["stage"] == "fill"
+
+
+def test_request_path_is_instrumented(enabled_metrics):
+    with StubServer(StubConfig(latency=0.05)) as server:
+        gpt = GPTService("sk-test", base_url=server.base_url)
+        gpt.chat([{"role": "user", "content": "Hallo"}], stream=False)
+        list(gpt.chat([{"role": "user", "content": "Hallo"}]))
+
+    with open("pdfs/anlage_vm.pdf", "rb") as pdf_file:
+        fill_pdf_bytes(PdfTemplate(pdf_file.read()), {})
+
+    snapshot = metrics.snapshot()
+    histograms = snapshot["histograms"]
+    assert histograms['gpt_chat_seconds{json_mode="False",model="gpt-4.1",stream="False"}']["count"] == 1
+    assert histograms['gpt_chat_seconds{json_mode="False",model="gpt-4.1",stream="True"}']["count"] == 1
+    assert histograms['gpt_time_to_first_token_seconds{model="gpt-4.1"}']["sum"] >= 0.05
+    assert snapshot["counters"]['gpt_tokens_total{kind="completion",model="gpt-4.1"}'] > 0
+    for stage in ("clone", "fill", "write"):
+        assert histograms[f'pdf_ops_seconds{{op="fill",stage="{stage}"}}']["count"] == 1
+    assert histograms['pdf_ops_seconds{op="template",stage="parse"}']["count"] == 1
+
+
+def test_stopped_and_failed_streams_are_timed(enabled_metrics):
+    with StubServer(StubConfig(token_rate=200)) as server:
+        gpt = GPTService("sk-test", base_url=server.base_url, max_retries=0)
+        stream = gpt.chat([{"role": "user", "content": "Hallo"}])
+        next(stream)
+        # The caller stops reading, e.g. a closed browser tab
+        stream.close()
+
+    with StubServer(StubConfig(error_rate=1.0)) as server:
+        gpt = GPTService("sk-test", base_url=server.base_url, max_retries=0)
+        with pytest.raises(Exception):
+            gpt.chat([{"role": "user", "content": "Hallo"}])
+
+    histograms = metrics.snapshot()["histograms"]
+    labels = 'json_mode="False",model="gpt-4.1",stream="True"'
+    assert histograms[f'gpt_chat_seconds{{error="cancelled",{labels}}}']["count"] == 1
+    assert histograms[f'gpt_chat_seconds{{error="RateLimitError",{labels}}}']["count"] == 1
+
+
+def test_concurrent_prometheus_exports(enabled_metrics, tmp_path):
+    metrics.inc("calls_total")
+    path = tmp_path / "metrics.prom"
+    errors = []
+
+    def export():
+        for _ in range(50):
+            try:
+                metrics.write_prometheus(path)
+            except OSError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=export) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert path.read_text(encoding="utf-8") == metrics.to_prometheus()
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import sys
+
+from talkdoc_core.prompts import (
+    CompactFields,
+    filter_json_fields,
+    get_chat_history_to_json_prompt,
+    get_incremental_extraction_prompt,
+    get_system_prompt_body,
+    get_system_prompt_for_chat,
+)
+
+
+FIELDS = {
+    "txtfPersonVorname": {
+        "/TU": "Ausfüllfeld; A. Persönliche Daten > 1 Vorname; Vorname laut Ausweis.",
+        "type": "/Tx",
+        "page": 0,
+        "hidden_fields": {"FF": 0},
+    },
+    "txtfPersonNachname": {
+        "/TU": "Ausfüllfeld; A. Persönliche Daten > 2 Nachname; Nachname laut Ausweis.",
+        "type": "/Tx",
+        "page": 0,
+    },
+    "chbxKonto": {"/TU": "Keine Bankverbindung\nvorhanden", "type": "/Btn", "page": 1},
+}
+
+MESSAGES = [
+    {"role": "system", "content": "system"},
+    {"role": "user", "content": "Ich heiße Max"},
+    {"role": "assistant", "content": "Danke"},
+]
+
+
+def test_compact_fields_encoding():
+    fields = CompactFields(FIELDS)
+
+    assert fields.text.splitlines() == [
+        '{1}="Ausfüllfeld; A. Persönliche Daten > "',
+        "## Seite 0",
+        "f1|T|{1}1 Vorname; Vorname laut Ausweis.",
+        "f2|T|{1}2 Nachname; Nachname laut Ausweis.",
+        "## Seite 1",
+        "f3|B|Keine Bankverbindung vorhanden",
+    ]
+    assert fields.decode({"f1": "Max", "f3": "Ja", "chbxKonto": "Nein"}) == {
+        "txtfPersonVorname": "Max",
+        "chbxKonto": "Nein",
+    }
+    assert fields.encode_values({"txtfPersonNachname": "Muster"}) == {"f2": "Muster"}
+
+
+def test_prompts_use_the_compact_field_list():
+    fields = CompactFields(FIELDS)
+
+    chat_prompt = get_system_prompt_body(FIELDS)
+    extraction_prompt = get_chat_history_to_json_prompt(MESSAGES, fields)
+    incremental_prompt = get_incremental_extraction_prompt(
+        MESSAGES, fields, {"txtfPersonVorname": "Max"}
+    )
+
+    for prompt in (chat_prompt, extraction_prompt, incremental_prompt):
+        assert fields.text in prompt
+        assert "hidden_fields" not in prompt
+    assert "'f1': 'Max'" in incremental_prompt
+
+
+def test_json_encoding_keeps_the_template_dict():
+    prompt = get_chat_history_to_json_prompt(MESSAGES, FIELDS)
+
+    assert str(filter_json_fields(FIELDS)) in prompt
+    assert str(filter_json_fields(FIELDS)) in get_system_prompt_body(FIELDS, "json")
+
+
+def test_prompt_tokens_script():
+    output = subprocess.run(
+        [sys.executable, "scripts/prompt_tokens.py", "--json"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": "."},
+    ).stdout
+
+    report = json.loads(output)
+    assert report
+    assert all(row["compact"] < row["json"] for row in report)
+
+
+def test_volatile_parts_come_last():
+    fields = CompactFields(FIELDS)
+    later_messages = MESSAGES[:2] + [{"role": "user", "content": "Nachname Muster"}, MESSAGES[2]]
+
+    first = get_chat_history_to_json_prompt(MESSAGES, fields, today="2024-01-01")
+    second = get_chat_history_to_json_prompt(later_messages, fields, today="2024-01-02")
+    prefix = first[: first.index("Today's date is")]
+
+    assert "Today's date is 2024-01-01." in first
+    assert second.startswith(prefix)
+    assert prefix.endswith(f"{fields.text}\n            ]]></input_json>\n\n            ")
+    assert "Ich heiße Max" not in prefix
+
+    system_prompt = get_system_prompt_for_chat(FIELDS, today="2024-01-01")
+    assert system_prompt == get_system_prompt_body(FIELDS) + "\n\n        Today's date is 2024-01-01."
@@ -0,0 +1,148 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from talkdoc_core.gptservice import GPTService
+from talkdoc_core.response_cache import CacheMissError, ResponseCache, cache_key, main
+
+
+MESSAGES = [{"role": "user", "content": "Hallo"}]
+
+
+class CountingCompletions:
+    """Counts the requests that reach the client."""
+
+    def __init__(self):
+        self.requests = 0
+
+    async def create(self, **params):
+        self.requests += 1
+        return ChatCompletion.model_validate(
+            {
+                "id": "1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": params["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": f"Antwort {self.requests}"},
+                    }
+                ],
+            }
+        )
+
+
+def counting_gpt(cache):
+    gpt = GPTService("sk-test", cache=cache)
+    gpt.client = SimpleNamespace(chat=SimpleNamespace(completions=CountingCompletions()))
+    return gpt
+
+
+def test_cache_key():
+    key = cache_key("gpt-4.1", MESSAGES, {"type": "json_object"})
+
+    assert key == cache_key("gpt-4.1", [dict(MESSAGES[0])], {"type": "json_object"})
+    assert key != cache_key("gpt-4.1", MESSAGES)
+    assert key != cache_key("gpt-4.1-mini", MESSAGES, {"type": "json_object"})
+
+
+def test_memory_lru():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats.as_dict() == {
+        "memory_hits": 2,
+        "disk_hits": 0,
+        "misses": 1,
+        "stores": 3,
+        "evictions": 0,
+        "expired": 0,
+        "hit_rate": 0.6667,
+    }
+
+
+def test_disk_tier_survives_restart_and_evicts_by_size(tmp_path):
+    cache = ResponseCache(max_entries=1, directory=tmp_path)
+    cache.put("aa11", "x" * 100)
+    cache.put("bb22", "y" * 100)
+
+    # Evicted from memory, still on disk
+    assert cache.get("aa11") == "x" * 100
+    assert ResponseCache(directory=tmp_path).get("bb22") == "y" * 100
+
+    small = ResponseCache(directory=tmp_path, max_disk_bytes=400)
+    small.put("cc33", "z" * 100)
+    assert small.stats.evictions == 1
+    assert small.get("cc33") == "z" * 100
+    assert len(list(tmp_path.glob("*/*.json"))) == 2
+
+
+def test_concurrent_writes_of_the_same_key(tmp_path):
+    caches = [ResponseCache(directory=tmp_path) for _ in range(4)]
+    errors = []
+
+    def write(cache, text):
+        for _ in range(50):
+            try:
+                cache.put("dd44", text)
+            except OSError as e:
+                errors.append(e)
+
+    threads = [
+        threading.Thread(target=write, args=(cache, c * 100)) for cache, c in zip(caches, "abcd")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert ResponseCache(directory=tmp_path).get("dd44") in {c * 100 for c in "abcd"}
+    assert list(tmp_path.glob("*/*.tmp")) == []
+
+
+def test_replay_serves_recorded_responses_only(tmp_path):
+    recorder = counting_gpt(ResponseCache(directory=tmp_path))
+    assert recorder.chat(MESSAGES, stream=False, json_mode=True) == "Antwort 1"
+    assert recorder.chat(MESSAGES, stream=False, json_mode=True) == "Antwort 1"
+    assert recorder.client.chat.completions.requests == 1
+
+    replay = counting_gpt(ResponseCache(directory=tmp_path, replay=True))
+    assert replay.chat(MESSAGES, stream=False, json_mode=True) == "Antwort 1"
+    with pytest.raises(CacheMissError):
+        replay.chat(MESSAGES, stream=False)
+    assert replay.client.chat.completions.requests == 0
+
+
+def test_disk_entries_expire(tmp_path):
+    cache = ResponseCache(directory=tmp_path, disk_ttl=3600)
+    cache.put("aa11", "IBAN DE89 3704 0044 0532 0130 00")
+    path = next(tmp_path.glob("*/*.json"))
+    entry = json.loads(path.read_text(encoding="utf-8"))
+    entry["created"] -= 7200
+    path.write_text(json.dumps(entry), encoding="utf-8")
+
+    # A new process does not serve it and deletes it on open
+    assert ResponseCache(directory=tmp_path, disk_ttl=7300).get("aa11") is not None
+    assert ResponseCache(directory=tmp_path, disk_ttl=3600).get("aa11") is None
+    assert not path.exists()
+    # Recorded responses stay valid for replay
+    cache.put("bb22", "x")
+    assert ResponseCache(directory=tmp_path, replay=True, disk_ttl=0).get("bb22") == "x"
+
+
+def test_purge_all(tmp_path):
+    ResponseCache(directory=tmp_path).put("aa11", "x")
+
+    assert main([str(tmp_path), "--all"]) == 0
+    assert list(tmp_path.glob("*/*.json")) == []
@@ -0,0 +1,74 @@
+import json
+
+from talkdoc_core.prompts import get_sectioned_system_prompt_body, get_system_prompt_body
+from talkdoc_core.sections import FormSections
+
+
+def field(label, page, field_type="/Tx"):
+    return {"/TU": label, "type": field_type, "page": page}
+
+
+FIELDS = {
+    "txtfPersonVorname": field("Ausfüllfeld; A. Persönliche Daten > 1 Vorname", 0),
+    "txtfPersonNachname": field("Ausfüllfeld; A. Persönliche Daten > 2 Nachname", 0),
+    "txtfPersonGeburtsort": field("Ausfüllfeld; A. Persönliche Daten > 3 Geburtsort", 0),
+    "chbxKonto": field("Ankreuzfeld; B. Bankverbindung > Konto vorhanden", 1, "/Btn"),
+    "txtfIBAN": field("Ausfüllfeld; B. Bankverbindung > IBAN", 1),
+    "txtfDatum": field("Ausfüllfeld; C. Unterschrift > Datum", 2),
+}
+
+
+def test_sections_follow_the_template_order():
+    sections = FormSections(FIELDS, max_fields=3)
+
+    assert [s.fields for s in sections.sections] == [
+        ("txtfPersonVorname", "txtfPersonNachname", "txtfPersonGeburtsort"),
+        # Small runs are merged up to max_fields
+        ("chbxKonto", "txtfIBAN", "txtfDatum"),
+    ]
+    assert sections.sections[0].label == "Seite 0 – A. Persönliche Daten"
+    assert sections.sections[1].label == "Seiten 1, 2 – B. Bankverbindung"
+
+
+def test_large_pages_are_split_evenly():
+    fields = {f"txtf{i}": field(f"Feld {i}", 0) for i in range(7)}
+
+    assert [len(s.fields) for s in FormSections(fields, max_fields=3).sections] == [2, 2, 3]
+
+
+def test_current_section_follows_the_last_answer():
+    sections = FormSections(FIELDS, max_fields=3)
+
+    assert sections.current({}) == 0
+    assert sections.current({"txtfPersonVorname": "Max"}) == 0
+    # A skipped field does not hold the section back
+    assert sections.current({"txtfPersonVorname": "Max", "txtfPersonGeburtsort": "Köln"}) == 1
+    assert sections.current({"txtfDatum": "01.01.2025"}) == 1
+
+
+def test_message_carries_only_the_current_section():
+    sections = FormSections(FIELDS, max_fields=3)
+    message = sections.message({"txtfPersonVorname": "Max", "txtfPersonGeburtsort": "Köln"})
+
+    assert message["role"] == "system"
+    content = message["content"]
+    assert "2 von 6 Feldern beantwortet" in content
+    assert "1. Seite 0 – A. Persönliche Daten: 2/3 beantwortet\n" in content
+    assert "2. Seiten 1, 2 – B. Bankverbindung: 0/3 beantwortet ← aktuell" in content
+    # Aliases of the whole form
+    assert "f4|B|" in content and "f5|T|" in content
+    assert "f1|T|" not in content
+
+
+def test_scoped_prompt_stays_small_for_large_forms():
+    with open("form_templates/Antrag_auf_Einbürgerung_v3.json", "r", encoding="utf-8") as file:
+        template = json.load(file)
+    sections = FormSections(template)
+    names = list(template)
+
+    full = len(get_system_prompt_body(template))
+    scoped = len(get_sectioned_system_prompt_body()) + max(
+        len(sections.prompt({name: "x" for name in names[:answered]}))
+        for answered in range(0, len(names), 25)
+    )
+    assert scoped < full / 3
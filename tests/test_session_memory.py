@@ -0,0 +1,35 @@
+from talkdoc_core.agents import IncrementalExtractor
+from talkdoc_core.context import ConversationContext
+from talkdoc_core.form_registry import get_form_registry, get_prompt_store
+from talkdoc_core.session_memory import session_memory_report
+
+FORM = "Antrag auf Einbürgerung"
+
+
+def session(form, answers):
+    extractor = IncrementalExtractor.for_form(form)
+    extractor.values.update(answers)
+    return {
+        "form_dict": form.template,
+        "messages": form.system_messages(language="Deutsch")
+        + [{"role": "assistant", "content": "Hallo"}],
+        "extractor": extractor,
+        "context": ConversationContext(),
+    }
+
+
+def test_session_memory_scales_with_answers_not_the_template():
+    form = get_form_registry().get(FORM)
+    shared = (form, get_prompt_store())
+
+    empty = session_memory_report(session(form, {}), shared)
+    answered = session_memory_report(
+        session(form, {name: "Test" for name in list(form.template)[:50]}), shared
+    )
+
+    # The template, prompts and rules are shared, a session holds its answers
+    assert empty.total_own < 4 * 1024 < empty.shared / 100
+    assert empty.own["form_dict"] == 0
+    assert answered.own["extractor"] > empty.own["extractor"]
+    assert answered.shared == empty.shared
+    assert "KB shared" in answered.format()
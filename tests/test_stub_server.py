@@ -0,0 +1,76 @@
+import json
+import time
+
+import openai
+import pytest
+
+from talkdoc_core.agents import get_json_from_chat_history_agent
+from talkdoc_core.gptservice import GPTService
+from talkdoc_core.stub_server import ScriptedResponse, StubConfig, StubServer
+
+
+FIELDS = {
+    "txtfPersonVorname": {"/TU": "Vorname", "type": "/Tx", "page": 0},
+    "chbxKonto": {"/TU": "Konto vorhanden", "type": "/Btn", "page": 1},
+}
+
+MESSAGES = [
+    {"role": "system", "content": "system"},
+    {"role": "user", "content": "Ich heiße Max"},
+    {"role": "assistant", "content": "Danke"},
+]
+
+
+@pytest.fixture
+def stub():
+    config = StubConfig(
+        responses=[ScriptedResponse({"f1": "Max"}, match="Wie ist Ihr Nachname?")]
+    )
+    with StubServer(config) as server:
+        yield server
+
+
+def test_chat_and_key_check_against_stub(stub):
+    gpt = GPTService("sk-test", base_url=stub.base_url)
+
+    assert gpt.check_openai_api_key()
+    assert gpt.chat(MESSAGES, stream=False).startswith("Hallo!")
+    assert json.loads(
+        gpt.chat([{"role": "user", "content": "Wie ist Ihr Nachname?"}], stream=False, json_mode=True)
+    ) == {"f1": "Max"}
+    assert gpt.usage.requests == 2
+
+
+def test_streaming_with_latency_and_token_rate(stub):
+    stub.config.latency = 0.2
+    stub.config.token_rate = 100
+    gpt = GPTService("sk-test", base_url=stub.base_url)
+
+    start = time.perf_counter()
+    chunks = gpt.chat(MESSAGES)
+    first = next(chunks)
+    first_token = time.perf_counter() - start
+    content = first.choices[0].delta.content + "".join(
+        c.choices[0].delta.content or "" for c in chunks
+    )
+
+    assert first_token >= 0.2
+    assert content.startswith("Hallo!")
+    assert gpt.usage.completion_tokens == len(content.split())
+
+
+def test_extraction_end_to_end(stub):
+    gpt = GPTService("sk-test", base_url=stub.base_url)
+
+    assert get_json_from_chat_history_agent(gpt, MESSAGES, FIELDS) == {
+        "txtfPersonVorname": "Test",
+        "chbxKonto": "Ja",
+    }
+
+
+def test_rate_limit_errors(stub):
+    stub.config.error_rate = 1.0
+    gpt = GPTService("sk-test", base_url=stub.base_url, max_retries=0)
+
+    with pytest.raises(openai.RateLimitError):
+        gpt.chat(MESSAGES, stream=False)
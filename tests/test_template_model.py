@@ -0,0 +1,96 @@
+import json
+import pickle
+import zlib
+
+import pytest
+
+from talkdoc_core.prompts import filter_json_fields, get_system_prompt_body
+from talkdoc_core.template_model import (
+    FieldFlag,
+    FormTemplate,
+    compile_template,
+    compiled_path,
+    load_template,
+)
+
+TEMPLATE_PATH = "form_templates/Antrag_auf_Einbürgerung_v3.json"
+
+TEMPLATE = {
+    "rbtnKind": {
+        "hidden_fields": {"FF": 49152, "on_state": "/0", "off_state": None},
+        "/TU": "Auswahl; Kind",
+        "type": "/Btn",
+        "page": 1,
+    },
+    "chbxKonto": {
+        "hidden_fields": {"FF": 0, "on_state": "Ja", "off_state": "/Off"},
+        "/TU": "Ankreuzfeld; Konto vorhanden",
+        "type": "/Btn",
+        "page": 0,
+    },
+    "txtfBemerkung": {
+        "hidden_fields": {"FF": 4096},
+        "/TU": "Ausfüllfeld; Bemerkung",
+        "type": "/Tx",
+        "page": 2,
+    },
+}
+
+
+def test_flags_and_states_are_decoded():
+    template = FormTemplate.from_json(TEMPLATE)
+
+    radio, checkbox, text = template.values()
+    assert radio.radio and FieldFlag.NO_TOGGLE_TO_OFF in radio.flags
+    assert (radio.button_state("Ja"), radio.button_state(" nein ")) == ("/0", "/1")
+    assert not checkbox.radio
+    assert (checkbox.button_state("on"), checkbox.button_state("Off")) == ("/Ja", "/Off")
+    assert checkbox.button_state("vielleicht") is None
+    assert text.multiline and text.page == 2
+    with pytest.raises(AttributeError):
+        text.page = 0
+
+
+def test_compiled_template_round_trip(tmp_path):
+    path = tmp_path / "template.json"
+    path.write_text(json.dumps(TEMPLATE), encoding="utf-8")
+    compile_template(path)
+
+    template = load_template(path)
+    assert compiled_path(path).exists()
+    assert template == FormTemplate.from_json(TEMPLATE)
+    assert [spec.name for spec in template.values()] == list(TEMPLATE)
+    assert template.source_hash is not None
+
+
+def test_stale_artifact_falls_back_to_json(tmp_path):
+    path = tmp_path / "template.json"
+    path.write_text(json.dumps(TEMPLATE), encoding="utf-8")
+    compile_template(path)
+
+    changed = {**TEMPLATE, "txtfOrt": {"/TU": "Ort", "type": "/Tx", "page": 0}}
+    path.write_text(json.dumps(changed), encoding="utf-8")
+    assert "txtfOrt" in load_template(path)
+
+    compiled_path(path).write_bytes(b"garbage")
+    assert list(load_template(path)) == list(changed)
+
+    # Truncated and incompatible pickles
+    compile_template(path)
+    artifact = compiled_path(path).read_bytes()
+    compiled_path(path).write_bytes(zlib.compress(zlib.decompress(artifact)[:-20]))
+    assert list(load_template(path)) == list(changed)
+    compiled_path(path).write_bytes(zlib.compress(pickle.dumps({"format": 1})))
+    assert list(load_template(path)) == list(changed)
+
+
+def test_prompts_are_unchanged_by_the_model():
+    with open(TEMPLATE_PATH, "r", encoding="utf-8") as file:
+        raw = json.load(file)
+    template = load_template(TEMPLATE_PATH)
+
+    assert filter_json_fields(template) == {
+        k: {key: v for key, v in field.items() if key != "hidden_fields"}
+        for k, field in raw.items()
+    }
+    assert get_system_prompt_body(template) == get_system_prompt_body(raw)